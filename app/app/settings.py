@@ -42,18 +42,43 @@ INSTALLED_APPS = [
     'core',
     'user',
     'recipe',
+    'batch',
 ]
 
+# The rest of the stack depends on the request path, see
+# MIDDLEWARE_PROFILES below
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.MiddlewareProfileMiddleware',
 ]
 
+# The token authenticated JSON API needs no sessions, CSRF, messages or
+# frame options, so it skips those middleware. Everything else, the
+# admin included, runs the full default stack.
+MIDDLEWARE_PROFILES = {
+    'default': [
+        'core.middleware.ReplicaRoutingMiddleware',
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.common.CommonMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    ],
+    'api': [
+        'core.middleware.CompressionMiddleware',
+        'core.middleware.ReplicaRoutingMiddleware',
+        'django.middleware.common.CommonMiddleware',
+    ],
+}
+MIDDLEWARE_PROFILE_ROUTES = (
+    ('/api/', 'api'),
+)
+
+# API responses at least this many bytes long are gzip or, when the brotli
+# package is installed, brotli compressed
+COMPRESSION_MIN_SIZE = 1024
+
 ROOT_URLCONF = 'app.urls'
 
 TEMPLATES = [
@@ -88,6 +113,64 @@ DATABASES = {
     }
 }
 
+# Cache shared by every process, e.g. CACHE_LOCATION=cache:11211 for a
+# memcached server. Shard assignments, throttle buckets and replica pins are
+# kept there; without it each process has a local cache of its own.
+if os.environ.get('CACHE_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ['CACHE_LOCATION'].split(','),
+        }
+    }
+
+# Shards for user owned data, e.g. DB_SHARD_NAMES=app_shard1,app_shard2.
+# Each user is assigned to one shard and all of their tags, ingredients and
+# recipes live there. Run prepare_shards once after migrating them. With
+# DB_SHARD_ENGINE=sqlite the names are SQLite database files instead.
+DATABASE_SHARDS = []
+for index, name in enumerate(
+    filter(None, os.environ.get('DB_SHARD_NAMES', '').split(','))
+):
+    alias = f'shard_{index}'
+    if os.environ.get('DB_SHARD_ENGINE') == 'sqlite':
+        DATABASES[alias] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, name),
+        }
+    else:
+        DATABASES[alias] = dict(DATABASES['default'], NAME=name)
+    DATABASE_SHARDS.append(alias)
+
+SHARD_ID_BLOCK = 100000000
+# Processes cache shard assignments for this long. Moving a user waits it
+# out before copying and again before deleting the copied rows.
+SHARD_MAP_CACHE_SECONDS = 300
+
+# Read replicas, e.g. DB_REPLICA_HOSTS=replica1,replica2. Safe requests read
+# from a healthy replica unless the client wrote in the last
+# REPLICA_PIN_SECONDS.
+DATABASE_REPLICAS = []
+for index, host in enumerate(
+    filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))
+):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dict(
+        DATABASES['default'],
+        HOST=host,
+        TEST={'MIRROR': 'default'},
+    )
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = [
+    'core.routers.ShardRouter',
+    'core.routers.ReplicaRouter',
+]
+
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+REPLICA_PIN_COOKIE = 'db_pin'
+REPLICA_HEALTH_CHECK_INTERVAL = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -131,4 +214,161 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
-AUTH_USER_MODEL = 'core.User'
\ No newline at end of file
+# Uploads are stored once per distinct content under a sha256 name, set
+# DEFAULT_FILE_STORAGE to django.core.files.storage.FileSystemStorage to
+# keep the uuid names from upload_to, or to
+# core.storage.ContentAddressedObjectStorage to keep them in the object
+# store configured below
+DEFAULT_FILE_STORAGE = os.environ.get(
+    'DEFAULT_FILE_STORAGE',
+    'core.storage.ContentAddressedStorage'
+)
+
+AUTH_USER_MODEL = 'core.User'
+
+# FastJSONRenderer and FastJSONParser use orjson when it is installed and
+# fall back to the stdlib json module otherwise
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'core.throttling.TokenBucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'read': '1000/min',
+        'write': '300/min',
+        'upload': '60/min',
+    },
+}
+
+# Each process leases 1/THROTTLE_LEASE_DIVISOR of a throttle budget at a
+# time from the shared cache
+THROTTLE_LEASE_DIVISOR = 10
+
+
+# Background jobs, run with `manage.py run_worker`
+
+JOB_LOCK_TIMEOUT = 15 * 60
+# running jobs refresh their lock this often, well within JOB_LOCK_TIMEOUT
+JOB_HEARTBEAT_INTERVAL = 60
+JOB_RETRY_BASE_DELAY = 10
+JOB_RETRY_MAX_DELAY = 60 * 60
+
+
+# POST /api/batch/ runs up to BATCH_MAX_REQUESTS sub-requests against these
+# paths, running consecutive reads on up to BATCH_MAX_WORKERS threads
+
+BATCH_ALLOWED_PATHS = ('/api/recipe/', '/api/user/')
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_WORKERS = 4
+
+
+# Responses to requests sent with an Idempotency-Key header are replayed
+# for IDEMPOTENCY_KEY_TTL seconds. A duplicate of a request still running
+# waits up to IDEMPOTENCY_WAIT_SECONDS for it, and a running request is
+# presumed dead after IDEMPOTENCY_LOCK_TIMEOUT seconds.
+
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_WAIT_SECONDS = 10
+IDEMPOTENCY_LOCK_TIMEOUT = 5 * 60
+
+
+# Most changes GET /api/recipe/sync/ returns per page
+SYNC_PAGE_SIZE = 500
+# `manage.py prune_changes` drops change log entries older than this many
+# seconds, clients with an older cursor are sent back to a full snapshot
+SYNC_CHANGE_RETENTION = 30 * 24 * 60 * 60
+
+
+# `manage.py run_event_stream` serves GET /api/recipe/events/ as server-sent
+# events. Idle streams get a comment every EVENT_STREAM_HEARTBEAT seconds,
+# and a stream more than EVENT_STREAM_MAX_BACKLOG events behind is closed
+# so its client resumes from its Last-Event-ID. Without PostgreSQL's NOTIFY
+# the change log is polled every EVENT_STREAM_POLL_INTERVAL seconds.
+
+EVENT_STREAM_HEARTBEAT = 15
+EVENT_STREAM_MAX_BACKLOG = 1000
+EVENT_STREAM_POLL_INTERVAL = 1
+
+
+# Reads on views using LatencyBudgetMixin fail with a 503 once their
+# queries run for longer than the view's latency_budget, or
+# DEFAULT_LATENCY_BUDGET seconds when it has none
+
+DEFAULT_LATENCY_BUDGET = 5
+
+# Most ids a ?tags= or ?ingredients= recipe filter may list
+FILTER_MAX_IDS = 50
+
+
+# GET /api/recipe/recipes/<id>/image/ serves resized copies of a recipe's
+# image. Only the sizes, DPRs, formats and qualities listed here are
+# accepted, less any format Pillow was built without. Copies are rendered on IMAGE_RESIZE_WORKERS threads and kept
+# in an LRU disk cache of at most IMAGE_CACHE_MAX_BYTES.
+
+IMAGE_VARIANT_SIZES = (64, 128, 256, 320, 480, 640, 800, 1024, 1280)
+IMAGE_VARIANT_DPRS = (1, 2, 3)
+IMAGE_VARIANT_FORMATS = ('jpeg', 'png', 'webp')
+IMAGE_VARIANT_QUALITIES = (50, 70, 85)
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', '/vol/web/cache/images')
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+IMAGE_RESIZE_WORKERS = 4
+IMAGE_RESIZE_TIMEOUT = 10
+
+
+# core.storage.ObjectStorage keeps files in OBJECT_STORAGE_BACKEND, either
+# core.objectstore.S3ObjectStore for a bucket of S3 or an S3 compatible
+# service (needs boto3), or core.objectstore.LocalObjectStore, a stand-in
+# keeping objects below MEDIA_ROOT. Files over OBJECT_STORAGE_PART_SIZE are
+# uploaded in parts on OBJECT_STORAGE_UPLOAD_WORKERS threads, and clients
+# download through presigned URLs valid for OBJECT_STORAGE_URL_EXPIRY
+# seconds.
+
+OBJECT_STORAGE_BACKEND = os.environ.get(
+    'OBJECT_STORAGE_BACKEND',
+    'core.objectstore.LocalObjectStore'
+)
+OBJECT_STORAGE_BUCKET = os.environ.get('OBJECT_STORAGE_BUCKET', '')
+OBJECT_STORAGE_ENDPOINT_URL = os.environ.get('OBJECT_STORAGE_ENDPOINT_URL')
+OBJECT_STORAGE_REGION = os.environ.get('OBJECT_STORAGE_REGION')
+OBJECT_STORAGE_ACCESS_KEY = os.environ.get('OBJECT_STORAGE_ACCESS_KEY')
+OBJECT_STORAGE_SECRET_KEY = os.environ.get('OBJECT_STORAGE_SECRET_KEY')
+OBJECT_STORAGE_MAX_CONNECTIONS = 32
+OBJECT_STORAGE_PART_SIZE = 8 * 1024 * 1024
+OBJECT_STORAGE_UPLOAD_WORKERS = 8
+OBJECT_STORAGE_URL_EXPIRY = 60 * 60
+
+
+# POST /api/recipe/recipes/<id>/image-upload/ hands out presigned URLs to
+# upload images of at most IMAGE_UPLOAD_MAX_BYTES straight to the object
+# store, valid for IMAGE_UPLOAD_URL_EXPIRY seconds
+
+IMAGE_UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+IMAGE_UPLOAD_URL_EXPIRY = 15 * 60
+
+
+# Most recipes POST /api/recipe/recipes/clone/ copies in one request
+RECIPE_CLONE_MAX = 1000
+
+
+# Public recipes are copied into the timelines of their author's followers
+# by background jobs, FEED_FANOUT_BATCH followers at a time, and timelines
+# keep their FEED_TIMELINE_LENGTH newest recipes. Recipes of authors with
+# more than FEED_FANOUT_MAX_FOLLOWERS followers are not copied but merged
+# into GET /api/recipe/feed/ as it is read, FEED_PAGE_SIZE at a time.
+
+FEED_TIMELINE_LENGTH = 800
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+FEED_FANOUT_BATCH = 1000
+FEED_PAGE_SIZE = 50
+
+
+# Most recipes POST /api/recipe/recipes/shopping-list/ totals up at once
+SHOPPING_LIST_MAX_RECIPES = 500
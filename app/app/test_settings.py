@@ -0,0 +1,31 @@
+"""
+Django settings for running the tests, e.g.
+
+    python manage.py test --settings=app.test_settings
+"""
+
+from app.settings import *  # noqa: F401,F403
+from app.settings import DATABASES, DATABASE_REPLICAS, DATABASE_SHARDS
+
+
+# Without configured shards the tests get two in-memory SQLite shards, which
+# sharding tests switch on with override_settings(DATABASE_SHARDS=...)
+TEST_DATABASE_SHARDS = list(DATABASE_SHARDS)
+if not TEST_DATABASE_SHARDS:
+    for index in range(2):
+        alias = f'shard_{index}'
+        DATABASES[alias] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        }
+        TEST_DATABASE_SHARDS.append(alias)
+
+# Without configured replicas the tests get replica_0, a mirror of the
+# default database they read from with override_settings(DATABASE_REPLICAS=..)
+TEST_DATABASE_REPLICAS = list(DATABASE_REPLICAS)
+if not TEST_DATABASE_REPLICAS:
+    DATABASES['replica_0'] = dict(
+        DATABASES['default'],
+        TEST={'MIRROR': 'default'},
+    )
+    TEST_DATABASE_REPLICAS.append('replica_0')
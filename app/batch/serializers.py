@@ -0,0 +1,40 @@
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from rest_framework import serializers
+
+
+class BatchItemSerializer(serializers.Serializer):
+    """Serializes one sub-request of a batch"""
+    id = serializers.CharField(required=False, max_length=64)
+    method = serializers.ChoiceField(
+        choices=('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+    )
+    path = serializers.CharField(max_length=2048)
+    body = serializers.JSONField(required=False)
+
+    def validate_path(self, value):
+        if not urlsplit(value).path.startswith(
+            tuple(settings.BATCH_ALLOWED_PATHS)
+        ):
+            raise serializers.ValidationError(
+                f'Only paths under {", ".join(settings.BATCH_ALLOWED_PATHS)} '
+                f'can be batched.'
+            )
+
+        return value
+
+
+class BatchSerializer(serializers.Serializer):
+    """Serializes a list of sub-requests"""
+    requests = BatchItemSerializer(many=True, allow_empty=False)
+
+    def validate_requests(self, value):
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(
+                f'A batch holds at most {settings.BATCH_MAX_REQUESTS} '
+                f'requests.'
+            )
+
+        return value
@@ -0,0 +1,189 @@
+import io
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, \
+                        override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from PIL import Image
+
+from batch.views import plan
+from core.models import Recipe, Tag
+
+
+BATCH_URL = reverse('batch:batch')
+
+
+class BatchPlanTests(SimpleTestCase):
+
+    def test_reads_grouped_between_writes(self):
+        """consecutive GETs share a group, writes run alone"""
+        methods = ['GET', 'GET', 'POST', 'GET', 'DELETE', 'PATCH', 'GET']
+
+        groups = plan([{'method': method} for method in methods])
+
+        self.assertEqual(groups, [[0, 1], [2], [3], [4], [5], [6]])
+
+
+class PublicBatchApiTests(TestCase):
+
+    def test_login_required(self):
+        """batches need an authenticated user"""
+        response = APIClient().post(BATCH_URL, {'requests': []})
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateBatchApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123',
+            name='Test'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def batch(self, *requests):
+        return self.client.post(
+            BATCH_URL,
+            {'requests': list(requests)},
+            format='json'
+        )
+
+    def test_runs_requests_in_order(self):
+        """writes are visible to the reads after them"""
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        response = self.batch(
+            {'id': 'me', 'method': 'GET', 'path': '/api/user/me/'},
+            {'method': 'GET', 'path': '/api/recipe/tags/'},
+            {'method': 'POST', 'path': '/api/recipe/recipes/', 'body': {
+                'title': 'Soup',
+                'time_minutes': 5,
+                'price': '1.00',
+                'tag_names': ['Lunch'],
+            }},
+            {'method': 'GET', 'path': '/api/recipe/recipes/?tags=1'},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        me, tags, created, recipes = response.data
+        self.assertEqual(me['id'], 'me')
+        self.assertEqual(me['body']['email'], 'test@test.com')
+        self.assertEqual([tag['name'] for tag in tags['body']], ['Vegan'])
+        self.assertEqual(created['status'], status.HTTP_201_CREATED)
+        self.assertEqual(recipes['status'], status.HTTP_200_OK)
+        self.assertEqual(len(recipes['body']), 0)
+
+    def test_authenticates_once(self):
+        """the token is looked up for the batch, not per sub-request"""
+        with CaptureQueriesContext(connection) as queries:
+            self.batch(*[
+                {'method': 'GET', 'path': '/api/recipe/tags/'}
+                for _ in range(5)
+            ])
+
+        token_queries = [
+            query for query in queries
+            if 'authtoken_token' in query['sql']
+        ]
+        self.assertEqual(len(token_queries), 1)
+
+    def test_per_item_status(self):
+        """failed sub-requests report their own status"""
+        response = self.batch(
+            {'method': 'GET', 'path': '/api/recipe/nothing/'},
+            {'method': 'POST', 'path': '/api/recipe/tags/', 'body': {}},
+            {'method': 'GET', 'path': '/api/recipe/tags/'},
+        )
+
+        self.assertEqual(
+            [item['status'] for item in response.data],
+            [404, 400, 200]
+        )
+
+    @override_settings(
+        MEDIA_ROOT=tempfile.mkdtemp(),
+        IMAGE_CACHE_DIR=tempfile.mkdtemp()
+    )
+    def test_streaming_response_rejected_per_item(self):
+        """files cannot be batched, the other items still run"""
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            time_minutes=5,
+            price='1.00'
+        )
+        output = io.BytesIO()
+        Image.new('RGB', (40, 20), 'red').save(output, 'JPEG')
+        recipe.image.save('photo.jpg', ContentFile(output.getvalue()))
+
+        image_path = reverse('recipe:recipe-image', args=[recipe.id])
+        image_path += '?w=128'
+
+        response = self.batch(
+            {'method': 'GET', 'path': image_path},
+            {'method': 'GET', 'path': '/api/recipe/tags/'},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['status'] for item in response.data],
+            [406, 200]
+        )
+
+    def test_rejects_other_paths(self):
+        """only recipe and user API paths can be batched"""
+        response = self.batch({'method': 'GET', 'path': '/api/batch/'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(BATCH_MAX_REQUESTS=2)
+    def test_request_cap(self):
+        """batches over BATCH_MAX_REQUESTS are rejected"""
+        response = self.batch(*[
+            {'method': 'GET', 'path': '/api/recipe/tags/'}
+            for _ in range(3)
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ConcurrentBatchApiTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Tag.objects.create(user=self.user, name='Vegan')
+
+    @patch('batch.views.ThreadPoolExecutor', wraps=ThreadPoolExecutor)
+    def test_reads_run_concurrently(self, executor):
+        """consecutive reads run on a thread pool"""
+        response = self.client.post(BATCH_URL, {'requests': [
+            {'method': 'GET', 'path': '/api/recipe/tags/'},
+            {'method': 'GET', 'path': '/api/user/me/'},
+        ]}, format='json')
+
+        executor.assert_called_once_with(max_workers=2)
+        self.assertEqual(
+            [item['status'] for item in response.data],
+            [200, 200]
+        )
+        self.assertEqual(response.data[0]['body'][0]['name'], 'Vegan')
@@ -0,0 +1,154 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+from rest_framework import status
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from batch.serializers import BatchSerializer
+
+
+logger = logging.getLogger(__name__)
+
+# request headers sub-requests inherit from the batch request
+INHERITED_META = (
+    'REMOTE_ADDR', 'SERVER_NAME', 'SERVER_PORT', 'SERVER_PROTOCOL',
+    'HTTP_HOST', 'HTTP_USER_AGENT', 'HTTP_ACCEPT_LANGUAGE',
+    'HTTP_X_FORWARDED_FOR', 'wsgi.url_scheme',
+    'wsgi.errors', 'wsgi.version', 'wsgi.multithread',
+    'wsgi.multiprocess', 'wsgi.run_once',
+)
+
+
+def plan(items):
+    """splits items into groups run one after another
+
+    Consecutive GETs form one group and may run concurrently, every
+    write is a group of its own so it sees the effect of earlier items
+    and later items see its effect.
+    """
+    groups = []
+    for index, item in enumerate(items):
+        if item['method'] == 'GET' and groups and \
+                items[groups[-1][0]]['method'] == 'GET':
+            groups[-1].append(index)
+        else:
+            groups.append([index])
+
+    return groups
+
+
+def build_request(request, item):
+    """a Django request for a sub-request, authenticated as request.user"""
+    url = urlsplit(item['path'])
+    body = b''
+    if 'body' in item:
+        body = json.dumps(item['body']).encode()
+    environ = {
+        key: value for key, value in request.META.items()
+        if key in INHERITED_META
+    }
+    environ.update({
+        'REQUEST_METHOD': item['method'],
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+    })
+    sub_request = WSGIRequest(environ)
+    # DRF authenticates requests carrying these with ForcedAuthentication,
+    # so sub-requests skip the token lookup
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+
+    return sub_request
+
+
+class BatchView(APIView):
+    """Run several recipe and user API requests in one round trip"""
+    serializer_class = BatchSerializer
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def run(self, item):
+        """runs one sub-request and returns its result"""
+        result = {'status': status.HTTP_404_NOT_FOUND, 'body': None}
+        if 'id' in item:
+            result['id'] = item['id']
+        sub_request = build_request(self.request, item)
+        try:
+            match = resolve(sub_request.path_info)
+        except Resolver404:
+            return result
+        try:
+            response = match.func(sub_request, *match.args, **match.kwargs)
+        except Exception:
+            logger.exception('Batch item %s %s failed', item['method'],
+                             item['path'])
+            result['status'] = status.HTTP_500_INTERNAL_SERVER_ERROR
+            return result
+
+        if response.streaming:
+            # files are fetched on their own, they cannot go in a JSON body
+            response.close()
+            result['status'] = status.HTTP_406_NOT_ACCEPTABLE
+            result['body'] = {
+                'detail': 'Streaming responses cannot be batched.'
+            }
+            return result
+
+        result['status'] = response.status_code
+        if hasattr(response, 'data'):
+            result['body'] = response.data
+        elif response.content:
+            result['body'] = response.content.decode()
+        if response.has_header('Retry-After'):
+            result['retry_after'] = response['Retry-After']
+
+        return result
+
+    def run_in_thread(self, item):
+        try:
+            return self.run(item)
+        finally:
+            connections.close_all()
+
+    def can_run_concurrently(self):
+        """reads in other threads would not see this thread's transaction"""
+        return settings.BATCH_MAX_WORKERS > 1 and not any(
+            connection.in_atomic_block for connection in connections.all()
+        )
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['requests']
+
+        results = [None] * len(items)
+        concurrent = self.can_run_concurrently()
+        for group in plan(items):
+            if concurrent and len(group) > 1:
+                workers = min(len(group), settings.BATCH_MAX_WORKERS)
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    outcomes = pool.map(
+                        self.run_in_thread,
+                        [items[index] for index in group]
+                    )
+                    for index, result in zip(group, outcomes):
+                        results[index] = result
+            else:
+                for index in group:
+                    results[index] = self.run(items[index])
+
+        return Response(results)
@@ -1,5 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from django.utils.translation import gettext as _
 
 from core import models
@@ -25,7 +28,82 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class EstimatedCountPaginator(Paginator):
+    """Paginator that reads big unfiltered counts from planner statistics
+
+    On PostgreSQL an unfiltered changelist takes its count from
+    pg_class.reltuples instead of a COUNT(*) over the whole table.
+    """
+    exact_count_below = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE relname = %s',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.exact_count_below:
+                return row[0]
+
+        return super().count
+
+
+class IndexedSearchAdmin(admin.ModelAdmin):
+    """Admin whose search only runs lookups backed by an index
+
+    A numeric term matches the id, a term with an @ matches the owner's
+    email and anything else is a case sensitive prefix of the first
+    search field, which a plain db_index serves on PostgreSQL too.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('name',)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        if '@' in term:
+            return queryset.filter(user__email=term), False
+
+        prefix_lookup = f'{self.search_fields[0]}__startswith'
+
+        return queryset.filter(**{prefix_lookup: term}), False
+
+
+class TagAdmin(IndexedSearchAdmin):
+    list_display = ('name', 'user')
+
+
+class IngredientAdmin(IndexedSearchAdmin):
+    list_display = ('name', 'user')
+
+
+class RecipeIngredientInline(admin.TabularInline):
+    model = models.RecipeIngredient
+    autocomplete_fields = ('ingredient',)
+    extra = 1
+
+
+class RecipeAdmin(IndexedSearchAdmin):
+    list_display = ('title', 'user', 'time_minutes', 'price')
+    autocomplete_fields = ('tags',)
+    inlines = (RecipeIngredientInline,)
+    search_fields = ('title',)
+
+
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
-admin.site.register(models.Recipe)
+admin.site.register(models.Tag, TagAdmin)
+admin.site.register(models.Ingredient, IngredientAdmin)
+admin.site.register(models.Recipe, RecipeAdmin)
@@ -0,0 +1,129 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import F
+
+from core.models import Change, ChangeCounter, ImageBlob, Ingredient, \
+                        Recipe, Tag
+from core.sharding import OWNED_MODELS, shard_for_user, _cache_key
+
+
+# models whose deletes go to the owner's change log
+SYNCED_MODELS = (Tag, Ingredient, Recipe)
+# the change log goes last, after every delete was written to it
+CHANGE_LOG_MODELS = (Change, ChangeCounter)
+
+
+def _dependents(model):
+    """(through model, column) pairs of link tables pointing at model"""
+    return [
+        (owned, field.column)
+        for owned, _ in OWNED_MODELS
+        if owned._meta.auto_created
+        for field in owned._meta.fields
+        if field.remote_field and field.remote_field.model is model
+    ]
+
+
+def _delete_rows(model, alias, column, values):
+    """deletes the rows whose column is in values without loading them"""
+    connection = connections[alias]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE {connection.ops.quote_name(column)} '
+            f'IN ({", ".join(["%s"] * len(values))})',
+            list(values)
+        )
+        return cursor.rowcount
+
+
+def release_images(names):
+    """drops one reference per name and queues the files for removal"""
+    from core.tasks import delete_files
+
+    names = [name for name in names if name]
+    if not names:
+        return
+    for name, count in Counter(names).items():
+        ImageBlob.objects.filter(name=name).update(
+            ref_count=F('ref_count') - count
+        )
+    delete_files.enqueue({'names': sorted(set(names))})
+
+
+def _deletion_order():
+    """owned models in the order their rows are deleted"""
+    models = [
+        (model, lookup) for model, lookup in reversed(OWNED_MODELS)
+        if not model._meta.auto_created
+    ]
+
+    return sorted(models, key=lambda item: item[0] in CHANGE_LOG_MODELS)
+
+
+def delete_user(user_id, batch_size=1000, progress=None):
+    """deletes a user and every row they own in bounded batches
+
+    Django's delete() collects every related row into memory and deletes
+    them in one transaction. Here each owned model is instead walked in
+    primary key ordered batches of ids, children before parents, and
+    every batch is deleted with plain DELETE ... WHERE pk IN statements
+    in its own transaction. No delete signals are sent for those rows, so
+    what their receivers do happens here: deleted recipes, tags and
+    ingredients are logged to the change log, which is emptied last,
+    public recipes are retracted from followers' feeds and image files
+    are queued for removal.
+
+    Returns the number of rows deleted. progress, if given, is called
+    with (model, rows deleted so far) after every batch.
+    """
+    from recipe import events, feed, sync
+
+    alias = shard_for_user(user_id, for_write=True)
+    user = get_user_model()(pk=user_id)
+    deleted = 0
+    for model, lookup in _deletion_order():
+        pk = model._meta.pk
+        columns = ['pk']
+        if model is Recipe:
+            columns += ['image', 'published_at']
+        rows = model._base_manager.using(alias).filter(
+            **{lookup: user_id}
+        ).order_by('pk').values_list(*columns)
+        last_pk = None
+        while True:
+            batch = rows if last_pk is None else rows.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            pks = [row[0] for row in batch]
+            seq = None
+            with transaction.atomic(using=alias):
+                for dependent, column in _dependents(model):
+                    deleted += _delete_rows(dependent, alias, column, pks)
+                deleted += _delete_rows(model, alias, pk.column, pks)
+                if model in SYNCED_MODELS:
+                    seq = sync.record_changes(user, deleted=[
+                        model(pk=row_pk, user_id=user_id) for row_pk in pks
+                    ])
+            if seq is not None:
+                events.notify(alias, user_id, seq)
+            if model is Recipe:
+                release_images(row[1] for row in batch)
+                feed.retract_recipes([
+                    row[0] for row in batch if row[2] is not None
+                ])
+            last_pk = pks[-1]
+            if progress is not None:
+                progress(model, deleted)
+
+    user_model = get_user_model()
+    deleted += user_model.objects.filter(pk=user_id).delete()[0]
+    if alias != DEFAULT_DB_ALIAS:
+        user_model.objects.using(alias).filter(pk=user_id).delete()
+        cache.delete(_cache_key(user_id))
+
+    return deleted
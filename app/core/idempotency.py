@@ -0,0 +1,153 @@
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils import encoders
+
+from core.models import IdempotencyKey
+
+
+POLL_INTERVAL = 0.1
+
+
+def fingerprint(request):
+    """sha256 over the method, path and parsed body of a request
+
+    Uploaded files count by name and size so they are not read again.
+    """
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = {
+            key: [
+                [value.name, value.size] if hasattr(value, 'size') else value
+                for value in values
+            ]
+            for key, values in data.lists()
+        }
+    payload = json.dumps(
+        [request.method, request.get_full_path(), data],
+        sort_keys=True,
+        cls=encoders.JSONEncoder
+    )
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def claim(request, key, digest):
+    """creates the key's record, or returns the one another request made
+
+    Returns (record, created). While a request with the same key and body
+    is still running this polls until it finishes or the wait runs out.
+    Records that expired or whose request died are replaced.
+    """
+    records = IdempotencyKey.objects.for_user(request.user)
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        now = timezone.now()
+        try:
+            with transaction.atomic(using=records.db):
+                return records.create(
+                    user=request.user,
+                    key=key,
+                    fingerprint=digest,
+                    expires_at=now + timedelta(
+                        seconds=settings.IDEMPOTENCY_KEY_TTL
+                    ),
+                ), True
+        except IntegrityError:
+            record = records.filter(key=key).first()
+        if record is None:
+            continue
+        stale = now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+        running = record.status == IdempotencyKey.IN_PROGRESS
+        if record.expires_at <= now or (running and record.created_at < stale):
+            records.filter(pk=record.pk, status=record.status).delete()
+            continue
+        if not running or record.fingerprint != digest:
+            return record, False
+        if time.monotonic() >= deadline:
+            return record, False
+        time.sleep(POLL_INTERVAL)
+
+
+def replay(record):
+    """rebuilds the response stored on a finished record"""
+    data = json.loads(record.response_body) if record.response_body else None
+    response = Response(
+        data,
+        status=record.response_status,
+        headers=json.loads(record.response_headers)
+    )
+    response['Idempotent-Replayed'] = 'true'
+
+    return response
+
+
+def idempotent(view_method):
+    """lets clients retry a view method safely with an Idempotency-Key
+
+    The first response for a key is stored and returned again for later
+    requests with the same key, without running the view. Requests that
+    raise or end in a server error are not stored so they can be retried.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {'detail': 'Idempotency-Key must be at most 255 characters.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        digest = fingerprint(request)
+        record, created = claim(request, key, digest)
+        if not created:
+            if record.fingerprint != digest:
+                return Response(
+                    {'detail': 'Idempotency-Key was already used for a '
+                               'different request.'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if record.status == IdempotencyKey.IN_PROGRESS:
+                return Response(
+                    {'detail': 'A request with this Idempotency-Key is '
+                               'still running.'},
+                    status=status.HTTP_409_CONFLICT,
+                    headers={'Retry-After': '1'}
+                )
+            return replay(record)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if response.status_code >= 500:
+            record.delete()
+            return response
+
+        record.status = IdempotencyKey.DONE
+        record.response_status = response.status_code
+        if response.data is not None:
+            record.response_body = json.dumps(
+                response.data,
+                cls=encoders.JSONEncoder
+            )
+        record.response_headers = json.dumps(dict(response.items()))
+        record.save(update_fields=[
+            'status', 'response_status', 'response_body', 'response_headers'
+        ])
+
+        return response
+
+    return wrapper
@@ -0,0 +1,275 @@
+import json
+import logging
+import random
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.utils import DatabaseError
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from core.metrics import metrics
+from core.models import Job
+
+
+logger = logging.getLogger(__name__)
+
+tasks = {}
+
+
+class Task:
+    """A function registered to run as a background job"""
+
+    def __init__(self, func, name, max_attempts, concurrency):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.concurrency = concurrency
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, payload=None, **kwargs):
+        """queues a job that runs this task with the payload"""
+        return enqueue(self.name, payload, **kwargs)
+
+
+def task(name=None, max_attempts=5, concurrency=None):
+    """registers a function as a background task
+
+    The function is called with the job's decoded payload. concurrency
+    caps how many jobs of the task run at once across all workers.
+    """
+    def register(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        tasks[task_name] = Task(func, task_name, max_attempts, concurrency)
+        return tasks[task_name]
+
+    return register
+
+
+def enqueue(name, payload=None, priority=0, delay=0, max_attempts=None):
+    """queues a job for a registered task"""
+    if max_attempts is None:
+        registered = tasks.get(name)
+        max_attempts = registered.max_attempts if registered else 5
+
+    return Job.objects.create(
+        name=name,
+        payload=json.dumps(payload or {}),
+        priority=priority,
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts,
+    )
+
+
+def retry_delay(attempts):
+    """seconds to wait before retrying a job that failed attempts times"""
+    base = settings.JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1)
+    delay = min(base, settings.JOB_RETRY_MAX_DELAY)
+
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _saturated_tasks():
+    """names of tasks already running at their concurrency limit"""
+    limited = {
+        name: registered.concurrency for name, registered in tasks.items()
+        if registered.concurrency
+    }
+    if not limited:
+        return []
+    running = Job.objects.filter(
+        status=Job.RUNNING,
+        name__in=limited
+    ).values('name').annotate(count=Count('id'))
+
+    return [
+        row['name'] for row in running
+        if row['count'] >= limited[row['name']]
+    ]
+
+
+def claim(worker_id):
+    """locks and returns the next runnable job, or None
+
+    Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED so workers
+    never block on each other. Running jobs whose lock went stale are
+    treated as queued again. Concurrency limits are checked before the
+    claim, so racing workers can briefly exceed them.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    runnable = Q(status=Job.QUEUED, run_at__lte=now) | Q(
+        status=Job.RUNNING,
+        locked_at__lt=stale
+    )
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            runnable
+        ).exclude(
+            name__in=_saturated_tasks()
+        ).order_by('-priority', 'run_at', 'id').first()
+        if job is None:
+            return None
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING,
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+
+    job.refresh_from_db()
+    return job
+
+
+class Heartbeat:
+    """Keeps a running job's lock fresh from a background thread
+
+    Jobs running longer than JOB_LOCK_TIMEOUT would otherwise look stale
+    and be claimed, and run, a second time.
+    """
+
+    def __init__(self, job, interval=None):
+        self.job = job
+        self.interval = interval or settings.JOB_HEARTBEAT_INTERVAL
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def beat(self):
+        """refreshes the lock, returns whether the job still holds it"""
+        return Job.objects.filter(
+            pk=self.job.pk,
+            locked_by=self.job.locked_by
+        ).update(locked_at=timezone.now()) == 1
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    if not self.beat():
+                        logger.warning('Job %s lost its lock', self.job.pk)
+                        return
+                except DatabaseError:
+                    logger.exception('Job %s heartbeat failed', self.job.pk)
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def run_job(job):
+    """runs a claimed job and records its outcome
+
+    The outcome is only recorded while the job is still locked by the
+    worker that ran it, a job reclaimed by another worker is left alone.
+    """
+    started = time.monotonic()
+    try:
+        registered = tasks[job.name]
+        with Heartbeat(job):
+            registered(**json.loads(job.payload))
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s (%s) failed:\n%s', job.pk, job.name, error)
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + timedelta(
+                seconds=retry_delay(job.attempts)
+            )
+            metrics.incr('jobs.retried')
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+            metrics.incr('jobs.failed')
+        job.last_error = error
+    else:
+        job.status = Job.DONE
+        job.finished_at = timezone.now()
+        job.last_error = ''
+        metrics.incr('jobs.succeeded')
+    finally:
+        metrics.timing('jobs.duration', time.monotonic() - started)
+
+    worker_id = job.locked_by
+    job.locked_by = ''
+    job.locked_at = None
+    fields = (
+        'status', 'run_at', 'finished_at', 'last_error', 'locked_by',
+        'locked_at',
+    )
+    recorded = Job.objects.filter(pk=job.pk, locked_by=worker_id).update(
+        **{field: getattr(job, field) for field in fields}
+    )
+    if not recorded:
+        logger.warning(
+            'Job %s was reclaimed while %s ran it, outcome dropped',
+            job.pk,
+            worker_id
+        )
+        metrics.incr('jobs.lost')
+
+
+class Worker:
+    """Claims and runs jobs on one or more threads until stopped"""
+
+    def __init__(self, concurrency=1, poll_interval=1.0, burst=False):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.burst = burst
+        self.id = f'{socket.gethostname()}:{uuid.uuid4().hex[:8]}'
+        self.stopping = threading.Event()
+        autodiscover_modules('tasks')
+
+    def stop(self):
+        """lets running jobs finish, then exits"""
+        self.stopping.set()
+
+    def work(self, thread_number=0):
+        """claims and runs jobs until stopped, or drained in burst mode"""
+        worker_id = f'{self.id}/{thread_number}'
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                try:
+                    job = claim(worker_id)
+                except DatabaseError:
+                    logger.exception('Worker %s could not claim', worker_id)
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                if job is None:
+                    if self.burst:
+                        return
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                run_job(job)
+        finally:
+            if thread_number:
+                connection.close()
+
+    def run(self):
+        """runs the worker threads and waits for them to exit"""
+        if self.concurrency == 1:
+            self.work()
+            return
+        threads = [
+            threading.Thread(target=self.work, args=(number,))
+            for number in range(1, self.concurrency + 1)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,77 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from core.models import Recipe
+from recipe import images
+
+
+class Command(BaseCommand):
+    """Django command to store metadata for already uploaded images"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--processes', type=int, default=os.cpu_count())
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='also redo images that already have metadata'
+        )
+
+    def handle(self, *args, **options):
+        totals = {'updated': 0, 'missing': 0, 'failed': 0}
+        with ProcessPoolExecutor(options['processes']) as pool:
+            for alias in settings.DATABASE_SHARDS or [DEFAULT_DB_ALIAS]:
+                self.backfill(alias, pool, options, totals)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored metadata for {totals["updated"]} images, '
+            f'{totals["missing"]} missing, {totals["failed"]} failed'
+        ))
+
+    def backfill(self, alias, pool, options, totals):
+        """decodes one batch of images at a time on the pool
+
+        An image that cannot be read or decoded is reported and skipped.
+        """
+        recipes = Recipe._base_manager.using(alias).exclude(
+            image=''
+        ).exclude(image__isnull=True).only('id', 'user', 'image')
+        if not options['all']:
+            recipes = recipes.filter(image_width__isnull=True)
+        recipes = recipes.order_by('id')
+        last_id = 0
+        while True:
+            batch = list(recipes.filter(id__gt=last_id)[
+                :options['batch_size']
+            ])
+            if not batch:
+                return
+            last_id = batch[-1].id
+            futures = [
+                pool.submit(images.stored_metadata, recipe.image.name)
+                for recipe in batch
+            ]
+            for recipe, future in zip(batch, futures):
+                try:
+                    metadata = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as exc:
+                    self.stderr.write(f'Recipe {recipe.id}: '
+                                      f'{recipe.image.name} failed: {exc!r}')
+                    totals['failed'] += 1
+                    continue
+                if metadata is None:
+                    self.stderr.write(f'Recipe {recipe.id}: '
+                                      f'{recipe.image.name} is missing')
+                    totals['missing'] += 1
+                    continue
+                for field, value in metadata.items():
+                    setattr(recipe, field, value)
+                recipe.save(update_fields=list(metadata))
+                totals['updated'] += 1
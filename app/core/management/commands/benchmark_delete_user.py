@@ -0,0 +1,87 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core.deletion import delete_user
+from core.models import Ingredient, Recipe, Tag
+
+
+class Command(BaseCommand):
+    """Django command to time deleting a user with many recipes"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--cascade',
+            action='store_true',
+            help="also time Django's cascading delete for comparison"
+        )
+
+    def create_user(self, count):
+        """a throwaway user with count tagged recipes"""
+        user = get_user_model().objects.create_user(
+            f'benchmark-{uuid.uuid4().hex}@benchmark.invalid'
+        )
+        tags = [
+            Tag.objects.create(user=user, name=f'Tag {number}')
+            for number in range(10)
+        ]
+        ingredient = Ingredient.objects.create(user=user, name='Salt')
+        using = tags[0]._state.db
+        last_pk = 0
+        for start in range(0, count, 5000):
+            Recipe.objects.using(using).bulk_create(
+                Recipe(
+                    user=user,
+                    title=f'Recipe {number}',
+                    time_minutes=10,
+                    price='1.00'
+                )
+                for number in range(start, min(start + 5000, count))
+            )
+            recipe_ids = list(Recipe.objects.using(using).filter(
+                user=user,
+                pk__gt=last_pk
+            ).order_by('pk').values_list('pk', flat=True))
+            last_pk = recipe_ids[-1]
+            Recipe.tags.through.objects.using(using).bulk_create(
+                Recipe.tags.through(
+                    recipe_id=recipe_id,
+                    tag_id=tags[recipe_id % len(tags)].pk
+                )
+                for recipe_id in recipe_ids
+            )
+            Recipe.ingredients.through.objects.using(using).bulk_create(
+                Recipe.ingredients.through(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient.pk
+                )
+                for recipe_id in recipe_ids
+            )
+
+        return user
+
+    def handle(self, *args, **options):
+        count = options['recipes']
+        self.stdout.write(f'Creating a user with {count} recipes...')
+        user = self.create_user(count)
+        started = time.perf_counter()
+        deleted = delete_user(user.pk, options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'delete_user: {deleted} rows in {elapsed:.2f}s, '
+            f'{deleted / elapsed:.0f} rows/s'
+        )
+
+        if options['cascade']:
+            user = self.create_user(count)
+            started = time.perf_counter()
+            deleted = user.delete()[0]
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'cascade: {deleted} rows in {elapsed:.2f}s, '
+                f'{deleted / elapsed:.0f} rows/s'
+            )
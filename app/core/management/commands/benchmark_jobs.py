@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import task, Worker
+from core.models import Job
+
+
+@task(name='benchmark.noop')
+def noop(**payload):
+    """does nothing, so the benchmark measures queue overhead only"""
+
+
+class Command(BaseCommand):
+    """Django command to measure job throughput at several worker counts"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=1000)
+        parser.add_argument('--workers', default='1,2,4,8')
+
+    def handle(self, *args, **options):
+        count = options['jobs']
+        for concurrency in map(int, options['workers'].split(',')):
+            Job.objects.filter(name=noop.name).delete()
+            Job.objects.bulk_create(
+                Job(name=noop.name) for _ in range(count)
+            )
+            started = time.monotonic()
+            Worker(concurrency=concurrency, burst=True).run()
+            elapsed = time.monotonic() - started
+            done = Job.objects.filter(
+                name=noop.name,
+                status=Job.DONE
+            ).count()
+            self.stdout.write(
+                f'{concurrency} workers: {done} jobs in {elapsed:.2f}s, '
+                f'{done / elapsed:.0f} jobs/s'
+            )
+
+        Job.objects.filter(name=noop.name).delete()
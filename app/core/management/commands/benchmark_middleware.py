@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from core.middleware import MiddlewareProfile
+
+
+class Command(BaseCommand):
+    """Django command to measure the per request cost of each profile"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000)
+        parser.add_argument('--path', default='/api/recipe/recipes/')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        factory = RequestFactory()
+        timings = {}
+        for name, paths in settings.MIDDLEWARE_PROFILES.items():
+            profile = MiddlewareProfile(paths, lambda request: HttpResponse())
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                started = time.perf_counter()
+                for _ in range(count):
+                    profile.chain(factory.get(options['path']))
+                elapsed = time.perf_counter() - started
+            timings[name] = elapsed / count * 1e6
+            self.stdout.write(
+                f'{name}: {len(paths)} middleware, '
+                f'{timings[name]:.2f} microseconds per request'
+            )
+
+        for name, timing in timings.items():
+            if name != 'default':
+                self.stdout.write(self.style.SUCCESS(
+                    f'{name} saves {timings["default"] - timing:.2f} '
+                    f'microseconds per request over default'
+                ))
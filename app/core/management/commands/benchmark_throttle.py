@@ -0,0 +1,41 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+
+from rest_framework.request import Request
+
+from core.throttling import TokenBucketThrottle, buckets
+from recipe.views import RecipeViewSet
+
+
+class Command(BaseCommand):
+    """Django command to measure the per request cost of throttling"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        request = Request(RequestFactory().get('/api/recipe/recipes/'))
+        request.user = get_user_model()(pk=1)
+        view = RecipeViewSet(action='list')
+        throttle = TokenBucketThrottle()
+        # a fixed clock never refills the bucket, so it holds them all
+        throttle.timer = lambda: 0.0
+        rate = f'{count * 2}/min'
+        self.stdout.write(f'Throttling {count} requests at {rate}')
+
+        with override_settings(REST_FRAMEWORK={
+            'DEFAULT_THROTTLE_RATES': {'read': rate}
+        }):
+            buckets.clear()
+            started = time.perf_counter()
+            for _ in range(count):
+                throttle.allow_request(request, view)
+            elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{elapsed / count * 1e6:.2f} microseconds per request'
+        ))
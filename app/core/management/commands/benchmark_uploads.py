@@ -0,0 +1,33 @@
+import os
+import time
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+
+from core import objectstore
+from core.storage import ObjectStorage
+
+
+class Command(BaseCommand):
+    """Django command to measure object store upload throughput"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=256)
+        parser.add_argument('--part-size-mb', type=int, default=8)
+        parser.add_argument('--workers', default='1,2,4,8,16')
+
+    def handle(self, *args, **options):
+        data = os.urandom(options['size_mb'] * 1024 * 1024)
+        for workers in map(int, options['workers'].split(',')):
+            storage = ObjectStorage(
+                part_size=options['part_size_mb'] * 1024 * 1024,
+                workers=workers
+            )
+            started = time.monotonic()
+            name = storage.save('benchmark/upload.bin', ContentFile(data))
+            elapsed = time.monotonic() - started
+            objectstore.store().delete(name)
+            self.stdout.write(
+                f'{workers} workers: {options["size_mb"]} MB in '
+                f'{elapsed:.2f}s, {options["size_mb"] / elapsed:.1f} MB/s'
+            )
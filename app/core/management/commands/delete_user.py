@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_framework.authtoken.models import Token
+
+from core.deletion import delete_user
+
+
+class Command(BaseCommand):
+    """Django command to delete a user and their data in batches"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('email')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'No user with email {options["email"]}')
+
+        # locks the user out so no rows are added while deleting
+        get_user_model().objects.filter(pk=user.pk).update(is_active=False)
+        Token.objects.filter(user=user).delete()
+
+        def progress(model, deleted):
+            if options['verbosity'] > 1:
+                self.stdout.write(
+                    f'{deleted} rows deleted, at {model._meta.label}'
+                )
+
+        deleted = delete_user(user.pk, options['batch_size'], progress)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {user.email}, {deleted} rows in all'
+        ))
@@ -0,0 +1,143 @@
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.utils import timezone
+
+from core import objectstore
+from core.models import ImageBlob, Recipe
+from core.storage import ObjectStorage
+
+
+def scan_files(root):
+    """yields (path, stat) for every file below root
+
+    Directories are walked with os.scandir one entry at a time, so memory
+    use grows with the depth of the tree, not the number of files.
+    """
+    pending = [root]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path, entry.stat(follow_symlinks=False)
+
+
+def stored_files(directory):
+    """yields (name, size, mtime) for every stored file below directory"""
+    if isinstance(default_storage, ObjectStorage):
+        yield from objectstore.store().list(directory.rstrip('/') + '/')
+        return
+    root = settings.MEDIA_ROOT
+    for path, stat in scan_files(os.path.join(root, directory)):
+        name = os.path.relpath(path, root).replace(os.sep, '/')
+        yield name, stat.st_size, stat.st_mtime
+
+
+def remove_file(name):
+    if isinstance(default_storage, ObjectStorage):
+        objectstore.store().delete(name)
+    else:
+        os.remove(os.path.join(settings.MEDIA_ROOT, name))
+
+
+def referenced_names(names, since):
+    """the names still in use, with one IN query per database
+
+    A name counts as used while a recipe points at it, or while its
+    ImageBlob has references or was touched after since.
+    """
+    referenced = set()
+    for alias in settings.DATABASE_SHARDS or [DEFAULT_DB_ALIAS]:
+        referenced.update(
+            Recipe._base_manager.using(alias).filter(
+                image__in=names
+            ).values_list('image', flat=True)
+        )
+    referenced.update(
+        ImageBlob.objects.filter(name__in=names).filter(
+            Q(ref_count__gt=0) | Q(updated_at__gt=since)
+        ).values_list('name', flat=True)
+    )
+
+    return referenced
+
+
+class Command(BaseCommand):
+    """Django command to delete media files no recipe references"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', default='uploads/recipe')
+        parser.add_argument('--grace-hours', type=float, default=24)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=0,
+            help='maximum files deleted per second, 0 for no limit'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.since = timezone.now() - timedelta(hours=options['grace_hours'])
+        self.started = time.monotonic()
+        self.totals = {'scanned': 0, 'deleted': 0, 'bytes': 0}
+
+        cutoff = self.since.timestamp()
+        batch = {}
+        for name, size, modified in stored_files(options['directory']):
+            self.totals['scanned'] += 1
+            if modified > cutoff:
+                continue
+            batch[name] = size
+            if len(batch) >= options['batch_size']:
+                self.collect(batch)
+                batch = {}
+        if batch:
+            self.collect(batch)
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {self.totals["deleted"]} of '
+            f'{self.totals["scanned"]} files, '
+            f'{self.totals["bytes"]} bytes'
+        ))
+
+    def collect(self, batch):
+        """deletes the unreferenced files of one batch"""
+        orphans = set(batch) - referenced_names(list(batch), self.since)
+        for name in sorted(orphans):
+            if self.options['verbosity'] > 1:
+                self.stdout.write(name)
+            if not self.options['dry_run']:
+                self.throttle()
+                try:
+                    remove_file(name)
+                except FileNotFoundError:
+                    continue
+            self.totals['deleted'] += 1
+            self.totals['bytes'] += batch[name]
+        if orphans and not self.options['dry_run']:
+            ImageBlob.objects.filter(name__in=orphans).delete()
+
+    def throttle(self):
+        """sleeps to keep deletions under --rate per second"""
+        rate = self.options['rate']
+        if rate <= 0:
+            return
+        due = self.started + self.totals['deleted'] / rate
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.sharding import move_user, shard_for_user
+
+
+class Command(BaseCommand):
+    """Django command to move a user's data to another shard"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('email')
+        parser.add_argument('shard', choices=settings.DATABASE_SHARDS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'No user with email {options["email"]}')
+
+        source = shard_for_user(user.id)
+        moved = move_user(user.id, options['shard'], options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} rows for {user.email} '
+            f'from {source} to {options["shard"]}'
+        ))
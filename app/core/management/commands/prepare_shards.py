@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from core.sharding import offset_sequences
+
+
+class Command(BaseCommand):
+    """Django command to give every shard its own block of row ids"""
+
+    def handle(self, *args, **options):
+        for index, alias in enumerate(settings.DATABASE_SHARDS):
+            try:
+                offset_sequences(alias, index * settings.SHARD_ID_BLOCK)
+            except ImproperlyConfigured as exc:
+                raise CommandError(exc)
+            self.stdout.write(f'Offset id sequences on {alias}')
+
+        self.stdout.write(self.style.SUCCESS('Shards prepared!'))
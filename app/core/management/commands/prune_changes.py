@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from recipe.sync import prune_changes
+
+
+class Command(BaseCommand):
+    """Django command to delete change log entries past their retention"""
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(
+            seconds=settings.SYNC_CHANGE_RETENTION
+        )
+        pruned = 0
+        for alias in settings.DATABASE_SHARDS or [DEFAULT_DB_ALIAS]:
+            pruned += prune_changes(before, using=alias)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Pruned {pruned} change log entries'
+        ))
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from core.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    """Django command to delete expired idempotency keys"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        purged = 0
+        for alias in settings.DATABASE_SHARDS or [DEFAULT_DB_ALIAS]:
+            expired = IdempotencyKey.objects.using(alias).filter(
+                expires_at__lte=now
+            )
+            while True:
+                batch = list(expired.values_list('pk', flat=True)[
+                    :options['batch_size']
+                ])
+                if not batch:
+                    break
+                purged += IdempotencyKey.objects.using(alias).filter(
+                    pk__in=batch
+                ).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {purged} expired idempotency keys'
+        ))
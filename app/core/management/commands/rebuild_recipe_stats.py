@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from recipe.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    """Django command to recompute the per-user recipe stats table"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('emails', nargs='*')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('id').only('id')
+        if options['emails']:
+            users = users.filter(email__in=options['emails'])
+
+        batch_size = options['batch_size']
+        rebuilt = 0
+        last_id = 0
+        while True:
+            batch = list(users.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            rebuilt += rebuild_stats(batch)
+            last_id = batch[-1].id
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt recipe stats for {rebuilt} users'
+        ))
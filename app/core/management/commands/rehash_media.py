@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core.models import Recipe
+from core.storage import ContentAddressed, is_hashed_name
+
+
+class Command(BaseCommand):
+    """Django command to move recipe images to content addressed names"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--keep-originals', action='store_true')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field('image').storage
+        if not isinstance(storage, ContentAddressed):
+            raise CommandError(
+                'DEFAULT_FILE_STORAGE is not a core.storage.'
+                'ContentAddressed storage'
+            )
+
+        totals = {'rehashed': 0, 'missing': 0}
+        for alias in settings.DATABASE_SHARDS or [DEFAULT_DB_ALIAS]:
+            self.rehash(alias, storage, options, totals)
+
+        verb = 'Would rehash' if options['dry_run'] else 'Rehashed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {totals["rehashed"]} images, '
+            f'{totals["missing"]} missing'
+        ))
+
+    def rehash(self, alias, storage, options, totals):
+        """rehashes the images on one database, one batch at a time"""
+        recipes = Recipe._base_manager.using(alias).exclude(
+            image=''
+        ).exclude(image__isnull=True).only('id', 'image').order_by('id')
+        last_id = 0
+        while True:
+            batch = list(recipes.filter(id__gt=last_id)[
+                :options['batch_size']
+            ])
+            if not batch:
+                return
+            last_id = batch[-1].id
+            for recipe in batch:
+                original = recipe.image.name
+                if is_hashed_name(original):
+                    continue
+                if not storage.exists(original):
+                    self.stderr.write(f'Recipe {recipe.id}: {original} '
+                                      f'is missing')
+                    totals['missing'] += 1
+                    continue
+                totals['rehashed'] += 1
+                if options['dry_run']:
+                    continue
+                with storage.open(original) as content:
+                    recipe.image.name = storage.save(original, content)
+                recipe.save(update_fields=['image'])
+                shared = recipes.filter(image=original).exists()
+                if not options['keep_originals'] and not shared:
+                    storage.delete(original)
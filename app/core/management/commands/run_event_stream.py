@@ -0,0 +1,45 @@
+import asyncio
+import resource
+import signal
+
+from django.core.management.base import BaseCommand
+
+from recipe.events import EventStreamServer
+
+
+class Command(BaseCommand):
+    """Django command to serve change notifications as server-sent events"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--db-threads', type=int, default=4)
+
+    def raise_open_file_limit(self):
+        """every stream holds a socket, so allow as many as permitted"""
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+        return hard
+
+    def handle(self, *args, **options):
+        limit = self.raise_open_file_limit()
+        loop = asyncio.get_event_loop()
+        stream = EventStreamServer(db_threads=options['db_threads'])
+        server = loop.run_until_complete(
+            stream.start(options['host'], options['port'])
+        )
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, loop.stop)
+        self.stdout.write(self.style.SUCCESS(
+            f'Serving {stream.path} on {options["host"]}:{options["port"]} '
+            f'with up to {limit} open files'
+        ))
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.run_until_complete(stream.close())
+            loop.close()
@@ -0,0 +1,76 @@
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import Worker
+from core.metrics import metrics
+
+
+class Command(BaseCommand):
+    """Django command to run background jobs from the job table"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--report-interval', type=float, default=60.0)
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='exit once no job is runnable'
+        )
+
+    def report(self, started):
+        stats = metrics.snapshot()
+        finished = sum(
+            stats.get(f'jobs.{outcome}', 0)
+            for outcome in ('succeeded', 'failed', 'retried')
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{stats.get("jobs.succeeded", 0)} succeeded, '
+            f'{stats.get("jobs.failed", 0)} failed, '
+            f'{stats.get("jobs.retried", 0)} retried, '
+            f'{finished / elapsed if elapsed else 0:.1f} jobs/s'
+        )
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            burst=options['burst'],
+        )
+
+        def shutdown(signum, frame):
+            self.stdout.write(self.style.WARNING(
+                'Finishing running jobs before exiting...'
+            ))
+            worker.stop()
+
+        previous = {
+            signum: signal.signal(signum, shutdown)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+
+        started = time.monotonic()
+        reporter = threading.Thread(
+            target=self.report_until_stopped,
+            args=(worker, started, options['report_interval']),
+            daemon=True
+        )
+        reporter.start()
+        self.stdout.write(self.style.SUCCESS(
+            f'Worker {worker.id} running {worker.concurrency} threads'
+        ))
+        try:
+            worker.run()
+        finally:
+            worker.stop()
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.report(started)
+
+    def report_until_stopped(self, worker, started, interval):
+        while not worker.stopping.wait(interval):
+            self.report(started)
@@ -0,0 +1,42 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """Thread safe in-process counters and timings"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._timings = defaultdict(lambda: [0, 0.0])
+
+    def incr(self, name, value=1):
+        """adds to a counter"""
+        with self._lock:
+            self._counters[name] += value
+
+    def timing(self, name, seconds):
+        """records one observation of a duration"""
+        with self._lock:
+            timing = self._timings[name]
+            timing[0] += 1
+            timing[1] += seconds
+
+    def snapshot(self):
+        """returns a copy of every counter and timing"""
+        with self._lock:
+            data = dict(self._counters)
+            for name, (count, total) in self._timings.items():
+                data[f'{name}.count'] = count
+                data[f'{name}.total'] = total
+
+        return data
+
+    def reset(self):
+        """drops every counter and timing"""
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+metrics = Metrics()
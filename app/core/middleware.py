@@ -0,0 +1,249 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.exception import convert_exception_to_response
+from django.db import connections
+from django.db.utils import InterfaceError, OperationalError
+from django.utils.cache import patch_vary_headers
+from django.utils.module_loading import import_string
+from django.utils.text import compress_string
+
+from core import routers
+from core.routers import allow_replica_reads, current_replica
+from core.timeouts import is_statement_timeout
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _pin_cache_key(request):
+    """keys the primary pin on the client's credentials, when it sent any"""
+    credentials = request.META.get('HTTP_AUTHORIZATION')
+    if not credentials:
+        return None
+    digest = hashlib.sha1(credentials.encode()).hexdigest()
+
+    return f'replica-pin:{digest}'
+
+
+class ReplicaRoutingMiddleware:
+    """Lets safe requests read from replicas unless the client just wrote
+
+    A client that sends a write is pinned to the primary for
+    REPLICA_PIN_SECONDS, through a signed cookie and, for token clients
+    that may drop cookies, a key in the shared cache derived from the
+    Authorization header. A replica that fails with a connection error is
+    taken out of rotation until its next health check.
+    """
+    pin_salt = 'core.middleware.ReplicaRoutingMiddleware'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def is_pinned(self, request):
+        pinned = request.get_signed_cookie(
+            settings.REPLICA_PIN_COOKIE,
+            default=None,
+            salt=self.pin_salt,
+            max_age=settings.REPLICA_PIN_SECONDS
+        )
+        if pinned is not None:
+            return True
+        key = _pin_cache_key(request)
+
+        return key is not None and cache.get(key) is not None
+
+    def pin(self, request, response):
+        seconds = settings.REPLICA_PIN_SECONDS
+        response.set_signed_cookie(
+            settings.REPLICA_PIN_COOKIE,
+            'primary',
+            salt=self.pin_salt,
+            max_age=seconds,
+            httponly=True
+        )
+        key = _pin_cache_key(request)
+        if key is not None:
+            cache.set(key, True, seconds)
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        safe = request.method in SAFE_METHODS
+        allow_replica_reads(safe and not self.is_pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            allow_replica_reads(False)
+        if not safe:
+            self.pin(request, response)
+
+        return response
+
+    def process_exception(self, request, exception):
+        alias = current_replica()
+        if alias is None:
+            return None
+        if not isinstance(exception, (InterfaceError, OperationalError)):
+            return None
+        if connections[alias].errors_occurred and \
+                not is_statement_timeout(exception):
+            routers.replicas.mark_unhealthy(alias)
+
+        return None
+
+
+class MiddlewareProfile:
+    """A middleware chain built the way BaseHandler.load_middleware does"""
+
+    def __init__(self, paths, get_response):
+        self.view_middleware = []
+        self.template_response_middleware = []
+        self.exception_middleware = []
+        handler = get_response
+        for path in reversed(paths):
+            try:
+                instance = import_string(path)(handler)
+            except MiddlewareNotUsed:
+                continue
+            if instance is None:
+                raise ImproperlyConfigured(
+                    f'Middleware factory {path} returned None.'
+                )
+            if hasattr(instance, 'process_view'):
+                self.view_middleware.insert(0, instance.process_view)
+            if hasattr(instance, 'process_template_response'):
+                self.template_response_middleware.append(
+                    instance.process_template_response
+                )
+            if hasattr(instance, 'process_exception'):
+                self.exception_middleware.append(instance.process_exception)
+            handler = convert_exception_to_response(instance)
+        self.chain = handler
+
+
+class MiddlewareProfileMiddleware:
+    """Runs the MIDDLEWARE_PROFILES chain picked by the request path
+
+    MIDDLEWARE_PROFILE_ROUTES maps path prefixes to profiles, the longest
+    matching prefix wins and other paths use the 'default' profile. This
+    must be the last entry in MIDDLEWARE so the view, exception and
+    template response hooks it forwards are the only ones Django calls.
+    """
+
+    def __init__(self, get_response):
+        self.profiles = {
+            name: MiddlewareProfile(paths, get_response)
+            for name, paths in settings.MIDDLEWARE_PROFILES.items()
+        }
+        self.routes = sorted(
+            settings.MIDDLEWARE_PROFILE_ROUTES,
+            key=lambda route: len(route[0]),
+            reverse=True
+        )
+
+    def profile_for(self, path):
+        for prefix, name in self.routes:
+            if path.startswith(prefix):
+                return name
+
+        return 'default'
+
+    def __call__(self, request):
+        request.middleware_profile = self.profile_for(request.path_info)
+
+        return self.profiles[request.middleware_profile].chain(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = self.profiles[request.middleware_profile]
+        for process_view in profile.view_middleware:
+            response = process_view(request, view_func, view_args, view_kwargs)
+            if response:
+                return response
+
+    def process_template_response(self, request, response):
+        profile = self.profiles[request.middleware_profile]
+        for process_template_response in profile.template_response_middleware:
+            response = process_template_response(request, response)
+
+        return response
+
+    def process_exception(self, request, exception):
+        profile = self.profiles[request.middleware_profile]
+        for process_exception in profile.exception_middleware:
+            response = process_exception(request, exception)
+            if response:
+                return response
+
+
+def accepted_encodings(request):
+    """the content codings the client accepts, without q=0 ones"""
+    accepted = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.partition(';')
+        params = params.replace(' ', '')
+        if params in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+
+    return accepted
+
+
+class CompressionMiddleware:
+    """Compresses responses of COMPRESSION_MIN_SIZE bytes or more
+
+    Brotli is used when the brotli package is installed and the client
+    accepts it, gzip otherwise. Responses that would not get smaller,
+    streaming responses and ones already encoded are sent as they are.
+    """
+    brotli_quality = 5
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def choose_encoding(self, request):
+        accepted = accepted_encodings(request)
+        if brotli is not None and 'br' in accepted:
+            return 'br'
+        if 'gzip' in accepted:
+            return 'gzip'
+
+        return None
+
+    def compress(self, content, encoding):
+        if encoding == 'br':
+            return brotli.compress(content, quality=self.brotli_quality)
+
+        return compress_string(content)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.choose_encoding(request)
+        if encoding is None:
+            return response
+        compressed = self.compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+
+        return response
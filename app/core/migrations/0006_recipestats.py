@@ -0,0 +1,27 @@
+# Generated by Django 2.1.15 on 2026-10-18 21:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_recipe_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recipe_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('recipe_count', models.PositiveIntegerField(default=0)),
+                ('price_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('price_counts', models.TextField(default='{}')),
+                ('time_histogram', models.TextField(default='{}')),
+                ('tag_counts', models.TextField(default='{}')),
+                ('ingredient_counts', models.TextField(default='{}')),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.1.15 on 2026-10-18 21:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_recipestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardAssignment',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='shard_assignment', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('alias', models.CharField(max_length=64)),
+            ],
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+
+def merge_case_duplicates(apps, schema_editor):
+    """keeps the oldest of each user's names that differ only by case"""
+    alias = schema_editor.connection.alias
+    Recipe = apps.get_model('core', 'Recipe')
+    for model_name, field in (('Tag', 'tags'), ('Ingredient', 'ingredients')):
+        model = apps.get_model('core', model_name)
+        through = getattr(Recipe, field).through
+        column = f'{model_name.lower()}_id'
+        keep = {}
+        duplicates = {}
+        for row in model.objects.using(alias).order_by('id'):
+            key = (row.user_id, row.name.lower())
+            if key in keep:
+                duplicates[row.id] = keep[key]
+            else:
+                keep[key] = row.id
+        for duplicate, survivor in duplicates.items():
+            linked = through.objects.using(alias).filter(
+                **{column: survivor}
+            ).values_list('recipe_id', flat=True)
+            links = through.objects.using(alias).filter(**{column: duplicate})
+            links.filter(recipe_id__in=list(linked)).delete()
+            links.update(**{column: survivor})
+        model.objects.using(alias).filter(id__in=list(duplicates)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_case_duplicates, migrations.RunPython.noop),
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX core_tag_user_lower_name '
+             'ON core_tag (user_id, lower(name))'],
+            ['DROP INDEX core_tag_user_lower_name'],
+        ),
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX core_ingredient_user_lower_name '
+             'ON core_ingredient (user_id, lower(name))'],
+            ['DROP INDEX core_ingredient_user_lower_name'],
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.1.15 on 2026-10-18 23:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_follow_and_feed'),
+    ]
+
+    operations = [
+        # RecipeIngredient takes over the table of the plain many to many
+        # field, which already has its columns and unique constraint
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='RecipeIngredient',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Ingredient')),
+                        ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingredient_amounts', to='core.Recipe')),
+                    ],
+                    options={
+                        'db_table': 'core_recipe_ingredients',
+                    },
+                ),
+                migrations.AlterUniqueTogether(
+                    name='recipeingredient',
+                    unique_together={('recipe', 'ingredient')},
+                ),
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='ingredients',
+                    field=models.ManyToManyField(through='core.RecipeIngredient', to='core.Ingredient'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipeingredient',
+            name='quantity',
+            field=models.DecimalField(blank=True, decimal_places=3, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='recipeingredient',
+            name='unit',
+            field=models.CharField(blank=True, choices=[('', 'item'), ('g', 'g'), ('kg', 'kg'), ('oz', 'oz'), ('lb', 'lb'), ('ml', 'ml'), ('l', 'l'), ('tsp', 'tsp'), ('tbsp', 'tbsp'), ('cup', 'cup')], max_length=8),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-18 23:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_recipe_ingredient_amounts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shardassignment',
+            name='moving',
+            field=models.BooleanField(default=False),
+        ),
+    ]
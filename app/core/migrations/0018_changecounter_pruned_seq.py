@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-19 00:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_shardassignment_moving'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changecounter',
+            name='pruned_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -1,9 +1,14 @@
 import uuid
 import os
-from django.db import models
+from decimal import Decimal
+
+from django.db import connections, models
+from django.db.models.functions import Lower
+from django.dispatch import Signal
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
                                         PermissionsMixin
 from django.conf import settings
+from django.utils import timezone
 
 
 def recipe_image_file_path(instance, filename):
@@ -14,6 +19,111 @@ def recipe_image_file_path(instance, filename):
     return os.path.join('uploads/recipe/', generated_filename)
 
 
+class UserOwnedQuerySet(models.QuerySet):
+    """Queryset for rows that belong to a single user"""
+
+    def for_user(self, user):
+        """return the user's rows, read from the shard the user lives on
+
+        Without shards the routers pick the database, so reads may still
+        go to a replica.
+        """
+        from core.sharding import shard_for_user, sharding_enabled
+
+        queryset = self.filter(user=user)
+        if not sharding_enabled():
+            return queryset
+
+        return queryset.using(shard_for_user(user.pk))
+
+    def create(self, **kwargs):
+        """create the row on its owner's shard"""
+        from core.sharding import shard_for_user, sharding_enabled
+
+        if (
+            sharding_enabled() and self._db is None and
+            kwargs.get('user') is not None
+        ):
+            alias = shard_for_user(kwargs['user'].pk, for_write=True)
+            return self.using(alias).create(**kwargs)
+
+        return super().create(**kwargs)
+
+
+UserOwnedManager = models.Manager.from_queryset(UserOwnedQuerySet)
+
+
+def normalize_name(name):
+    """collapses whitespace in a tag or ingredient name"""
+    return ' '.join(str(name).split())
+
+
+# sent by get_or_create_names with the rows it inserted
+names_created = Signal(providing_args=['instances', 'using'])
+
+
+class NamedQuerySet(UserOwnedQuerySet):
+    """Queryset for user owned rows unique on (user, lower(name))"""
+
+    def _matching(self, user, names):
+        # exact names are matched too since SQLite's lower() is ASCII only
+        return self.for_user(user).annotate(
+            lower_name=Lower('name')
+        ).filter(
+            models.Q(lower_name__in=[name.lower() for name in names]) |
+            models.Q(name__in=names)
+        )
+
+    def get_or_create_names(self, user, names):
+        """returns (rows, created rows) for names, creating missing ones
+
+        Names are matched case-insensitively and the first spelling wins.
+        Missing rows are inserted with ON CONFLICT DO NOTHING, so
+        concurrent writers never create duplicates or fail on each other.
+        The inserted rows skip post_save, so names_created is sent
+        with all of them instead.
+        """
+        wanted = {}
+        for name in map(normalize_name, names):
+            if name:
+                wanted.setdefault(name.lower(), name)
+        if not wanted:
+            return [], []
+
+        found = {
+            row.name.lower(): row
+            for row in self._matching(user, list(wanted.values()))
+        }
+        missing = [
+            name for key, name in wanted.items() if key not in found
+        ]
+        if missing:
+            connection = connections[self.for_user(user).db]
+            table = connection.ops.quote_name(self.model._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {table} (name, user_id) VALUES '
+                    + ', '.join(['(%s, %s)'] * len(missing))
+                    + ' ON CONFLICT DO NOTHING',
+                    [value for name in missing for value in (name, user.pk)]
+                )
+            created = list(self._matching(user, missing))
+            for row in created:
+                found.setdefault(row.name.lower(), row)
+            names_created.send(
+                sender=self.model,
+                instances=created,
+                using=connection.alias
+            )
+        else:
+            created = []
+
+        return [found[key] for key in wanted if key in found], created
+
+
+NamedManager = models.Manager.from_queryset(NamedQuerySet)
+
+
 class UserManager(BaseUserManager):
 
     def create_user(self, email, password=None, **extra_fields):
@@ -42,6 +152,14 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    following = models.ManyToManyField(
+        'self',
+        through='Follow',
+        symmetrical=False,
+        related_name='followers'
+    )
+    # kept in step with Follow rows by core.signals
+    follower_count = models.PositiveIntegerField(default=0)
 
     objects = UserManager()
 
@@ -50,24 +168,28 @@ class User(AbstractBaseUser, PermissionsMixin):
 
 class Tag(models.Model):
     """Tag for a recipe"""
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
 
+    objects = NamedManager()
+
     def __str__(self):
         return self.name
 
 
 class Ingredient(models.Model):
     """Ingredient to be used in a recipe"""
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
 
+    objects = NamedManager()
+
     def __str__(self):
         return self.name
 
@@ -78,13 +200,392 @@ class Recipe(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
-    title = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, db_index=True)
     time_minutes = models.IntegerField()
     price = models.DecimalField(max_digits=5, decimal_places=2)
     link = models.CharField(max_length=255, blank=True)
-    ingredients = models.ManyToManyField('Ingredient')
+    ingredients = models.ManyToManyField(
+        'Ingredient',
+        through='RecipeIngredient'
+    )
     tags = models.ManyToManyField('Tag')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # read from the image when it is uploaded, see recipe.images
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_format = models.CharField(max_length=16, blank=True)
+    image_bytes = models.PositiveIntegerField(null=True, blank=True)
+    image_orientation = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True
+    )
+    image_placeholder = models.CharField(max_length=64, blank=True)
+    image_color = models.CharField(max_length=7, blank=True)
+    is_public = models.BooleanField(default=False)
+    # set when the recipe is made public, orders it in followers' feeds
+    published_at = models.DateTimeField(null=True, blank=True)
+
+    objects = UserOwnedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', '-published_at', '-id'],
+                name='core_recipe_published_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.title
+
+
+# units an ingredient's quantity may be given in, mapped to the unit its
+# totals are added up in and how many of those one of it makes. Amounts
+# without a unit count whole items.
+INGREDIENT_UNITS = {
+    '': ('', Decimal(1)),
+    'g': ('g', Decimal(1)),
+    'kg': ('g', Decimal(1000)),
+    'oz': ('g', Decimal('28.349523125')),
+    'lb': ('g', Decimal('453.59237')),
+    'ml': ('ml', Decimal(1)),
+    'l': ('ml', Decimal(1000)),
+    'tsp': ('ml', Decimal('4.92892159375')),
+    'tbsp': ('ml', Decimal('14.78676478125')),
+    'cup': ('ml', Decimal('236.5882365')),
+}
+
+# sent by RecipeIngredient.objects.set_for_recipe with the recipe whose
+# ingredients it changed
+ingredients_set = Signal(providing_args=['instances', 'using'])
+
+
+class RecipeIngredientQuerySet(models.QuerySet):
+    """Queryset for the ingredients of recipes"""
+
+    def set_for_recipe(self, recipe, amounts):
+        """makes the ingredients in amounts the recipe's only ones
+
+        amounts maps ingredient ids to (quantity, unit), or to None to
+        keep the amount an ingredient already has. Django 2.1 refuses
+        add() and set() on relations with a through model, so rows are
+        written here with at most one insert, update and delete. None of
+        them send m2m_changed, so ingredients_set is sent instead.
+        """
+        rows = self.using(recipe._state.db or self.db)
+        current = {
+            row.ingredient_id: row for row in rows.filter(recipe=recipe)
+        }
+        stale = [
+            row.pk for ingredient_id, row in current.items()
+            if ingredient_id not in amounts
+        ]
+        added = []
+        changed = {}
+        for ingredient_id, amount in amounts.items():
+            row = current.get(ingredient_id)
+            if row is None:
+                quantity, unit = amount or (None, '')
+                added.append(self.model(
+                    recipe=recipe,
+                    ingredient_id=ingredient_id,
+                    quantity=quantity,
+                    unit=unit
+                ))
+            elif amount is not None and (row.quantity, row.unit) != amount:
+                changed[row.pk] = amount
+        if not (stale or added or changed):
+            return
+
+        if stale:
+            rows.filter(pk__in=stale).delete()
+        if added:
+            rows.bulk_create(added)
+        if changed:
+            rows.filter(pk__in=changed).update(
+                quantity=models.Case(
+                    *[models.When(pk=pk, then=models.Value(quantity))
+                      for pk, (quantity, _) in changed.items()],
+                    output_field=models.DecimalField()
+                ),
+                unit=models.Case(
+                    *[models.When(pk=pk, then=models.Value(unit))
+                      for pk, (_, unit) in changed.items()],
+                    output_field=models.CharField()
+                )
+            )
+        ingredients_set.send(
+            sender=Recipe,
+            instances=[recipe],
+            using=rows.db
+        )
+
+
+RecipeIngredientManager = models.Manager.from_queryset(
+    RecipeIngredientQuerySet
+)
+
+
+class RecipeIngredient(models.Model):
+    """An ingredient of a recipe and how much of it the recipe needs"""
+    recipe = models.ForeignKey(
+        'Recipe',
+        on_delete=models.CASCADE,
+        related_name='ingredient_amounts'
+    )
+    ingredient = models.ForeignKey(
+        'Ingredient',
+        on_delete=models.CASCADE
+    )
+    quantity = models.DecimalField(
+        max_digits=10,
+        decimal_places=3,
+        null=True,
+        blank=True
+    )
+    unit = models.CharField(
+        max_length=8,
+        blank=True,
+        choices=[(unit, unit or 'item') for unit in INGREDIENT_UNITS]
+    )
+
+    objects = RecipeIngredientManager()
+
+    class Meta:
+        # the table of the plain many to many field this replaced
+        db_table = 'core_recipe_ingredients'
+        unique_together = (('recipe', 'ingredient'),)
+
+    def __str__(self):
+        return f'ingredient {self.ingredient_id} of recipe {self.recipe_id}'
+
+
+class RecipeStats(models.Model):
+    """Running aggregates over a user's recipes, one row per user"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='recipe_stats'
+    )
+    recipe_count = models.PositiveIntegerField(default=0)
+    price_total = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0
+    )
+    # JSON encoded {key: count} maps, keyed by price in cents, time bucket
+    # label, tag id and ingredient id respectively
+    price_counts = models.TextField(default='{}')
+    time_histogram = models.TextField(default='{}')
+    tag_counts = models.TextField(default='{}')
+    ingredient_counts = models.TextField(default='{}')
+
+    objects = UserOwnedManager()
+
+    def __str__(self):
+        return f'{self.user} ({self.recipe_count} recipes)'
+
+
+class IdempotencyKey(models.Model):
+    """The stored outcome of a request sent with an Idempotency-Key"""
+    IN_PROGRESS = 'in_progress'
+    DONE = 'done'
+    STATUS_CHOICES = (
+        (IN_PROGRESS, 'In progress'),
+        (DONE, 'Done'),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=IN_PROGRESS
+    )
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.TextField(blank=True)
+    response_headers = models.TextField(default='{}')
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    objects = UserOwnedManager()
+
+    class Meta:
+        unique_together = (('user', 'key'),)
+
+    def __str__(self):
+        return f'{self.key} ({self.status})'
+
+
+class Change(models.Model):
+    """An entry in a user's change log, read by the sync endpoint"""
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    ACTION_CHOICES = (
+        (UPSERT, 'Created or updated'),
+        (DELETE, 'Deleted'),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    seq = models.BigIntegerField()
+    kind = models.CharField(max_length=16)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=8, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = UserOwnedManager()
+
+    class Meta:
+        unique_together = (('user', 'seq'),)
+
+    def __str__(self):
+        return f'#{self.seq} {self.action} {self.kind} {self.object_id}'
+
+
+class ChangeCounter(models.Model):
+    """The last change log sequence number handed out for a user"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='change_counter'
+    )
+    last_seq = models.BigIntegerField(default=0)
+    # entries up to this one were pruned, older cursors need a snapshot
+    pruned_seq = models.BigIntegerField(default=0)
+
+    objects = UserOwnedManager()
+
+    def __str__(self):
+        return f'{self.user} at #{self.last_seq}'
+
+
+class Follow(models.Model):
+    """A user following another user's public recipes"""
+    follower = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    followee = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = (('follower', 'followee'),)
+        indexes = [
+            models.Index(
+                fields=['followee', 'follower'],
+                name='core_follow_followee_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.follower_id} follows {self.followee_id}'
+
+
+class TimelineEntry(models.Model):
+    """A public recipe in a follower's precomputed feed
+
+    Rows are written by the recipe.fan_out job and live on the shard of
+    the user reading the feed, while the recipe lives on its author's.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    recipe_id = models.IntegerField(db_index=True)
+    author_id = models.IntegerField()
+    published_at = models.DateTimeField()
+
+    objects = UserOwnedManager()
+
+    class Meta:
+        unique_together = (('user', 'recipe_id'),)
+        indexes = [
+            models.Index(
+                fields=['user', '-published_at', '-recipe_id'],
+                name='core_timeline_feed_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'recipe {self.recipe_id} for {self.user_id}'
+
+
+class ImageBlob(models.Model):
+    """A stored file and how many model fields reference it"""
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count} references)'
+
+
+class ShardAssignment(models.Model):
+    """Directory entry mapping a user to the shard holding their data"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='shard_assignment'
+    )
+    alias = models.CharField(max_length=64)
+    # set while the user's rows are copied to another shard
+    moving = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'{self.user} on {self.alias}'
+
+
+class Job(models.Model):
+    """A unit of background work claimed and run by run_worker"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=255)
+    payload = models.TextField(default='{}')
+    priority = models.IntegerField(default=0)
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=QUEUED
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=255, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
@@ -0,0 +1,389 @@
+import base64
+import hashlib
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.signing import Signer
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+
+try:
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+
+MISSING_CODES = ('404', 'NoSuchKey', 'NotFound')
+
+# put_object parameters that sign each header of a presigned PUT
+HEADER_PARAMS = {
+    'content-type': ('ContentType', str),
+    'content-length': ('ContentLength', int),
+    'x-amz-checksum-sha256': ('ChecksumSHA256', str),
+}
+
+
+class ObjectStoreError(Exception):
+    """An object store refused a request"""
+
+
+def content_type(key):
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+def upload_headers(content_type, size, sha256):
+    """the headers a presigned PUT of a file must be sent with
+
+    Stores reject the upload unless its type and length are the ones
+    signed and its body hashes to sha256, a hex digest.
+    """
+    return {
+        'Content-Type': content_type,
+        'Content-Length': str(size),
+        'x-amz-checksum-sha256': base64.b64encode(
+            bytes.fromhex(sha256)
+        ).decode(),
+    }
+
+
+class LocalObjectStore:
+    """Stand-in for S3 that keeps objects as files below MEDIA_ROOT
+
+    Objects live at the same path as FileSystemStorage would use, so
+    switching stores needs no copying. Multipart uploads are staged in
+    .multipart/ and joined on completion. Presigned URLs point at
+    core.views.ObjectView and carry an HMAC made with SECRET_KEY of the
+    method, key, expiry and the headers an upload must send.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or settings.MEDIA_ROOT
+        self.signer = Signer(salt='core.objectstore')
+
+    def path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(os.path.abspath(self.root) + os.sep):
+            raise ObjectStoreError(f'{key} is outside the store')
+
+        return path
+
+    def _write(self, path, chunks, sha256=None):
+        """writes chunks to path atomically, returns their sha256
+
+        Nothing is stored if sha256 is given and the chunks do not match.
+        """
+        digest = hashlib.sha256()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(
+            dir=os.path.dirname(path),
+            prefix='.tmp-'
+        )
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    file.write(chunk)
+            if sha256 is not None and digest.hexdigest() != sha256:
+                raise ObjectStoreError('checksum mismatch')
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+        return digest.hexdigest()
+
+    def put(self, key, body):
+        return self._write(self.path(key), [body])
+
+    def receive(self, key, chunks, sha256=None):
+        """stores an upload sent to a presigned URL"""
+        return self._write(self.path(key), chunks, sha256)
+
+    def create_multipart_upload(self, key):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._upload_dir(upload_id))
+
+        return upload_id
+
+    def _upload_dir(self, upload_id):
+        return os.path.join(self.root, '.multipart', upload_id)
+
+    def upload_part(self, key, upload_id, number, body):
+        path = os.path.join(self._upload_dir(upload_id), f'{number:05d}')
+        if not os.path.isdir(os.path.dirname(path)):
+            raise ObjectStoreError(f'no upload {upload_id}')
+
+        return self._write(path, [body])
+
+    def complete_multipart_upload(self, key, upload_id, etags):
+        directory = self._upload_dir(upload_id)
+
+        def chunks():
+            for number in range(1, len(etags) + 1):
+                with open(os.path.join(directory, f'{number:05d}'),
+                          'rb') as part:
+                    yield from iter(lambda: part.read(1024 * 1024), b'')
+
+        self._write(self.path(key), chunks())
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def abort_multipart_upload(self, key, upload_id):
+        shutil.rmtree(self._upload_dir(upload_id), ignore_errors=True)
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def head(self, key):
+        """{'size', 'content_type', 'modified'} of an object, or None"""
+        try:
+            stat = os.stat(self.path(key))
+        except FileNotFoundError:
+            return None
+
+        return {
+            'size': stat.st_size,
+            'content_type': content_type(key),
+            'modified': stat.st_mtime,
+        }
+
+    def checksum(self, key):
+        """the sha256 hex digest of an object, or None"""
+        try:
+            with self.open(key) as file:
+                digest = hashlib.sha256()
+                for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        except FileNotFoundError:
+            return None
+
+        return digest.hexdigest()
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix):
+        """yields (key, size, modified) of objects below prefix"""
+        top = os.path.join(self.root, prefix)
+        for directory, _, names in os.walk(top):
+            for name in names:
+                if name.startswith('.tmp-'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                yield key, stat.st_size, stat.st_mtime
+
+    def signature(self, method, key, expires, headers):
+        signed = '\n'.join(
+            f'{name.lower()}:{value}'
+            for name, value in sorted(headers.items())
+        )
+
+        return self.signer.signature(
+            f'{method}\n{key}\n{expires}\n{signed}'
+        )
+
+    def presigned_url(self, key, method='GET', expires_in=3600, headers=None):
+        """a URL that allows one method on key for expires_in seconds
+
+        A PUT must send exactly the headers given here.
+        """
+        expires = int(time.time() + expires_in)
+        query = {
+            'expires': expires,
+            'signature': self.signature(method, key, expires, headers or {}),
+        }
+
+        return f'{reverse("core:object", args=[key])}?{urlencode(query)}'
+
+    def verify(self, method, key, expires, signature, headers=None):
+        """whether a presigned URL is genuine and unexpired"""
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+
+        return expires >= time.time() and constant_time_compare(
+            signature or '',
+            self.signature(method, key, expires, headers or {})
+        )
+
+
+class S3ObjectStore:
+    """Objects in a bucket of S3 or an S3 compatible service
+
+    One boto3 client is shared by every thread, so HTTP connections are
+    pooled, up to OBJECT_STORAGE_MAX_CONNECTIONS of them. Needs boto3.
+    """
+
+    def __init__(self):
+        if boto3 is None:
+            raise ObjectStoreError('S3ObjectStore needs boto3 installed')
+        self.bucket = settings.OBJECT_STORAGE_BUCKET
+        self.client = boto3.client(
+            's3',
+            endpoint_url=settings.OBJECT_STORAGE_ENDPOINT_URL or None,
+            region_name=settings.OBJECT_STORAGE_REGION or None,
+            aws_access_key_id=settings.OBJECT_STORAGE_ACCESS_KEY or None,
+            aws_secret_access_key=settings.OBJECT_STORAGE_SECRET_KEY or None,
+            config=Config(
+                max_pool_connections=settings.OBJECT_STORAGE_MAX_CONNECTIONS,
+                retries={'max_attempts': 5, 'mode': 'standard'},
+                signature_version='s3v4'
+            )
+        )
+
+    def put(self, key, body):
+        response = self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=body,
+            ContentType=content_type(key)
+        )
+
+        return response['ETag'].strip('"')
+
+    def create_multipart_upload(self, key):
+        return self.client.create_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            ContentType=content_type(key)
+        )['UploadId']
+
+    def upload_part(self, key, upload_id, number, body):
+        return self.client.upload_part(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=number,
+            Body=body
+        )['ETag']
+
+    def complete_multipart_upload(self, key, upload_id, etags):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [
+                {'ETag': etag, 'PartNumber': number}
+                for number, etag in enumerate(etags, 1)
+            ]}
+        )
+
+    def abort_multipart_upload(self, key, upload_id):
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id
+        )
+
+    def open(self, key):
+        """downloads an object into a seekable temporary file"""
+        file = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        try:
+            self.client.download_fileobj(self.bucket, key, file)
+        except ClientError as exc:
+            file.close()
+            if exc.response['Error']['Code'] in MISSING_CODES:
+                raise FileNotFoundError(key) from exc
+            raise
+        file.seek(0)
+
+        return file
+
+    def head(self, key):
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as exc:
+            if exc.response['Error']['Code'] in MISSING_CODES:
+                return None
+            raise
+
+        return {
+            'size': response['ContentLength'],
+            'content_type': response.get('ContentType', ''),
+            'modified': response['LastModified'].timestamp(),
+        }
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list(self, prefix):
+        pages = self.client.get_paginator('list_objects_v2').paginate(
+            Bucket=self.bucket,
+            Prefix=prefix
+        )
+        for page in pages:
+            for item in page.get('Contents', ()):
+                yield (
+                    item['Key'],
+                    item['Size'],
+                    item['LastModified'].timestamp()
+                )
+
+    def checksum(self, key):
+        """the sha256 S3 verified on upload as a hex digest, or None"""
+        try:
+            response = self.client.head_object(
+                Bucket=self.bucket,
+                Key=key,
+                ChecksumMode='ENABLED'
+            )
+        except ClientError as exc:
+            if exc.response['Error']['Code'] in MISSING_CODES:
+                return None
+            raise
+        checksum = response.get('ChecksumSHA256')
+        if not checksum or '-' in checksum:
+            return None
+
+        return base64.b64decode(checksum).hex()
+
+    def presigned_url(self, key, method='GET', expires_in=3600, headers=None):
+        params = {'Bucket': self.bucket, 'Key': key}
+        for name, value in (headers or {}).items():
+            param, convert = HEADER_PARAMS[name.lower()]
+            params[param] = convert(value)
+
+        return self.client.generate_presigned_url(
+            'put_object' if method == 'PUT' else 'get_object',
+            Params=params,
+            ExpiresIn=expires_in
+        )
+
+
+_store = None
+_store_key = None
+_lock = threading.Lock()
+
+
+def store():
+    """the shared store OBJECT_STORAGE_BACKEND names"""
+    global _store, _store_key
+    key = (
+        settings.OBJECT_STORAGE_BACKEND,
+        settings.OBJECT_STORAGE_BUCKET,
+        settings.MEDIA_ROOT,
+    )
+    with _lock:
+        if _store is None or _store_key != key:
+            _store = import_string(settings.OBJECT_STORAGE_BACKEND)()
+            _store_key = key
+
+        return _store
@@ -0,0 +1,37 @@
+import io
+import re
+
+from django.conf import settings
+
+from rest_framework.parsers import JSONParser
+
+from core.renderers import FastJSONRenderer, orjson
+
+
+# orjson reads integers wider than 64 bits as floats
+LONG_NUMBER = re.compile(rb'\d{19}')
+
+
+class FastJSONParser(JSONParser):
+    """JSON parser that uses orjson when it is installed
+
+    Bodies orjson rejects or could read differently, and bodies in
+    charsets other than UTF-8, are parsed by JSONParser so the accepted
+    input, the parsed values and the error messages stay the same.
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower() not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        if not LONG_NUMBER.search(body):
+            try:
+                return orjson.loads(body)
+            except orjson.JSONDecodeError:
+                pass
+
+        return super().parse(io.BytesIO(body), media_type, parser_context)
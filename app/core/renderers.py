@@ -0,0 +1,89 @@
+import math
+import re
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+LINE_SEPARATORS = (
+    ('\u2028'.encode(), b'\\u2028'),
+    ('\u2029'.encode(), b'\\u2029'),
+)
+
+# orjson writes floats from 1e16 up as 1e16 where json writes 1e+16, and
+# those below 1e-4 as 0.00001 where json writes 1e-05. Output that holds such
+# a float is rendered by json instead. EXPONENT and SMALL_FLOAT are a quick
+# check that also matches text such as "One-pot" or "#e0a0b0"; when they hit,
+# strings are cut out and only numbers, and numeric keys, are looked at.
+EXPONENT = re.compile(rb'e[-0-9]')
+SMALL_FLOAT = b'0.0000'
+STRING = re.compile(rb'("[-+.0-9e]+")|"(?:[^"\\]|\\.)*"')
+AWKWARD_FLOAT = re.compile(rb'[0-9]e|0\.0000')
+
+
+def has_non_finite_float(value):
+    """whether data holds a NaN or infinity, which orjson writes as null"""
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(map(has_non_finite_float, value.values()))
+    if isinstance(value, (list, tuple)):
+        return any(map(has_non_finite_float, value))
+
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSON renderer that uses orjson when it is installed
+
+    The output is byte for byte what JSONRenderer produces for compact,
+    unicode, strict JSON: Decimal, datetime and lazy strings go through
+    DRF's encoder, U+2028 and U+2029 are escaped. Indented output, other
+    JSON settings, values orjson cannot encode, such as integers wider
+    than 64 bits, and floats orjson writes differently, NaN and infinity
+    included, use the stdlib json path of JSONRenderer, which raises for
+    NaN.
+    """
+    encoder = encoders.JSONEncoder()
+
+    def use_fast_path(self, indent):
+        return (
+            orjson is not None and indent is None and self.compact and
+            not self.ensure_ascii
+        )
+
+    def has_awkward_float(self, ret, data):
+        """whether orjson wrote a float differently from json"""
+        if SMALL_FLOAT in ret or EXPONENT.search(ret):
+            if AWKWARD_FLOAT.search(STRING.sub(rb'\1', ret)):
+                return True
+        return b'null' in ret and has_non_finite_float(data)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if not self.use_fast_path(indent):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder.default,
+                option=orjson.OPT_NON_STR_KEYS |
+                orjson.OPT_PASSTHROUGH_DATETIME
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.has_awkward_float(ret, data):
+            return super().render(data, accepted_media_type, renderer_context)
+        for separator, escaped in LINE_SEPARATORS:
+            if separator in ret:
+                ret = ret.replace(separator, escaped)
+
+        return ret
@@ -0,0 +1,147 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.utils import DatabaseError
+
+
+_state = threading.local()
+
+
+def allow_replica_reads(allowed):
+    """lets reads on the current thread go to a replica (or stops them)
+
+    The replica is picked at the first read and kept until reads are
+    allowed or stopped again, so one request never mixes replicas that
+    lag by different amounts.
+    """
+    _state.replica_reads = allowed
+    _state.replica = None
+
+
+def replica_reads_allowed():
+    """whether reads on the current thread may go to a replica"""
+    return getattr(_state, 'replica_reads', False)
+
+
+def current_replica():
+    """the replica reads on the current thread go to, if one was picked"""
+    return getattr(_state, 'replica', None) or None
+
+
+class ReplicaPool:
+    """Tracks which configured replicas are healthy enough to read from"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = {}
+        self._healthy = {}
+
+    def probe(self, alias):
+        """runs a trivial query against a replica"""
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+    def is_healthy(self, alias):
+        """returns replica health, re-probing at most once per interval"""
+        now = time.monotonic()
+        interval = settings.REPLICA_HEALTH_CHECK_INTERVAL
+        with self._lock:
+            if now - self._checked.get(alias, -interval) < interval:
+                return self._healthy.get(alias, False)
+            self._checked[alias] = now
+        try:
+            self.probe(alias)
+            healthy = True
+        except DatabaseError as exc:
+            from core.timeouts import is_statement_timeout
+
+            if is_statement_timeout(exc):
+                # the request ran out of time, which says nothing about
+                # the replica, so check it again next time
+                with self._lock:
+                    self._checked.pop(alias, None)
+                raise
+            healthy = False
+        self._healthy[alias] = healthy
+
+        return healthy
+
+    def mark_unhealthy(self, alias):
+        """takes a replica out of rotation until its next health check"""
+        with self._lock:
+            self._checked[alias] = time.monotonic()
+            self._healthy[alias] = False
+
+    def choose(self):
+        """returns a random healthy replica alias, or None"""
+        candidates = [
+            alias for alias in settings.DATABASE_REPLICAS
+            if self.is_healthy(alias)
+        ]
+        return random.choice(candidates) if candidates else None
+
+
+replicas = ReplicaPool()
+
+
+class ShardRouter:
+    """Sends user owned rows to the shard their owner lives on"""
+
+    def _db_for_owner(self, model, hints, for_write=False):
+        from core.sharding import is_sharded, owner_id, shard_for_user
+
+        if not is_sharded(model):
+            return None
+        user_id = owner_id(hints.get('instance'))
+        if user_id is None:
+            return None
+
+        return shard_for_user(user_id, for_write=for_write)
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_owner(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_owner(model, hints, for_write=True)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        from core.sharding import is_sharded
+
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return True
+
+        return None
+
+
+class ReplicaRouter:
+    """Sends reads to a replica when the current request allows it"""
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or not replica_reads_allowed():
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if getattr(_state, 'replica', None) is None:
+            # False remembers that no replica was healthy
+            _state.replica = replicas.choose() or False
+
+        return _state.replica or None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+
+        return None
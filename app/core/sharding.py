@@ -0,0 +1,218 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.models import Tag, Ingredient, Recipe, RecipeIngredient, \
+                        RecipeStats, IdempotencyKey, Change, ChangeCounter, \
+                        ShardAssignment, TimelineEntry
+
+
+# User owned models in the order they are copied to a new shard, with the
+# lookup from each model to its owner. Rows are deleted in reverse order.
+OWNED_MODELS = [
+    (Tag, 'user_id'),
+    (Ingredient, 'user_id'),
+    (Recipe, 'user_id'),
+    (Recipe.tags.through, 'recipe__user_id'),
+    (RecipeIngredient, 'recipe__user_id'),
+    (RecipeStats, 'user_id'),
+    (IdempotencyKey, 'user_id'),
+    (Change, 'user_id'),
+    (ChangeCounter, 'user_id'),
+    (TimelineEntry, 'user_id'),
+]
+
+
+class UserMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The account is being moved, try again later.'
+    default_code = 'user_moving'
+
+
+def sharding_enabled():
+    """whether user owned data is partitioned across DATABASE_SHARDS"""
+    return bool(settings.DATABASE_SHARDS)
+
+
+def is_sharded(model):
+    """whether rows of the model live on their owner's shard"""
+    return sharding_enabled() and any(
+        model._meta.label_lower == owned._meta.label_lower
+        for owned, _ in OWNED_MODELS
+    )
+
+
+def owner_id(instance):
+    """returns the id of the user owning a model instance, if any"""
+    if instance is None:
+        return None
+    if isinstance(instance, get_user_model()):
+        return instance.pk
+
+    return getattr(instance, 'user_id', None)
+
+
+def default_shard(user_id):
+    """the shard a user is placed on before any rebalancing"""
+    return settings.DATABASE_SHARDS[user_id % len(settings.DATABASE_SHARDS)]
+
+
+def _cache_key(user_id):
+    return f'shard-map:{user_id}'
+
+
+def mirror_user(user_id, alias):
+    """creates the placeholder user row shard foreign keys point at"""
+    get_user_model().objects.using(alias).get_or_create(
+        id=user_id,
+        defaults={
+            'email': f'user-{user_id}@shard.invalid',
+            'password': '!',
+        }
+    )
+
+
+def shard_for_user(user_id, for_write=False):
+    """returns the database alias holding the user's data
+
+    Writes to a user who is being moved to another shard raise UserMoving.
+    """
+    if not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    key = _cache_key(user_id)
+    entry = cache.get(key)
+    if entry is None:
+        assignment, _ = ShardAssignment.objects.using(
+            DEFAULT_DB_ALIAS
+        ).get_or_create(
+            user_id=user_id,
+            defaults={'alias': default_shard(user_id)}
+        )
+        entry = (assignment.alias, assignment.moving)
+        mirror_user(user_id, assignment.alias)
+        cache.set(key, entry, settings.SHARD_MAP_CACHE_SECONDS)
+    alias, moving = entry
+    if for_write and moving:
+        raise UserMoving()
+
+    return alias
+
+
+def _assign(user_id, alias, moving):
+    """points the directory at a shard and drops this process' cached copy"""
+    ShardAssignment.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+        user_id=user_id,
+        defaults={'alias': alias, 'moving': moving}
+    )
+    cache.delete(_cache_key(user_id))
+
+
+def _wait_for_shard_map():
+    """waits until no process can still use an assignment cached before"""
+    time.sleep(settings.SHARD_MAP_CACHE_SECONDS)
+
+
+def _batches(queryset, batch_size):
+    """yields model instances in primary key ordered batches"""
+    last_pk = None
+    while True:
+        batch = queryset.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def move_user(user_id, target, batch_size=1000):
+    """copies a user's rows to another shard, repoints them and cleans up
+
+    The user is marked as moving and their writes fail with UserMoving
+    until the move is done. Processes may have the assignment cached for
+    SHARD_MAP_CACHE_SECONDS, so the copy starts once every process has
+    seen the mark and the source rows are deleted once every process has
+    seen the new shard.
+    """
+    source = shard_for_user(user_id)
+    if source == target:
+        return 0
+
+    _assign(user_id, source, moving=True)
+    try:
+        _wait_for_shard_map()
+        mirror_user(user_id, target)
+        moved = 0
+        with transaction.atomic(using=target):
+            for model, lookup in OWNED_MODELS:
+                rows = model.objects.using(source).filter(
+                    **{lookup: user_id}
+                )
+                for batch in _batches(rows, batch_size):
+                    model.objects.using(target).bulk_create(batch)
+                    moved += len(batch)
+    except BaseException:
+        _assign(user_id, source, moving=False)
+        raise
+
+    _assign(user_id, target, moving=False)
+    _wait_for_shard_map()
+
+    with transaction.atomic(using=source):
+        for model, lookup in reversed(OWNED_MODELS):
+            rows = model.objects.using(source).filter(**{lookup: user_id})
+            for batch in _batches(rows.only('pk'), batch_size):
+                model.objects.using(source).filter(
+                    pk__in=[row.pk for row in batch]
+                ).delete()
+
+    return moved
+
+
+def offset_sequences(alias, start):
+    """makes new rows on a shard take ids from a block no other shard uses
+
+    Keeping id blocks disjoint lets users move between shards with their
+    ids intact.
+    """
+    connection = connections[alias]
+    if connection.vendor not in ('postgresql', 'mysql', 'sqlite'):
+        raise ImproperlyConfigured(
+            f'Shards on {connection.vendor} are not supported, '
+            f'use PostgreSQL, MySQL or SQLite for {alias}'
+        )
+    tables = [
+        model._meta.db_table for model, _ in OWNED_MODELS
+        if model._meta.pk.get_internal_type() == 'AutoField'
+    ]
+    with connection.cursor() as cursor:
+        for table in tables:
+            cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}')
+            next_id = max(cursor.fetchone()[0], start, 1)
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)",
+                    [table, next_id]
+                )
+            elif connection.vendor == 'sqlite':
+                cursor.execute(
+                    'DELETE FROM sqlite_sequence WHERE name = %s',
+                    [table]
+                )
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) '
+                    'VALUES (%s, %s)',
+                    [table, next_id]
+                )
+            else:
+                cursor.execute(
+                    f'ALTER TABLE {table} AUTO_INCREMENT = {next_id + 1:d}'
+                )
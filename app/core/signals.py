@@ -0,0 +1,79 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save, \
+                                     pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Follow, ImageBlob, Recipe
+
+
+def _image_name(instance):
+    """the stored image name, or None if the field was deferred"""
+    if 'image' not in instance.__dict__:
+        return None
+    value = instance.__dict__['image']
+
+    return getattr(value, 'name', value) or ''
+
+
+def _adjust_references(name, delta):
+    if name:
+        ImageBlob.objects.filter(name=name).update(
+            ref_count=F('ref_count') + delta,
+            updated_at=timezone.now()
+        )
+
+
+@receiver(post_init, sender=Recipe)
+def remember_image(sender, instance, **kwargs):
+    instance._saved_image = _image_name(instance)
+
+
+@receiver(pre_save, sender=Recipe)
+def load_saved_image(sender, instance, raw, using, update_fields, **kwargs):
+    """looks up the previous image of instances loaded without it"""
+    if instance._saved_image is not None or instance.pk is None:
+        return
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    saved = sender._base_manager.using(using).filter(
+        pk=instance.pk
+    ).values_list('image', flat=True).first()
+    instance._saved_image = saved or ''
+
+
+@receiver(post_save, sender=Recipe)
+def count_image_references(sender, instance, update_fields, **kwargs):
+    """moves a reference from the previous image to the current one"""
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    current = _image_name(instance)
+    previous = instance._saved_image or ''
+    if current is None or current == previous:
+        return
+    _adjust_references(current, 1)
+    _adjust_references(previous, -1)
+    instance._saved_image = current
+
+
+@receiver(post_delete, sender=Recipe)
+def release_image(sender, instance, **kwargs):
+    _adjust_references(_image_name(instance) or instance._saved_image, -1)
+
+
+def _adjust_followers(user_id, delta):
+    get_user_model().objects.filter(pk=user_id).update(
+        follower_count=F('follower_count') + delta
+    )
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        _adjust_followers(instance.followee_id, 1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_unfollow(sender, instance, **kwargs):
+    _adjust_followers(instance.followee_id, -1)
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, Storage
+from django.utils import timezone
+
+from core import objectstore
+
+
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+def content_hash(content):
+    """sha256 hex digest of a file, read one chunk at a time"""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def hashed_name(name, digest):
+    """the content addressed name for a file uploaded as name"""
+    extension = os.path.splitext(name)[1].lower()
+
+    return os.path.join(
+        os.path.dirname(name),
+        digest[:2],
+        digest[2:4],
+        f'{digest}{extension}'
+    )
+
+
+def is_hashed_name(name):
+    """whether a stored name was produced by ContentAddressed"""
+    return bool(HASHED_NAME.search(name))
+
+
+class ContentAddressed:
+    """Stores files once under a name derived from their sha256
+
+    A mixin for any Storage. Files land in two levels of fan-out
+    directories below the directory upload_to chose, e.g.
+    uploads/recipe/3f/a2/3fa2...c1.jpg. Identical uploads share one file,
+    and since a name never changes content it can be cached forever. Each
+    file has an ImageBlob row counting the model fields that reference
+    it; referenced files are never deleted. Two uploads of the same bytes
+    racing past the exists() check both write the hashed name, which
+    holds the same bytes either way, so neither gets a suffixed copy.
+    """
+
+    def save(self, name, content, max_length=None):
+        from core.models import ImageBlob
+
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = hashed_name(name, content_hash(content))
+        if self.exists(name):
+            ImageBlob.objects.filter(name=name).update(
+                updated_at=timezone.now()
+            )
+        else:
+            name = super().save(name, content, max_length=max_length)
+        self.register(name, content.size)
+
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def register(self, name, size):
+        """tracks a file that was stored under its hashed name"""
+        from core.models import ImageBlob
+
+        ImageBlob.objects.get_or_create(name=name, defaults={'size': size})
+
+    def delete(self, name):
+        from core.models import ImageBlob
+
+        if ImageBlob.objects.filter(name=name, ref_count__gt=0).exists():
+            return
+        super().delete(name)
+        ImageBlob.objects.filter(name=name).delete()
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def upload_executor(workers):
+    """a shared pool of workers threads multipart uploads send parts on"""
+    with _executors_lock:
+        if workers not in _executors:
+            _executors[workers] = ThreadPoolExecutor(workers)
+
+        return _executors[workers]
+
+
+class ObjectStorage(Storage):
+    """Keeps files in the object store OBJECT_STORAGE_BACKEND names
+
+    Files larger than part_size, OBJECT_STORAGE_PART_SIZE by default, are
+    sent as a multipart upload. Parts are read one after another but
+    uploaded on a shared pool of OBJECT_STORAGE_UPLOAD_WORKERS threads,
+    with at most twice that many parts held in memory. url() is a
+    presigned URL, so clients download straight from the store.
+    """
+
+    def __init__(self, part_size=None, workers=None):
+        self.part_size = part_size
+        self.workers = workers
+
+    def _save(self, name, content):
+        store = objectstore.store()
+        part_size = self.part_size or settings.OBJECT_STORAGE_PART_SIZE
+        workers = self.workers or settings.OBJECT_STORAGE_UPLOAD_WORKERS
+        content.seek(0)
+        if content.size <= part_size:
+            store.put(name, content.read())
+            return name
+
+        upload_id = store.create_multipart_upload(name)
+        slots = threading.BoundedSemaphore(2 * workers)
+        futures = []
+        try:
+            for number, part in enumerate(
+                iter(lambda: content.read(part_size), b''),
+                1
+            ):
+                slots.acquire()
+                future = upload_executor(workers).submit(
+                    store.upload_part,
+                    name,
+                    upload_id,
+                    number,
+                    part
+                )
+                future.add_done_callback(lambda done: slots.release())
+                futures.append(future)
+            etags = [future.result() for future in futures]
+            store.complete_multipart_upload(name, upload_id, etags)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            store.abort_multipart_upload(name, upload_id)
+            raise
+
+        return name
+
+    def _open(self, name, mode='rb'):
+        return File(objectstore.store().open(name), name)
+
+    def delete(self, name):
+        objectstore.store().delete(name)
+
+    def exists(self, name):
+        return objectstore.store().head(name) is not None
+
+    def size(self, name):
+        head = objectstore.store().head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+
+        return head['size']
+
+    def url(self, name):
+        return objectstore.store().presigned_url(
+            name,
+            expires_in=settings.OBJECT_STORAGE_URL_EXPIRY
+        )
+
+    def listdir(self, path):
+        prefix = path.rstrip('/') + '/' if path else ''
+        directories, files = set(), []
+        for key, _, _ in objectstore.store().list(prefix):
+            head, _, tail = key[len(prefix):].partition('/')
+            if tail:
+                directories.add(head)
+            else:
+                files.append(head)
+
+        return sorted(directories), files
+
+
+class ContentAddressedStorage(ContentAddressed, FileSystemStorage):
+    """ContentAddressed files below MEDIA_ROOT
+
+    Files are written under a temporary name and renamed onto their
+    hashed name, so a reader never sees a partly written file and a
+    concurrent upload of the same bytes simply replaces it.
+    """
+
+    def _save(self, name, content):
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        try:
+            os.replace(self.path(temporary), self.path(name))
+        except BaseException:
+            os.unlink(self.path(temporary))
+            raise
+
+        return name
+
+
+class ContentAddressedObjectStorage(ContentAddressed, ObjectStorage):
+    """ContentAddressed files in the object store"""
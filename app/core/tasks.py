@@ -0,0 +1,17 @@
+from django.core.files.storage import default_storage
+
+from core.deletion import delete_user
+from core.jobs import task
+
+
+@task(name='core.delete_files')
+def delete_files(names):
+    """removes stored files, skipping ones still referenced"""
+    for name in names:
+        default_storage.delete(name)
+
+
+@task(name='core.delete_user')
+def delete_user_data(user_id):
+    """deletes a deactivated user and everything they own"""
+    delete_user(user_id)
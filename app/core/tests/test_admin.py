@@ -1,7 +1,12 @@
+from unittest.mock import patch, MagicMock
+
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from core.admin import EstimatedCountPaginator
+from core.models import Recipe, Tag
+
 
 class AdminSiteTests(TestCase):
 
@@ -41,3 +46,87 @@ class AdminSiteTests(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
+
+
+class RecipeAdminTests(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email='admin@testuser.com',
+            password="password123",
+        )
+        self.client.force_login(self.admin_user)
+
+    def sample_recipes(self, count, title='Soup'):
+        for number in range(count):
+            recipe = Recipe.objects.create(
+                user=self.admin_user,
+                title=f'{title} {number}',
+                time_minutes=5,
+                price=1
+            )
+            tags, _ = Tag.objects.get_or_create_names(
+                self.admin_user,
+                ['Vegan']
+            )
+            recipe.tags.add(*tags)
+
+    def test_recipe_changelist_queries_do_not_grow(self):
+        """the recipe changelist does not run a query per row"""
+        url = reverse('admin:core_recipe_changelist')
+        self.sample_recipes(2)
+        with self.assertNumQueries(4):
+            self.client.get(url)
+        self.sample_recipes(20)
+
+        with self.assertNumQueries(4):
+            res = self.client.get(url)
+
+        self.assertContains(res, 'Soup 19')
+        self.assertContains(res, self.admin_user.email)
+
+    def test_recipe_change_page(self):
+        """the recipe change page renders with lookup widgets"""
+        self.sample_recipes(1)
+        recipe = Recipe.objects.get()
+        url = reverse('admin:core_recipe_change', args=[recipe.id])
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertContains(res, 'vForeignKeyRawIdAdminField')
+        self.assertContains(res, 'admin-autocomplete')
+
+    def test_search_by_prefix_and_id(self):
+        """search matches title prefixes and ids"""
+        self.sample_recipes(1, title='Curry')
+        self.sample_recipes(1, title='Soup')
+        curry = Recipe.objects.get(title__startswith='Curry')
+        url = reverse('admin:core_recipe_changelist')
+
+        by_prefix = self.client.get(url, {'q': 'Cur'})
+        by_id = self.client.get(url, {'q': str(curry.id)})
+
+        self.assertContains(by_prefix, 'Curry 0')
+        self.assertNotContains(by_prefix, 'Soup 0')
+        self.assertContains(by_id, 'Curry 0')
+        self.assertNotContains(by_id, 'Soup 0')
+
+    def test_estimated_count_on_postgres(self):
+        """unfiltered counts come from pg_class on PostgreSQL"""
+        connection = MagicMock(vendor='postgresql')
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (10000000,)
+        with patch.dict('core.admin.connections', {'default': connection}):
+            paginator = EstimatedCountPaginator(
+                Recipe.objects.order_by('id'),
+                100
+            )
+
+            self.assertEqual(paginator.count, 10000000)
+            filtered = EstimatedCountPaginator(
+                Recipe.objects.filter(title='x').order_by('id'),
+                100
+            )
+        self.assertEqual(filtered.count, 0)
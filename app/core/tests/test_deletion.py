@@ -0,0 +1,174 @@
+import json
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import jobs
+from core.deletion import delete_user
+from core.models import Change, Follow, ImageBlob, Ingredient, Job, \
+                        Recipe, RecipeIngredient, Tag, TimelineEntry
+from core.sharding import OWNED_MODELS
+from recipe import sync
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class DeleteUserTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.other = get_user_model().objects.create_user(
+            'other@test.com',
+            'password123'
+        )
+
+    def sample_recipe(self, user, title='Soup'):
+        recipe = Recipe.objects.create(
+            user=user,
+            title=title,
+            time_minutes=5,
+            price=1
+        )
+        recipe.tags.add(Tag.objects.create(user=user, name=title))
+        RecipeIngredient.objects.create(
+            recipe=recipe,
+            ingredient=Ingredient.objects.create(user=user, name=title)
+        )
+
+        return recipe
+
+    def test_deletes_owned_rows_in_batches(self):
+        """every row the user owns goes, other users' rows stay"""
+        for number in range(5):
+            self.sample_recipe(self.user, f'Recipe {number}')
+        kept = self.sample_recipe(self.other)
+        seen = []
+
+        delete_user(
+            self.user.pk,
+            batch_size=2,
+            progress=lambda model, deleted: seen.append(model)
+        )
+
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+        for model, lookup in OWNED_MODELS:
+            self.assertFalse(
+                model.objects.filter(**{lookup: self.user.pk}).exists(),
+                model._meta.label
+            )
+        self.assertEqual(seen.count(Recipe), 3)
+        self.assertEqual(list(Recipe.objects.all()), [kept])
+        self.assertEqual(kept.tags.count(), 1)
+        self.assertEqual(kept.ingredients.count(), 1)
+        self.assertTrue(Change.objects.filter(user=self.other).exists())
+
+    def test_images_queued_for_removal(self):
+        """recipe images lose their reference and are removed by a job"""
+        recipe = self.sample_recipe(self.user)
+        recipe.image.save('photo.jpg', ContentFile(b'image'))
+        name = recipe.image.name
+        shared = self.sample_recipe(self.other)
+        shared.image.save('photo.jpg', ContentFile(b'shared'))
+        other = self.sample_recipe(self.user, 'Stew')
+        other.image.save('photo.jpg', ContentFile(b'shared'))
+
+        delete_user(self.user.pk)
+
+        job = Job.objects.get(name='core.delete_files')
+        self.assertEqual(
+            json.loads(job.payload),
+            {'names': sorted([name, shared.image.name])}
+        )
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 0)
+        jobs.run_job(jobs.claim('worker'))
+        self.assertFalse(recipe.image.storage.exists(name))
+        self.assertTrue(recipe.image.storage.exists(shared.image.name))
+
+    def test_deletes_logged_to_change_log(self):
+        """clients still syncing are told about every deleted row"""
+        recipe = self.sample_recipe(self.user)
+        tag = recipe.tags.get()
+
+        with patch.object(
+            sync,
+            'record_changes',
+            wraps=sync.record_changes
+        ) as record:
+            delete_user(self.user.pk)
+
+        logged = {
+            (sync.kind_of(instance), instance.pk)
+            for call in record.call_args_list
+            for instance in call[1]['deleted']
+        }
+        self.assertIn(('recipe', recipe.pk), logged)
+        self.assertIn(('tag', tag.pk), logged)
+        self.assertFalse(Change.objects.filter(user=self.user.pk).exists())
+
+    def test_public_recipes_retracted_from_feeds(self):
+        """followers' timelines lose the deleted user's recipes"""
+        recipe = self.sample_recipe(self.user)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            is_public=True,
+            published_at=timezone.now()
+        )
+        TimelineEntry.objects.create(
+            user=self.other,
+            recipe_id=recipe.pk,
+            author_id=self.user.pk,
+            published_at=timezone.now()
+        )
+
+        delete_user(self.user.pk)
+
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_follows_of_deleted_user_not_replayed(self):
+        """only followers of the deleted user get their feed cleared"""
+        Follow.objects.create(follower=self.user, followee=self.other)
+        Follow.objects.create(follower=self.other, followee=self.user)
+        Job.objects.all().delete()
+
+        delete_user(self.user.pk)
+
+        self.assertFalse(Follow.objects.exists())
+        self.assertEqual(
+            [json.loads(job.payload) for job in Job.objects.filter(
+                name='recipe.unfollow'
+            )],
+            [{'follower_id': self.other.pk, 'followee_id': self.user.pk}]
+        )
+
+    def test_delete_user_command(self):
+        """the command deletes the user and reports the rows removed"""
+        self.sample_recipe(self.user)
+        out = StringIO()
+
+        call_command('delete_user', 'test@test.com', stdout=out)
+
+        self.assertIn('Deleted test@test.com', out.getvalue())
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+
+    def test_benchmark_command(self):
+        """the benchmark reports how fast rows were deleted"""
+        out = StringIO()
+        call_command('benchmark_delete_user', recipes=20, stdout=out)
+
+        self.assertIn('rows/s', out.getvalue())
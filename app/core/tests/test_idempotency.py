@@ -0,0 +1,185 @@
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import IdempotencyKey, Recipe, Tag
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+PAYLOAD = {'title': 'Soup', 'time_minutes': 5, 'price': '1.00'}
+
+
+class IdempotencyKeyTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, url=RECIPES_URL, payload=PAYLOAD, key='retry-1'):
+        return self.client.post(
+            url,
+            payload,
+            format='json',
+            HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def sample_key(self, **params):
+        defaults = {
+            'user': self.user,
+            'key': 'retry-1',
+            'fingerprint': 'digest',
+            'expires_at': timezone.now() + timedelta(hours=1),
+        }
+        defaults.update(params)
+
+        return IdempotencyKey.objects.create(**defaults)
+
+    def test_retry_replays_first_response(self):
+        """a retried create returns the stored response"""
+        first = self.post()
+        second = self.post()
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_without_key_every_request_runs(self):
+        """requests without the header are not deduplicated"""
+        self.client.post(RECIPES_URL, PAYLOAD)
+        self.client.post(RECIPES_URL, PAYLOAD)
+
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    def test_keys_are_per_user(self):
+        """the same key from two users creates two recipes"""
+        self.post()
+        self.client.force_authenticate(get_user_model().objects.create_user(
+            'other@test.com',
+            'password123'
+        ))
+        self.post()
+
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    def test_key_reused_for_other_request(self):
+        """a key sent with a different body is rejected"""
+        self.post()
+        response = self.post(payload=dict(PAYLOAD, title='Stew'))
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_failed_requests_not_stored(self):
+        """a request that raised can be retried with the same key"""
+        self.post(url=reverse('recipe:tag-list'), payload={'name': ''})
+        response = self.post(
+            url=reverse('recipe:tag-list'),
+            payload={'name': 'Vegan'}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Tag.objects.filter(name='Vegan').exists())
+
+    @patch('core.idempotency.fingerprint', return_value='digest')
+    def test_duplicate_waits_for_running_request(self, fingerprint):
+        """a duplicate polls until the first request finishes"""
+        record = self.sample_key()
+
+        def finish(seconds):
+            record.status = IdempotencyKey.DONE
+            record.response_status = 201
+            record.response_body = '{"id": 7}'
+            record.save()
+
+        with patch('core.idempotency.time.sleep', side_effect=finish):
+            response = self.post()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'id': 7})
+        self.assertFalse(Recipe.objects.exists())
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    @patch('core.idempotency.fingerprint', return_value='digest')
+    def test_duplicate_gives_up_waiting(self, fingerprint):
+        """a duplicate still running after the wait gets a 409"""
+        self.sample_key()
+
+        response = self.post()
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Recipe.objects.exists())
+
+    @patch('core.idempotency.fingerprint', return_value='digest')
+    def test_dead_and_expired_records_replaced(self, fingerprint):
+        """stale running records and expired results are run again"""
+        self.sample_key(created_at=timezone.now() - timedelta(hours=1))
+        self.post()
+        IdempotencyKey.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.post()
+
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    def test_upload_image_replayed(self):
+        """a retried upload does not store the image again"""
+        recipe = Recipe.objects.create(user=self.user, **PAYLOAD)
+        url = reverse('recipe:recipe-upload-image', args=[recipe.id])
+
+        def upload(ntf):
+            ntf.seek(0)
+            return self.client.post(
+                url,
+                {'image': ntf},
+                format='multipart',
+                HTTP_IDEMPOTENCY_KEY='upload-1'
+            )
+
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (10, 10)).save(ntf, format='JPEG')
+            first = upload(ntf)
+            with patch(
+                'recipe.serializers.RecipeImageSerializer.save'
+            ) as save:
+                second = upload(ntf)
+
+        save.assert_not_called()
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.data, first.data)
+
+    def test_purge_command(self):
+        """expired keys are purged"""
+        self.sample_key(expires_at=timezone.now() - timedelta(seconds=1))
+        self.sample_key(key='fresh')
+        out = StringIO()
+
+        call_command('purge_idempotency_keys', stdout=out)
+
+        self.assertEqual(
+            list(IdempotencyKey.objects.values_list('key', flat=True)),
+            ['fresh']
+        )
+        self.assertIn('Purged 1', out.getvalue())
@@ -0,0 +1,155 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import jobs
+from core.models import Job
+
+
+calls = []
+
+
+@jobs.task(name='test.record')
+def record(**payload):
+    calls.append(payload)
+
+
+@jobs.task(name='test.explode', max_attempts=2)
+def explode(**payload):
+    raise RuntimeError('boom')
+
+
+@jobs.task(name='test.limited', concurrency=1)
+def limited(**payload):
+    calls.append(payload)
+
+
+@jobs.task(name='test.reclaimed')
+def reclaimed(**payload):
+    # another worker took the job over, as after a missed heartbeat
+    Job.objects.update(locked_by='other-worker')
+
+
+@override_settings(JOB_RETRY_BASE_DELAY=10, JOB_RETRY_MAX_DELAY=60)
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_claim_orders_by_priority(self):
+        """higher priority jobs are claimed first"""
+        jobs.enqueue('test.record', {'n': 1})
+        urgent = jobs.enqueue('test.record', {'n': 2}, priority=10)
+
+        job = jobs.claim('worker')
+
+        self.assertEqual(job.pk, urgent.pk)
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.locked_by, 'worker')
+
+    def test_delayed_jobs_wait(self):
+        """jobs are not claimed before their run_at"""
+        jobs.enqueue('test.record', delay=60)
+
+        self.assertIsNone(jobs.claim('worker'))
+
+    def test_run_job_success(self):
+        """a successful job is marked done"""
+        record.enqueue({'n': 1})
+
+        jobs.run_job(jobs.claim('worker'))
+
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(calls, [{'n': 1}])
+
+    def test_failed_job_retried_with_backoff(self):
+        """a failing job is requeued for later until out of attempts"""
+        explode.enqueue()
+
+        jobs.run_job(jobs.claim('worker'))
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=4))
+        self.assertIn('boom', job.last_error)
+
+        Job.objects.update(run_at=timezone.now())
+        jobs.run_job(jobs.claim('worker'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_retry_delay_grows_and_caps(self):
+        """retry delays back off exponentially up to the maximum"""
+        self.assertLessEqual(jobs.retry_delay(1), 10)
+        self.assertGreaterEqual(jobs.retry_delay(3), 20)
+        self.assertLessEqual(jobs.retry_delay(10), 60)
+
+    def test_concurrency_limit(self):
+        """tasks at their concurrency limit are skipped"""
+        limited.enqueue({'n': 1})
+        limited.enqueue({'n': 2})
+        record.enqueue({'n': 3})
+
+        first = jobs.claim('worker')
+        second = jobs.claim('worker')
+
+        self.assertEqual(first.name, 'test.limited')
+        self.assertEqual(second.name, 'test.record')
+        self.assertIsNone(jobs.claim('worker'))
+
+    def test_stale_running_job_reclaimed(self):
+        """jobs locked by a worker that died are claimed again"""
+        record.enqueue()
+        jobs.claim('dead-worker')
+        Job.objects.update(locked_at=timezone.now() - timedelta(days=1))
+
+        job = jobs.claim('worker')
+
+        self.assertEqual(job.locked_by, 'worker')
+        self.assertEqual(job.attempts, 2)
+
+    def test_heartbeat_keeps_long_job_locked(self):
+        """a job whose lock is refreshed is not claimed again"""
+        record.enqueue()
+        job = jobs.claim('worker')
+        Job.objects.update(locked_at=timezone.now() - timedelta(days=1))
+
+        self.assertTrue(jobs.Heartbeat(job).beat())
+        self.assertIsNone(jobs.claim('other-worker'))
+
+    def test_heartbeat_stops_when_lock_lost(self):
+        """a heartbeat does not refresh a lock another worker holds"""
+        record.enqueue()
+        job = jobs.claim('worker')
+        Job.objects.update(locked_by='other-worker')
+
+        self.assertFalse(jobs.Heartbeat(job).beat())
+
+    def test_reclaimed_job_outcome_not_recorded(self):
+        """a worker that lost the lock leaves the new holder's job alone"""
+        reclaimed.enqueue()
+
+        jobs.run_job(jobs.claim('worker'))
+
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertEqual(job.locked_by, 'other-worker')
+        self.assertIsNone(job.finished_at)
+
+    def test_burst_worker_drains_queue(self):
+        """run_worker --burst runs every runnable job and exits"""
+        for n in range(3):
+            record.enqueue({'n': n})
+
+        out = StringIO()
+        call_command('run_worker', '--burst', stdout=out)
+
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 3)
+        self.assertEqual(len(calls), 3)
+        self.assertIn('jobs/s', out.getvalue())
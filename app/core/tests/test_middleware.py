@@ -0,0 +1,82 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import Client, SimpleTestCase, TestCase, \
+                        RequestFactory, override_settings
+from django.urls import reverse
+
+from core.middleware import MiddlewareProfileMiddleware
+
+
+@override_settings(
+    MIDDLEWARE_PROFILES={'default': [], 'api': [], 'admin': []},
+    MIDDLEWARE_PROFILE_ROUTES=(('/api/', 'api'), ('/api/admin/', 'admin'))
+)
+class MiddlewareProfileMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = MiddlewareProfileMiddleware(
+            lambda request: HttpResponse(request.middleware_profile)
+        )
+
+    def test_longest_prefix_wins(self):
+        """the most specific route picks the profile"""
+        self.assertEqual(
+            self.middleware(self.factory.get('/api/admin/x')).content,
+            b'admin'
+        )
+        self.assertEqual(
+            self.middleware(self.factory.get('/api/recipe/')).content,
+            b'api'
+        )
+
+    def test_unrouted_paths_use_default(self):
+        """paths without a route run the default profile"""
+        self.assertEqual(
+            self.middleware(self.factory.get('/admin/')).content,
+            b'default'
+        )
+
+
+class MiddlewareProfileRequestTests(TestCase):
+
+    def setUp(self):
+        self.client = Client(enforce_csrf_checks=True)
+
+    def test_api_skips_browser_middleware(self):
+        """API responses skip sessions and frame options"""
+        response = self.client.post(reverse('user:create'), {
+            'email': 'test@test.com',
+            'password': 'password123',
+            'name': 'Test'
+        })
+
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('X-Frame-Options', response)
+        self.assertFalse(hasattr(response.wsgi_request, 'session'))
+
+    def test_admin_runs_full_stack(self):
+        """the admin still gets sessions, CSRF and frame options"""
+        get_user_model().objects.create_superuser(
+            'admin@test.com',
+            'password123'
+        )
+        response = self.client.get(reverse('admin:login'))
+        rejected = self.client.post(reverse('admin:login'), {
+            'username': 'admin@test.com',
+            'password': 'password123'
+        })
+
+        self.assertEqual(response['X-Frame-Options'], 'SAMEORIGIN')
+        self.assertTrue(hasattr(response.wsgi_request, 'session'))
+        self.assertEqual(rejected.status_code, 403)
+
+    def test_benchmark_command(self):
+        """the benchmark reports the time each profile saves"""
+        out = StringIO()
+        call_command('benchmark_middleware', requests=10, stdout=out)
+
+        self.assertIn('api saves', out.getvalue())
@@ -0,0 +1,168 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import skipIf
+from unittest.mock import patch
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from PIL import Image
+
+from core import objectstore
+from core.models import ImageBlob, Recipe
+from core.storage import ObjectStorage
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def jpeg_file():
+    output = io.BytesIO()
+    Image.new('RGB', (20, 10), 'red').save(output, 'JPEG')
+
+    return ContentFile(output.getvalue(), name='photo.jpg')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ObjectStorageTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+        self.store = objectstore.store()
+
+    def test_small_files_put_whole(self):
+        """files up to the part size are a single request"""
+        storage = ObjectStorage(part_size=1024)
+
+        with patch.object(self.store, 'create_multipart_upload') as create:
+            name = storage.save('uploads/small.bin', ContentFile(b'x' * 10))
+
+        create.assert_not_called()
+        self.assertEqual(storage.open(name).read(), b'x' * 10)
+        self.assertEqual(storage.size(name), 10)
+
+    def test_large_files_uploaded_in_parallel_parts(self):
+        """parts of a large file are sent concurrently and joined"""
+        data = os.urandom(10 * 1000 + 7)
+        running = []
+        peak = []
+        lock = threading.Lock()
+        upload_part = self.store.upload_part
+
+        def slow_upload_part(*args):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+            return upload_part(*args)
+
+        storage = ObjectStorage(part_size=1000, workers=4)
+        with patch.object(self.store, 'upload_part',
+                          side_effect=slow_upload_part) as upload:
+            name = storage.save('uploads/large.bin', ContentFile(data))
+
+        self.assertEqual(upload.call_count, 11)
+        self.assertGreater(max(peak), 1)
+        self.assertEqual(storage.open(name).read(), data)
+        self.assertFalse(os.listdir(os.path.join(MEDIA_ROOT, '.multipart')))
+
+    def test_failed_part_aborts_upload(self):
+        """a failing part removes the staged parts and stores nothing"""
+        storage = ObjectStorage(part_size=10, workers=2)
+
+        with patch.object(self.store, 'upload_part',
+                          side_effect=objectstore.ObjectStoreError):
+            with self.assertRaises(objectstore.ObjectStoreError):
+                storage.save('uploads/broken.bin', ContentFile(b'x' * 50))
+
+        self.assertFalse(storage.exists('uploads/broken.bin'))
+        self.assertFalse(os.listdir(os.path.join(MEDIA_ROOT, '.multipart')))
+
+    def test_presigned_urls(self):
+        """presigned URLs serve the object until they expire"""
+        storage = ObjectStorage()
+        name = storage.save('uploads/note.txt', ContentFile(b'hello'))
+        url = storage.url(name)
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), b'hello')
+        self.assertEqual(response['Content-Type'], 'text/plain')
+
+        tampered = url.replace('uploads/note.txt', 'uploads/other.txt')
+        self.assertEqual(
+            self.client.get(tampered).status_code,
+            status.HTTP_403_FORBIDDEN
+        )
+        expired = self.store.presigned_url(name, expires_in=-1)
+        self.assertEqual(
+            self.client.get(expired).status_code,
+            status.HTTP_403_FORBIDDEN
+        )
+
+    def test_keys_outside_store_refused(self):
+        """keys cannot climb out of the store's root"""
+        with self.assertRaises(objectstore.ObjectStoreError):
+            self.store.open('../secret')
+
+    @skipIf(objectstore.boto3 is not None, 'boto3 is installed')
+    def test_s3_store_needs_boto3(self):
+        """the S3 store explains that boto3 is missing"""
+        with self.assertRaises(objectstore.ObjectStoreError):
+            objectstore.S3ObjectStore()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    DEFAULT_FILE_STORAGE='core.storage.ContentAddressedObjectStorage'
+)
+class ObjectStorageRecipeImageTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            time_minutes=5,
+            price='1.00'
+        )
+
+    def test_uploaded_image_downloaded_from_store(self):
+        """uploads land in the store and are linked by presigned URL"""
+        response = self.client.post(
+            reverse('recipe:recipe-upload-image', args=[self.recipe.id]),
+            {'image': jpeg_file()},
+            format='multipart'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertTrue(default_storage.exists(self.recipe.image.name))
+        self.assertEqual(
+            ImageBlob.objects.get(name=self.recipe.image.name).ref_count,
+            1
+        )
+        url = urlsplit(response.data['image'])
+        download = self.client.get(f'{url.path}?{url.query}')
+        self.assertEqual(download.status_code, status.HTTP_200_OK)
+        self.assertEqual(download['Content-Type'], 'image/jpeg')
@@ -0,0 +1,216 @@
+import gzip
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from io import BytesIO
+from unittest import skipIf, skipUnless
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, RequestFactory, \
+                        override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core import middleware, parsers, renderers
+from core.models import Recipe
+
+
+PAYLOAD = [
+    OrderedDict([
+        ('id', 1),
+        ('title', 'Crème brûlée     "quoted"'),
+        ('price', Decimal('5.50')),
+        ('created', datetime(2019, 1, 2, 3, 4, 5, 678901, timezone.utc)),
+        ('uuid', uuid.UUID(int=7)),
+        ('label', ugettext_lazy('Tags')),
+        ('counts', {1: 2, 'three': None}),
+        ('flags', (True, False, 1.5)),
+    ]),
+]
+
+
+class FastJSONRendererTests(SimpleTestCase):
+
+    def assert_same_output(self, data, media_type=None):
+        self.assertEqual(
+            renderers.FastJSONRenderer().render(data, media_type),
+            JSONRenderer().render(data, media_type)
+        )
+
+    @skipUnless(renderers.orjson, 'orjson is not installed')
+    def test_orjson_output_matches_drf(self):
+        """orjson output is byte for byte what JSONRenderer writes"""
+        self.assert_same_output(PAYLOAD)
+        self.assert_same_output({'huge': 2 ** 70})
+        self.assert_same_output(None)
+
+    @skipUnless(renderers.orjson, 'orjson is not installed')
+    def test_floats_match_drf(self):
+        """floats are written as json writes them, exponents included"""
+        for number in (1.5, 0.1 + 0.2, 1e15, 1e16, 1e22, -2.5e300,
+                       0.0001, 1e-05, -9e-05, 1e-07, 5e-324, 0.0, -0.0):
+            self.assert_same_output({'number': number, 'list': [number]})
+        self.assert_same_output({1e16: 'key', 'nested': [[{'n': 1e-05}]]})
+
+    @skipUnless(renderers.orjson, 'orjson is not installed')
+    def test_non_finite_floats_raise(self):
+        """NaN and infinity are rejected, as JSONRenderer rejects them"""
+        for number in (float('nan'), float('inf'), -float('inf')):
+            data = [{'number': None}, {'number': number}]
+            with self.assertRaises(ValueError):
+                JSONRenderer().render(data)
+            with self.assertRaises(ValueError):
+                renderers.FastJSONRenderer().render(data)
+
+    @skipUnless(renderers.orjson, 'orjson is not installed')
+    def test_ordinary_output_stays_on_orjson(self):
+        """payloads without awkward floats never reach the stdlib path"""
+        with patch.object(JSONRenderer, 'render') as render:
+            renderers.FastJSONRenderer().render(PAYLOAD)
+
+        render.assert_not_called()
+
+    @skipUnless(renderers.orjson, 'orjson is not installed')
+    def test_float_like_text_stays_on_orjson(self):
+        """strings that look like exponents do not force the stdlib path"""
+        data = [{
+            'title': 'One-pot stew',
+            'colour': '#e0a0b0',
+            'blurhash': 'LEHV6nWB2yk8pyo0adR*.7kCMdnj',
+            'note': 'serve 0.00001 of a second later',
+            'price': Decimal('5.00'),
+            'rating': 4.5,
+        }] * 100
+
+        with patch.object(JSONRenderer, 'render') as render:
+            ret = renderers.FastJSONRenderer().render(data)
+
+        render.assert_not_called()
+        self.assertEqual(ret, JSONRenderer().render(data))
+
+    def test_fallback_output_matches_drf(self):
+        """without orjson the stdlib path is used"""
+        with patch.object(renderers, 'orjson', None):
+            self.assert_same_output(PAYLOAD)
+
+    def test_indented_output_matches_drf(self):
+        """indented rendering goes through JSONRenderer"""
+        self.assert_same_output(PAYLOAD, 'application/json; indent=4')
+
+
+class FastJSONParserTests(SimpleTestCase):
+
+    def parse(self, body, parser=None):
+        parser = parser or parsers.FastJSONParser()
+        return parser.parse(BytesIO(body))
+
+    def test_parses_like_drf(self):
+        """parsed data matches JSONParser"""
+        body = '{"title": "Crème", "tags": [1, 2], "big": 1e400}'.encode()
+
+        self.assertEqual(self.parse(body), self.parse(body, JSONParser()))
+        self.assertEqual(
+            self.parse(b'{"n": 123456789012345678901234567890}'),
+            {'n': 123456789012345678901234567890}
+        )
+
+    def test_invalid_json_rejected(self):
+        """malformed bodies and NaN raise ParseError"""
+        for body in (b'{"title": ', b'{"price": NaN}'):
+            with self.assertRaises(ParseError):
+                self.parse(body)
+
+    @skipIf(renderers.orjson, 'orjson is installed')
+    def test_works_without_orjson(self):
+        """the stdlib parser is used when orjson is missing"""
+        self.assertEqual(self.parse(b'{"a": 1}'), {'a': 1})
+
+
+@override_settings(COMPRESSION_MIN_SIZE=100)
+class CompressionMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.body = b'{"title": "Soup"}' * 100
+
+    def respond(self, accept, body=None):
+        compress = middleware.CompressionMiddleware(
+            lambda request: HttpResponse(body or self.body)
+        )
+        return compress(self.factory.get('/', HTTP_ACCEPT_ENCODING=accept))
+
+    def test_gzip(self):
+        """gzip is used when the client only accepts gzip"""
+        response = self.respond('gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.body)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    @skipUnless(middleware.brotli, 'brotli is not installed')
+    def test_brotli_preferred(self):
+        """brotli is preferred when the client accepts it"""
+        response = self.respond('gzip, br')
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(
+            middleware.brotli.decompress(response.content),
+            self.body
+        )
+
+    def test_small_and_refused_responses_untouched(self):
+        """short bodies and clients refusing every coding get plain bytes"""
+        for response in (
+            self.respond('gzip', body=b'{}'),
+            self.respond('gzip;q=0, br;q=0'),
+            self.respond(''),
+        ):
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class FastJSONApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_large_recipe_list_compressed(self):
+        """large API responses are compressed end to end"""
+        for number in range(50):
+            Recipe.objects.create(
+                user=self.user,
+                title=f'Recipe {number}',
+                time_minutes=5,
+                price='1.50'
+            )
+
+        response = self.client.get(
+            reverse('recipe:recipe-list'),
+            HTTP_ACCEPT_ENCODING='gzip'
+        )
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'"price":"1.50"', gzip.decompress(response.content))
+
+    def test_json_body_parsed(self):
+        """JSON request bodies go through the fast parser"""
+        response = self.client.post(reverse('recipe:recipe-list'), {
+            'title': 'Soup',
+            'time_minutes': 5,
+            'price': '1.00',
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
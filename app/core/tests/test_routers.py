@@ -0,0 +1,252 @@
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.utils import OperationalError
+from django.http import HttpResponse
+from django.test import SimpleTestCase, RequestFactory, \
+                        TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import routers
+from core.metrics import metrics
+from core.middleware import ReplicaRoutingMiddleware
+from core.models import Recipe
+from core.timeouts import StatementTimeout
+from recipe.views import RecipeViewSet
+
+
+# the replica mirror from app.test_settings, or the replicas configured
+TEST_REPLICAS = getattr(
+    settings,
+    'TEST_DATABASE_REPLICAS',
+    settings.DATABASE_REPLICAS
+)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0', 'replica_1'])
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        routers.replicas = routers.ReplicaPool()
+        patcher = patch.object(routers.ReplicaPool, 'probe')
+        self.probe = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(routers.allow_replica_reads, False)
+
+    def test_reads_go_to_primary_by_default(self):
+        """reads outside a replica-safe request stay on the primary"""
+        self.assertIsNone(self.router.db_for_read(Recipe))
+
+    def test_reads_go_to_replica_when_allowed(self):
+        """reads go to a replica when the request allows it"""
+        routers.allow_replica_reads(True)
+
+        self.assertIn(
+            self.router.db_for_read(Recipe),
+            ['replica_0', 'replica_1']
+        )
+
+    def test_one_replica_per_request(self):
+        """every read of a request goes to the replica picked first"""
+        routers.allow_replica_reads(True)
+        picked = {self.router.db_for_read(Recipe) for _ in range(20)}
+
+        self.assertEqual(len(picked), 1)
+        self.assertEqual(routers.current_replica(), picked.pop())
+
+    def test_writes_go_to_primary(self):
+        """writes never go to a replica"""
+        routers.allow_replica_reads(True)
+
+        self.assertIsNone(self.router.db_for_write(Recipe))
+
+    def test_unhealthy_replica_taken_out_of_rotation(self):
+        """replicas that fail their health check are skipped"""
+        self.probe.side_effect = lambda alias: (
+            alias == 'replica_0' and self.fail_probe()
+        )
+        routers.allow_replica_reads(True)
+
+        for _ in range(10):
+            self.assertEqual(self.router.db_for_read(Recipe), 'replica_1')
+
+    def test_all_replicas_unhealthy_falls_back_to_primary(self):
+        """with no healthy replica reads go to the primary"""
+        self.probe.side_effect = OperationalError
+        routers.allow_replica_reads(True)
+
+        self.assertIsNone(self.router.db_for_read(Recipe))
+
+    def test_health_is_cached_between_checks(self):
+        """replicas are probed at most once per check interval"""
+        routers.allow_replica_reads(True)
+        for _ in range(5):
+            self.router.db_for_read(Recipe)
+
+        self.assertEqual(self.probe.call_count, 2)
+
+    def test_replicas_are_not_migrated(self):
+        """replicas get their schema from replication"""
+        self.assertFalse(self.router.allow_migrate('replica_0', 'core'))
+        self.assertIsNone(self.router.allow_migrate('default', 'core'))
+
+    def fail_probe(self):
+        raise OperationalError('replica down')
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class ReplicaRoutingMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.seen = []
+
+        def get_response(request):
+            self.seen.append(routers.replica_reads_allowed())
+            return HttpResponse()
+
+        self.middleware = ReplicaRoutingMiddleware(get_response)
+        routers.replicas = routers.ReplicaPool()
+        patcher = patch.object(routers.ReplicaPool, 'probe')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(routers.allow_replica_reads, False)
+
+    def test_safe_request_reads_from_replica(self):
+        """GET requests may read from a replica"""
+        self.middleware(self.factory.get('/api/recipe/recipes/'))
+
+        self.assertEqual(self.seen, [True])
+        self.assertFalse(routers.replica_reads_allowed())
+
+    def test_write_pins_client_to_primary(self):
+        """a write pins the client's following reads to the primary"""
+        response = self.middleware(
+            self.factory.post('/api/recipe/recipes/')
+        )
+        request = self.factory.get('/api/recipe/recipes/')
+        request.COOKIES = {
+            key: morsel.value for key, morsel in response.cookies.items()
+        }
+        self.middleware(request)
+
+        self.assertEqual(self.seen, [False, False])
+
+    def test_write_pins_token_client_without_cookies(self):
+        """token clients are pinned through the cache as well"""
+        self.middleware(self.factory.post(
+            '/api/recipe/recipes/',
+            HTTP_AUTHORIZATION='Token pinned'
+        ))
+        self.middleware(self.factory.get(
+            '/api/recipe/recipes/',
+            HTTP_AUTHORIZATION='Token pinned'
+        ))
+        self.middleware(self.factory.get(
+            '/api/recipe/recipes/',
+            HTTP_AUTHORIZATION='Token other'
+        ))
+
+        self.assertEqual(self.seen, [False, False, True])
+
+    def test_forged_pin_cookie_ignored(self):
+        """only pins the middleware signed keep a client on the primary"""
+        request = self.factory.get('/api/recipe/recipes/')
+        request.COOKIES = {settings.REPLICA_PIN_COOKIE: '9999999999'}
+        self.middleware(request)
+
+        self.assertEqual(self.seen, [True])
+
+    @patch('core.middleware.connections')
+    def test_replica_connection_error_marks_unhealthy(self, connections):
+        """a replica failing with a connection error leaves the rotation"""
+        request = self.factory.get('/api/recipe/recipes/')
+        routers.allow_replica_reads(True)
+        routers.ReplicaRouter().db_for_read(Recipe)
+        connections['replica_0'].errors_occurred = True
+
+        self.middleware.process_exception(
+            request,
+            OperationalError('server closed the connection unexpectedly')
+        )
+
+        self.assertFalse(routers.replicas.is_healthy('replica_0'))
+        routers.allow_replica_reads(True)
+        self.assertIsNone(routers.ReplicaRouter().db_for_read(Recipe))
+
+    @patch('core.middleware.connections')
+    def test_statement_timeout_keeps_replica(self, connections):
+        """a request running out of time says nothing about the replica"""
+        request = self.factory.get('/api/recipe/recipes/')
+        routers.allow_replica_reads(True)
+        routers.ReplicaRouter().db_for_read(Recipe)
+        connections['replica_0'].errors_occurred = True
+
+        self.middleware.process_exception(request, StatementTimeout())
+
+        self.assertTrue(routers.replicas.is_healthy('replica_0'))
+
+
+@skipUnless(TEST_REPLICAS, 'needs app.test_settings or DB_REPLICA_HOSTS')
+@override_settings(DATABASE_REPLICAS=TEST_REPLICAS[:1])
+class ReplicaReadApiTests(TransactionTestCase):
+    """Reads outside a transaction, as they are outside of tests"""
+
+    def setUp(self):
+        routers.replicas = routers.ReplicaPool()
+        self.replica = TEST_REPLICAS[0]
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertReadFromReplica(self, url, table):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[self.replica]) as replica:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(any(table in query['sql'] for query in replica))
+        self.assertFalse(any(table in query['sql'] for query in primary))
+
+    def test_user_rows_read_from_replica(self):
+        """a user's own rows are read from a replica without shards"""
+        self.assertReadFromReplica(
+            reverse('recipe:stats'),
+            'core_recipestats'
+        )
+
+    def test_budgeted_reads_from_replica(self):
+        """reads under a latency budget are still sent to a replica"""
+        self.assertReadFromReplica(
+            reverse('recipe:recipe-list'),
+            'core_recipe'
+        )
+
+    @patch.object(RecipeViewSet, 'latency_budget', 1e-9)
+    def test_budget_applies_on_replica(self):
+        """replica reads that run out of budget fail fast as well"""
+        metrics.reset()
+
+        response = self.client.get(reverse('recipe:recipe-list'))
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        self.assertFalse(connections[self.replica].execute_wrappers)
+        with patch.object(RecipeViewSet, 'latency_budget', 5):
+            self.assertReadFromReplica(
+                reverse('recipe:recipe-list'),
+                'core_recipe'
+            )
@@ -0,0 +1,201 @@
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import sharding
+from core.models import Recipe, Tag, ShardAssignment
+from core.routers import ShardRouter
+
+
+SHARDS = ['shard_0', 'shard_1']
+
+# SQLite shards from app.test_settings, or the shards configured
+TEST_SHARDS = getattr(
+    settings,
+    'TEST_DATABASE_SHARDS',
+    settings.DATABASE_SHARDS
+)
+
+
+class ShardRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = ShardRouter()
+        self.user = get_user_model()(id=7, email='test@test.com')
+
+    @override_settings(DATABASE_SHARDS=[])
+    def test_unsharded_by_default(self):
+        """without shards every query stays on the default routing"""
+        recipe = Recipe(user=self.user)
+
+        self.assertIsNone(self.router.db_for_write(Recipe, instance=recipe))
+
+    @override_settings(DATABASE_SHARDS=SHARDS)
+    @patch('core.sharding.shard_for_user', return_value='shard_1')
+    def test_owned_rows_go_to_owner_shard(self, shard_for_user):
+        """user owned rows and their links follow the owner's shard"""
+        recipe = Recipe(user=self.user)
+
+        self.assertEqual(
+            self.router.db_for_write(Recipe, instance=recipe),
+            'shard_1'
+        )
+        self.assertEqual(
+            self.router.db_for_read(Recipe.tags.through, instance=recipe),
+            'shard_1'
+        )
+        self.assertEqual(
+            self.router.db_for_read(Tag, instance=self.user),
+            'shard_1'
+        )
+        shard_for_user.assert_called_with(self.user.id, for_write=False)
+
+    @override_settings(DATABASE_SHARDS=SHARDS)
+    def test_users_are_not_sharded(self):
+        """the user table stays on the default database"""
+        self.assertIsNone(
+            self.router.db_for_write(get_user_model(), instance=self.user)
+        )
+
+    @override_settings(DATABASE_SHARDS=SHARDS)
+    @patch('core.sharding.shard_for_user', return_value='shard_0')
+    def test_relations_to_users_allowed(self, shard_for_user):
+        """owned rows may point at users on the default database"""
+        self.assertTrue(
+            self.router.allow_relation(Recipe(user=self.user), self.user)
+        )
+
+    @override_settings(DATABASE_SHARDS=SHARDS)
+    def test_default_shard_spreads_users(self):
+        """users are spread over the shards by id"""
+        self.assertEqual(sharding.default_shard(4), 'shard_0')
+        self.assertEqual(sharding.default_shard(5), 'shard_1')
+
+    @patch('core.sharding.connections')
+    def test_prepare_unsupported_shard_backend(self, connections):
+        """preparing shards on a backend without id sequences fails clearly"""
+        connections.__getitem__.return_value.vendor = 'oracle'
+
+        with override_settings(DATABASE_SHARDS=SHARDS):
+            with self.assertRaisesMessage(CommandError, 'oracle'):
+                call_command('prepare_shards', stdout=StringIO())
+
+
+@skipUnless(
+    len(TEST_SHARDS) >= 2,
+    'needs app.test_settings or two DB_SHARD_NAMES configured'
+)
+@override_settings(DATABASE_SHARDS=TEST_SHARDS, SHARD_MAP_CACHE_SECONDS=0)
+class ShardedApiTests(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        # shard assignments are rolled back after each test, the cached
+        # user-shard entries pointing at them must go too
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_recipes_written_to_user_shard(self):
+        """API writes land on the user's shard only"""
+        alias = sharding.shard_for_user(self.user.id)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.client.post(reverse('recipe:recipe-list'), {
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': '5.00',
+        })
+
+        self.assertEqual(tag._state.db, alias)
+        self.assertEqual(Recipe.objects.using(alias).count(), 1)
+        for other in settings.DATABASE_SHARDS:
+            if other != alias:
+                self.assertEqual(Recipe.objects.using(other).count(), 0)
+        response = self.client.get(reverse('recipe:recipe-list'))
+        self.assertEqual(len(response.data), 1)
+
+    def test_stats_read_from_user_shard(self):
+        """top tags are looked up on the user's shard"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.client.post(reverse('recipe:recipe-list'), {
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': '5.00',
+            'tags': [tag.id],
+        })
+
+        response = self.client.get(reverse('recipe:stats'))
+
+        self.assertEqual(
+            response.data['top_tags'],
+            [{'id': tag.id, 'name': 'Vegan', 'count': 1}]
+        )
+
+    def test_move_user_between_shards(self):
+        """moving a user copies their rows and repoints the directory"""
+        source = sharding.shard_for_user(self.user.id)
+        target = next(
+            alias for alias in settings.DATABASE_SHARDS if alias != source
+        )
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            time_minutes=10,
+            price='5.00'
+        )
+        recipe.tags.add(tag)
+
+        call_command(
+            'move_user_shard',
+            self.user.email,
+            target,
+            stdout=StringIO()
+        )
+
+        self.assertEqual(
+            ShardAssignment.objects.get(user=self.user).alias,
+            target
+        )
+        self.assertFalse(Recipe.objects.using(source).exists())
+        moved = Recipe.objects.for_user(self.user).get()
+        self.assertEqual(moved.id, recipe.id)
+        self.assertEqual(list(moved.tags.all()), [tag])
+
+    def test_writes_blocked_while_moving(self):
+        """writes to a user being copied are refused until repointed"""
+        source = sharding.shard_for_user(self.user.id)
+        target = next(
+            alias for alias in settings.DATABASE_SHARDS if alias != source
+        )
+        payload = {'title': 'Soup', 'time_minutes': 10, 'price': '5.00'}
+        statuses = []
+
+        def write_during_move():
+            response = self.client.post(reverse('recipe:recipe-list'), payload)
+            statuses.append(response.status_code)
+
+        with patch.object(
+            sharding,
+            '_wait_for_shard_map',
+            side_effect=write_during_move
+        ):
+            sharding.move_user(self.user.id, target)
+
+        # refused while copying, accepted on the target once repointed
+        self.assertEqual(statuses, [503, 201])
+        self.assertTrue(Recipe.objects.using(target).exists())
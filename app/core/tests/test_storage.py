@@ -0,0 +1,215 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.models import ImageBlob, Recipe
+from core.storage import ContentAddressedStorage, is_hashed_name
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ContentAddressedStorageTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+
+    def sample_recipe(self, image=None, title='Soup'):
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title=title,
+            time_minutes=5,
+            price=1
+        )
+        if image is not None:
+            recipe.image.save('photo.JPG', ContentFile(image))
+
+        return recipe
+
+    def test_identical_images_stored_once(self):
+        """uploads with the same bytes share one hashed file"""
+        first = self.sample_recipe(b'same bytes')
+        second = self.sample_recipe(b'same bytes', title='Stew')
+        other = self.sample_recipe(b'other bytes', title='Salad')
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertTrue(is_hashed_name(first.image.name))
+        self.assertRegex(
+            first.image.name,
+            r'^uploads/recipe/(\w\w)/(\w\w)/\1\2\w{60}\.jpg$'
+        )
+        self.assertEqual(
+            ImageBlob.objects.get(name=first.image.name).ref_count,
+            2
+        )
+
+    def test_racing_uploads_keep_hashed_name(self):
+        """an upload losing the exists() race still uses the hashed name"""
+        first = self.sample_recipe(b'same bytes')
+        storage = first.image.storage
+
+        with patch.object(
+            ContentAddressedStorage,
+            'exists',
+            return_value=False
+        ):
+            second = self.sample_recipe(b'same bytes', title='Stew')
+
+        self.assertEqual(second.image.name, first.image.name)
+        directory = os.path.dirname(storage.path(first.image.name))
+        self.assertEqual(os.listdir(directory), [
+            os.path.basename(first.image.name)
+        ])
+        with storage.open(first.image.name) as file:
+            self.assertEqual(file.read(), b'same bytes')
+
+    def test_referenced_files_are_not_deleted(self):
+        """deleting a shared image keeps it for the other recipe"""
+        first = self.sample_recipe(b'same bytes')
+        second = self.sample_recipe(b'same bytes', title='Stew')
+        path = second.image.path
+
+        first.image.delete()
+
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+
+        second.delete()
+        second.image.storage.delete(second.image.name)
+
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_replacing_image_moves_reference(self):
+        """a replaced image loses its reference"""
+        recipe = self.sample_recipe(b'old bytes')
+        old_name = recipe.image.name
+
+        recipe = Recipe.objects.only('id').get(id=recipe.id)
+        recipe.image.save('photo.jpg', ContentFile(b'new bytes'))
+
+        self.assertEqual(ImageBlob.objects.get(name=old_name).ref_count, 0)
+        self.assertEqual(
+            ImageBlob.objects.get(name=recipe.image.name).ref_count,
+            1
+        )
+
+    def test_rehash_media_command(self):
+        """existing uuid named images are moved to hashed names"""
+        legacy = FileSystemStorage().save(
+            'uploads/recipe/1234.jpg',
+            ContentFile(b'legacy bytes')
+        )
+        recipe = self.sample_recipe()
+        Recipe.objects.filter(id=recipe.id).update(image=legacy)
+        out = StringIO()
+
+        call_command('rehash_media', stdout=out)
+
+        recipe.refresh_from_db()
+        self.assertTrue(is_hashed_name(recipe.image.name))
+        self.assertEqual(recipe.image.read(), b'legacy bytes')
+        self.assertFalse(os.path.exists(os.path.join(MEDIA_ROOT, legacy)))
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+        self.assertIn('Rehashed 1 images', out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class GcMediaCommandTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.storage = FileSystemStorage()
+        self.old = time.time() - 2 * 24 * 60 * 60
+
+    def sample_file(self, name, age=None):
+        name = self.storage.save(name, ContentFile(b'bytes'))
+        if age is not None:
+            os.utime(self.storage.path(name), (age, age))
+
+        return name
+
+    def gc_media(self, *args):
+        out = StringIO()
+        call_command('gc_media', *args, stdout=out)
+
+        return out.getvalue()
+
+    def test_deletes_only_old_unreferenced_files(self):
+        """referenced and recently written files are kept"""
+        referenced = self.sample_file('uploads/recipe/used.jpg', self.old)
+        Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            time_minutes=5,
+            price=1,
+            image=referenced
+        )
+        orphan = self.sample_file('uploads/recipe/ab/cd/orphan.jpg', self.old)
+        recent = self.sample_file('uploads/recipe/recent.jpg')
+
+        output = self.gc_media()
+
+        self.assertTrue(self.storage.exists(referenced))
+        self.assertTrue(self.storage.exists(recent))
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertIn('Deleted 1 of 3 files, 5 bytes', output)
+
+    def test_released_blobs_collected_after_grace(self):
+        """files whose references went to zero are deleted after grace"""
+        released = self.sample_file('uploads/recipe/released.jpg', self.old)
+        fresh = self.sample_file('uploads/recipe/fresh.jpg', self.old)
+        ImageBlob.objects.create(
+            name=released,
+            updated_at=timezone.now() - timedelta(days=2)
+        )
+        ImageBlob.objects.create(name=fresh)
+
+        self.gc_media()
+
+        self.assertFalse(self.storage.exists(released))
+        self.assertTrue(self.storage.exists(fresh))
+        self.assertEqual(
+            list(ImageBlob.objects.values_list('name', flat=True)),
+            [fresh]
+        )
+
+    def test_dry_run_deletes_nothing(self):
+        """a dry run only reports what would be deleted"""
+        orphan = self.sample_file('uploads/recipe/orphan.jpg', self.old)
+
+        output = self.gc_media('--dry-run')
+
+        self.assertTrue(self.storage.exists(orphan))
+        self.assertIn('Would delete 1 of 1 files', output)
+
+    def test_references_checked_per_batch(self):
+        """queries grow with the number of batches, not files"""
+        for number in range(30):
+            self.sample_file(f'uploads/recipe/{number}.jpg', self.old)
+
+        with self.assertNumQueries(3 * 3):
+            self.gc_media('--batch-size', '10')
+
+        self.assertFalse(self.storage.listdir('uploads/recipe')[1])
@@ -0,0 +1,168 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from core import throttling
+from recipe.views import RecipeViewSet, TagViewSet
+
+
+RATES = {
+    'DEFAULT_THROTTLE_CLASSES': ('core.throttling.TokenBucketThrottle',),
+    'DEFAULT_THROTTLE_RATES': {
+        'read': '20/min',
+        'write': '3/min',
+        'upload': '1/min',
+    },
+}
+
+
+@override_settings(REST_FRAMEWORK=RATES, THROTTLE_LEASE_DIVISOR=10)
+class TokenBucketThrottleTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        throttling.buckets.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(throttling.buckets.clear)
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.factory = RequestFactory()
+
+    def request(self, method='get', user=None):
+        request = Request(getattr(self.factory, method)('/'))
+        request.user = user or self.user
+        return request
+
+    def allow(self, request, view, now=0.0):
+        throttle = throttling.TokenBucketThrottle()
+        throttle.timer = lambda: now
+        return throttle.allow_request(request, view), throttle.wait()
+
+    def test_budget_exhausted_then_refilled(self):
+        """requests over the budget wait for the bucket to refill"""
+        view = RecipeViewSet(action='create')
+        results = [
+            self.allow(self.request('post'), view, now=10.0)[0]
+            for _ in range(4)
+        ]
+
+        self.assertEqual(results, [True, True, True, False])
+        self.assertEqual(
+            self.allow(self.request('post'), view, now=10.0)[1],
+            20
+        )
+        self.assertFalse(self.allow(self.request('post'), view, now=29.0)[0])
+        self.assertTrue(self.allow(self.request('post'), view, now=30.0)[0])
+
+    def test_no_burst_across_period_boundary(self):
+        """a spent budget refills at the rate, not all at once"""
+        view = RecipeViewSet(action='list')
+
+        def allowed(now):
+            return sum(
+                self.allow(self.request(), view, now=now)[0]
+                for _ in range(20)
+            )
+
+        self.assertEqual(allowed(59.0), 20)
+        self.assertEqual(allowed(61.0), 0)
+        self.assertEqual(allowed(89.0), 10)
+
+    def test_separate_budgets_per_scope_and_view(self):
+        """read, write and upload budgets and view classes are separate"""
+        for _ in range(3):
+            self.allow(self.request('post'), RecipeViewSet(action='create'))
+
+        self.assertFalse(
+            self.allow(self.request('post'), RecipeViewSet())[0]
+        )
+        self.assertTrue(self.allow(self.request(), RecipeViewSet())[0])
+        self.assertTrue(self.allow(self.request('post'), TagViewSet())[0])
+        self.assertTrue(self.allow(
+            self.request('post'),
+            RecipeViewSet(action='upload_image')
+        )[0])
+
+    def test_separate_budgets_per_user(self):
+        """one user exhausting their budget does not affect another"""
+        other = get_user_model().objects.create_user(
+            'other@test.com',
+            'password123'
+        )
+        view = RecipeViewSet(action='upload_image')
+
+        self.assertTrue(self.allow(self.request('post'), view)[0])
+        self.assertFalse(self.allow(self.request('post'), view)[0])
+        self.assertTrue(self.allow(self.request('post', other), view)[0])
+
+    def test_lease_avoids_cache_round_trips(self):
+        """requests are served from the local lease between cache calls"""
+        view = RecipeViewSet(action='list')
+        with patch.object(cache, 'get', wraps=cache.get) as get:
+            for _ in range(20):
+                self.assertTrue(self.allow(self.request(), view)[0])
+
+        self.assertEqual(get.call_count, 10)
+
+    def test_exhausted_budget_denied_locally(self):
+        """once the shared budget is empty denials skip the cache"""
+        view = RecipeViewSet(action='upload_image')
+        self.allow(self.request('post'), view)
+        self.allow(self.request('post'), view)
+        with patch.object(cache, 'get') as get:
+            self.assertFalse(self.allow(self.request('post'), view)[0])
+
+        get.assert_not_called()
+
+    def test_concurrent_leases_do_not_share_tokens(self):
+        """a lease taken while another is updating the bucket gets nothing"""
+        key, capacity, period = 'throttle:upload:test', 1, 60
+        other_process = throttling.LeasedBuckets()
+        results = []
+        get = cache.get
+
+        def lease_meanwhile(*args):
+            results.append(other_process.take(key, capacity, period, 0.0))
+            return get(*args)
+
+        with patch.object(cache, 'get', side_effect=lease_meanwhile):
+            results.append(throttling.buckets.take(key, capacity, period, 0.0))
+
+        self.assertEqual(results, [(False, 60.0), (True, 0)])
+        self.assertFalse(other_process.take(key, capacity, period, 1.0)[0])
+
+    @patch.object(throttling.TokenBucketThrottle, 'timer', lambda self: 30.0)
+    def test_throttled_api_sends_retry_after(self):
+        """a throttled API call is a 429 with a Retry-After header"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('recipe:recipe-list')
+        payload = {'title': 'Soup', 'time_minutes': 5, 'price': '1.00'}
+        for _ in range(3):
+            client.post(url, payload)
+
+        response = client.post(url, payload)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEqual(response['Retry-After'], '20')
+
+    def test_benchmark_command(self):
+        """the benchmark reports the per request overhead"""
+        out = StringIO()
+        call_command('benchmark_throttle', requests=1000, stdout=out)
+
+        self.assertIn('microseconds per request', out.getvalue())
@@ -0,0 +1,107 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.utils import OperationalError
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.metrics import metrics
+from core.timeouts import is_statement_timeout, statement_timeout
+from recipe.views import RecipeViewSet
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+SLOW_QUERY = (
+    'WITH RECURSIVE counter(x) AS ('
+    'SELECT 1 UNION ALL SELECT x + 1 FROM counter WHERE x < 100000000'
+    ') SELECT count(*) FROM counter'
+)
+
+
+class StatementTimeoutTests(TestCase):
+
+    def test_slow_statement_interrupted(self):
+        """a statement running past the budget is stopped"""
+        with self.assertRaises(OperationalError) as raised:
+            with statement_timeout(0.05):
+                with connection.cursor() as cursor:
+                    cursor.execute(SLOW_QUERY)
+
+        self.assertTrue(is_statement_timeout(raised.exception))
+
+    def test_fast_statements_unaffected(self):
+        """queries inside the budget run and the guard is removed after"""
+        with statement_timeout(5):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                self.assertEqual(cursor.fetchone(), (1,))
+
+        self.assertEqual(connection.execute_wrappers, [])
+
+    def test_queries_after_deadline_refused(self):
+        """no query starts once the budget is spent"""
+        with self.assertRaises(OperationalError) as raised:
+            with statement_timeout(0):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+
+        self.assertTrue(is_statement_timeout(raised.exception))
+
+
+class LatencyBudgetApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @patch.object(RecipeViewSet, 'latency_budget', 1e-9)
+    def test_exceeded_budget_is_503(self):
+        """a read that runs out of budget fails fast and is counted"""
+        metrics.reset()
+
+        response = self.client.get(RECIPES_URL)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        self.assertEqual(
+            metrics.snapshot()['latency_budget.RecipeViewSet.exceeded'],
+            1
+        )
+
+    @patch.object(RecipeViewSet, 'latency_budget', 1e-9)
+    def test_writes_not_budgeted(self):
+        """only reads run under the budget"""
+        response = self.client.post(RECIPES_URL, {
+            'title': 'Soup',
+            'time_minutes': 5,
+            'price': '1.00',
+        })
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_filter_size_limited(self):
+        """long or malformed filter lists are rejected before querying"""
+        too_many = ','.join(str(number) for number in range(51))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(RECIPES_URL, {'tags': too_many})
+        self.assertFalse(any(
+            query['sql'].startswith('SELECT') for query in queries
+        ))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tags', response.data)
+
+        response = self.client.get(RECIPES_URL, {'ingredients': '1,x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,159 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from core.metrics import metrics
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+# a lease holds its bucket's lock for one get and one set, a lock left by a
+# process that died expires after LOCK_SECONDS
+LOCK_SECONDS = 1
+LOCK_ATTEMPTS = 5
+LOCK_RETRY_SECONDS = 0.002
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """turns a rate like '100/min' into (capacity, period in seconds)"""
+    count, period = rate.split('/')
+
+    return int(count), PERIODS[period[0]]
+
+
+class LeasedBuckets:
+    """Process local slices of token buckets kept in the shared cache
+
+    Every key has a bucket of `capacity` tokens in the shared cache that
+    refills at capacity tokens per `period`, so a client can burst at most
+    `capacity` requests and is then held to the rate. A process leases a
+    slice of the bucket, topping it up for the time since it was last
+    refilled, and then serves requests from its local slice without
+    touching the cache, so at most one shared bucket update happens per
+    lease. The update holds a lock taken with cache.add, which is atomic on
+    memcached, so processes leasing at the same moment cannot hand out the
+    same tokens twice. The cache must be shared by every process, see
+    CACHE_LOCATION, or each process gets a bucket of its own.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, period, now):
+        """takes a token for key, returns (allowed, seconds to wait)"""
+        with self._lock:
+            state = self._local.get(key)
+            if state is not None:
+                if state[0] > 0:
+                    state[0] -= 1
+                    return True, 0
+                if now < state[1]:
+                    return False, state[1] - now
+
+        granted, wait = self._lease(key, capacity, period, now)
+        with self._lock:
+            self._local[key] = [max(granted - 1, 0), now + wait]
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_keys:
+                self._local.popitem(last=False)
+        if granted:
+            return True, 0
+
+        return False, wait
+
+    def _lease(self, key, capacity, period, now):
+        """takes tokens from the shared bucket, returns (granted, wait)
+
+        wait is how long until the bucket holds a whole token again. When
+        the bucket stays locked by other leases nothing is granted and the
+        wait is the time one token takes to refill.
+        """
+        lease = max(1, capacity // settings.THROTTLE_LEASE_DIVISOR)
+        lock = f'{key}:lock'
+        for _ in range(LOCK_ATTEMPTS):
+            if cache.add(lock, True, LOCK_SECONDS):
+                break
+            time.sleep(LOCK_RETRY_SECONDS)
+        else:
+            return 0, period / capacity
+
+        try:
+            tokens, refilled_at = cache.get(key, (capacity, now))
+            tokens = min(
+                capacity,
+                tokens + max(0, now - refilled_at) * capacity / period
+            )
+            granted = min(lease, int(tokens))
+            tokens -= granted
+            # a bucket left alone for a period is full, same as a missing one
+            cache.set(key, (tokens, now), period)
+        finally:
+            cache.delete(lock)
+
+        return granted, max(0, (1 - tokens) * period / capacity)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+
+buckets = LeasedBuckets()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttles each user per view class with read, write and upload budgets
+
+    The budget is picked from the view's `throttle_scope`, then from the
+    action name for uploads, then from the request method. Rates come
+    from DEFAULT_THROTTLE_RATES.
+    """
+    upload_actions = ('upload_image', 'request_image_upload')
+    timer = time.time
+
+    def get_scope(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope:
+            return scope
+        if getattr(view, 'action', None) in self.upload_actions:
+            return 'upload'
+
+        return 'read' if request.method in SAFE_METHODS else 'write'
+
+    def get_client(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+
+        return f'ip:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        scope = self.get_scope(request, view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+        capacity, period = parse_rate(rate)
+        key = (
+            f'throttle:{scope}:{type(view).__name__}:'
+            f'{self.get_client(request)}'
+        )
+        allowed, wait = buckets.take(key, capacity, period, self.timer())
+        if not allowed:
+            self.wait_seconds = math.ceil(wait)
+            metrics.incr(f'throttle.{scope}.denied')
+
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
@@ -0,0 +1,145 @@
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.utils import DatabaseError, OperationalError
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.metrics import metrics
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# SQLSTATE of statements cancelled by statement_timeout on PostgreSQL
+QUERY_CANCELED = '57014'
+
+
+class StatementTimeout(OperationalError):
+    """A query was started after its latency budget ran out"""
+
+
+class LatencyBudgetExceeded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The request ran out of time, try again later.'
+    default_code = 'latency_budget_exceeded'
+
+
+def is_statement_timeout(exc):
+    """whether a database error came from a statement timing out"""
+    if isinstance(exc, StatementTimeout):
+        return True
+    if not isinstance(exc, OperationalError):
+        return False
+
+    return (
+        getattr(exc.__cause__, 'pgcode', None) == QUERY_CANCELED or
+        str(exc) == 'interrupted'
+    )
+
+
+def _reset(connection):
+    """removes the statement timeout a budget set on a connection"""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('RESET statement_timeout')
+    except DatabaseError:
+        # a session that kept the timeout must not serve later requests
+        connection.close()
+
+
+@contextmanager
+def statement_timeout(seconds, using=DEFAULT_DB_ALIAS):
+    """bounds the time queries in the block may run for
+
+    No transaction is opened, so the routers still pick the database of
+    each query. The first query on the connection arms the guard: on
+    PostgreSQL SET statement_timeout makes the server cancel statements
+    running past the deadline, on SQLite a progress handler interrupts
+    them. Queries started after the deadline fail with StatementTimeout
+    before reaching the database.
+    """
+    connection = connections[using]
+    deadline = time.monotonic() + seconds
+    armed = []
+
+    def check_deadline(execute, sql, params, many, context):
+        remaining = deadline - time.monotonic()
+        if remaining < 0:
+            raise StatementTimeout('latency budget spent before the query')
+        if not armed:
+            if connection.vendor == 'postgresql':
+                execute(
+                    'SET statement_timeout = %s',
+                    [max(1, int(remaining * 1000))],
+                    False,
+                    context
+                )
+            elif connection.vendor == 'sqlite':
+                connection.connection.set_progress_handler(
+                    lambda: time.monotonic() > deadline,
+                    10000
+                )
+            armed.append(connection.connection)
+        return execute(sql, params, many, context)
+
+    try:
+        with connection.execute_wrapper(check_deadline):
+            yield
+    finally:
+        if armed and connection.connection is armed[0]:
+            if connection.vendor == 'postgresql':
+                _reset(connection)
+            elif connection.vendor == 'sqlite':
+                connection.connection.set_progress_handler(None, 0)
+
+
+class LatencyBudgetMixin:
+    """Bounds the database time of a view's reads
+
+    Reads run under statement_timeout() for the view's latency_budget
+    seconds, or DEFAULT_LATENCY_BUDGET, on whichever database the routers
+    send them to. A read that runs out of time fails fast with a 503
+    instead of holding a worker and a database connection. Views and
+    actions that wait on something other than the database set
+    latency_budgeted to False.
+    """
+    latency_budget = None
+    latency_budgeted = True
+
+    def get_latency_budget(self):
+        return self.latency_budget or settings.DEFAULT_LATENCY_BUDGET
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and self.latency_budgeted:
+            seconds = self.get_latency_budget()
+            self._budget = ExitStack()
+            for alias in connections:
+                self._budget.enter_context(
+                    statement_timeout(seconds, using=alias)
+                )
+
+    def _end_budget(self, exc=None):
+        budget = self.__dict__.pop('_budget', None)
+        if budget is None:
+            return
+        if exc is None:
+            budget.close()
+        else:
+            budget.__exit__(type(exc), exc, exc.__traceback__)
+
+    def handle_exception(self, exc):
+        self._end_budget(exc)
+        if is_statement_timeout(exc):
+            metrics.incr(f'latency_budget.{type(self).__name__}.exceeded')
+            exc = LatencyBudgetExceeded()
+
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        self._end_budget()
+
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from core import views
+
+
+app_name = 'core'
+
+urlpatterns = [
+    path('<path:key>', views.ObjectView.as_view(), name='object'),
+]
@@ -0,0 +1,74 @@
+import base64
+import binascii
+
+from django.http import FileResponse, Http404, HttpResponse, \
+                        HttpResponseBadRequest, HttpResponseForbidden
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from core import objectstore
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ObjectView(View):
+    """Answers presigned URLs of LocalObjectStore
+
+    Stands in for the object store's own endpoint in development and
+    tests. Production stores serve their presigned URLs themselves.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        self.store = objectstore.store()
+        if not isinstance(self.store, objectstore.LocalObjectStore):
+            raise Http404
+
+        return super().dispatch(request, *args, **kwargs)
+
+    def verify(self, request, key, headers=None):
+        return self.store.verify(
+            request.method,
+            key,
+            request.GET.get('expires'),
+            request.GET.get('signature'),
+            headers
+        )
+
+    def get(self, request, key):
+        if not self.verify(request, key):
+            return HttpResponseForbidden()
+        try:
+            file = self.store.open(key)
+        except (FileNotFoundError, objectstore.ObjectStoreError):
+            raise Http404
+
+        return FileResponse(file, content_type=objectstore.content_type(key))
+
+    def put(self, request, key):
+        headers = {
+            'Content-Type': request.META.get('CONTENT_TYPE', ''),
+            'Content-Length': request.META.get('CONTENT_LENGTH', ''),
+            'x-amz-checksum-sha256': request.META.get(
+                'HTTP_X_AMZ_CHECKSUM_SHA256',
+                ''
+            ),
+        }
+        if not self.verify(request, key, headers):
+            return HttpResponseForbidden()
+        try:
+            sha256 = base64.b64decode(
+                headers['x-amz-checksum-sha256'],
+                validate=True
+            ).hex()
+        except binascii.Error:
+            return HttpResponseBadRequest()
+        try:
+            self.store.receive(
+                key,
+                iter(lambda: request.read(64 * 1024), b''),
+                sha256
+            )
+        except objectstore.ObjectStoreError:
+            return HttpResponseBadRequest('BadDigest')
+
+        return HttpResponse()
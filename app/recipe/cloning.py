@@ -0,0 +1,153 @@
+from collections import Counter, defaultdict
+
+from django.db import connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.dispatch import Signal
+from django.utils import timezone
+
+from core.models import ImageBlob, Recipe
+from core.sharding import shard_for_user
+from recipe import stats
+
+
+# sent by clone_recipes with the recipes it inserted
+recipes_cloned = Signal(providing_args=['instances', 'using'])
+
+# relations copied from a recipe to its clones
+LINKS = ('tags', 'ingredients')
+
+# (original, clone) id pairs per INSERT ... SELECT, which keeps queries
+# under SQLite's limits of 999 parameters and 500 compound SELECTs
+PAIRS_PER_QUERY = 400
+
+
+def _links(alias, field, recipe_ids):
+    """{recipe id: [linked ids]} for a many to many field of recipes"""
+    relation = Recipe._meta.get_field(field)
+    links = defaultdict(list)
+    for recipe_id, target_id in relation.remote_field.through.objects.using(
+        alias
+    ).filter(**{
+        f'{relation.m2m_field_name()}_id__in': recipe_ids
+    }).values_list(
+        f'{relation.m2m_field_name()}_id',
+        f'{relation.m2m_reverse_field_name()}_id'
+    ):
+        links[recipe_id].append(target_id)
+
+    return links
+
+
+def _insert(alias, clones):
+    """inserts clones and sets their primary keys"""
+    connection = connections[alias]
+    if connection.features.can_return_ids_from_bulk_insert:
+        return Recipe.objects.using(alias).bulk_create(clones)
+
+    # without RETURNING the ids are read back; the write lock taken by the
+    # insert is held until commit, so the owner's newest ids are these
+    Recipe.objects.using(alias).bulk_create(clones)
+    ids = Recipe._base_manager.using(alias).filter(
+        user_id=clones[0].user_id
+    ).order_by('-id').values_list('id', flat=True)[:len(clones)]
+    for clone, pk in zip(clones, sorted(ids)):
+        clone.pk = pk
+
+    return clones
+
+
+def _copy_links(alias, field, pairs):
+    """copies the link rows of (original, clone) pairs in the database
+
+    Every column of the link table but its key is copied, so the amounts
+    kept on RecipeIngredient rows come along.
+    """
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    relation = Recipe._meta.get_field(field)
+    through = relation.remote_field.through
+    table = quote(through._meta.db_table)
+    recipe = quote(through._meta.get_field(
+        relation.m2m_field_name()
+    ).column)
+    columns = [
+        quote(column.column) for column in through._meta.concrete_fields
+        if not column.primary_key and quote(column.column) != recipe
+    ]
+    copied = ', '.join(f'link.{column}' for column in columns)
+    with connection.cursor() as cursor:
+        for start in range(0, len(pairs), PAIRS_PER_QUERY):
+            chunk = pairs[start:start + PAIRS_PER_QUERY]
+            mapping = ' UNION ALL '.join(
+                ['SELECT %s AS original, %s AS clone'] * len(chunk)
+            )
+            cursor.execute(
+                f'INSERT INTO {table} ({recipe}, {", ".join(columns)}) '
+                f'SELECT pairs.clone, {copied} FROM {table} link '
+                f'JOIN ({mapping}) pairs ON link.{recipe} = pairs.original',
+                [pk for pair in chunk for pk in pair]
+            )
+
+
+def _share_images(names):
+    """adds one ImageBlob reference per clone in a single UPDATE"""
+    counts = Counter(name for name in names if name)
+    if not counts:
+        return
+    ImageBlob.objects.filter(name__in=counts).update(
+        ref_count=F('ref_count') + Case(
+            *[When(name=name, then=Value(count))
+              for name, count in counts.items()],
+            output_field=IntegerField()
+        ),
+        updated_at=timezone.now()
+    )
+
+
+def clone_recipes(user, recipe_ids):
+    """copies some of a user's recipes along with their tags and ingredients
+
+    Returns the clones in the order of recipe_ids, skipping ids the user
+    does not own. The recipes are written with one bulk insert and their
+    tag and ingredient links are copied by INSERT ... SELECT inside the
+    database, so queries grow with batches of hundreds of recipes, not
+    with each one. Images are shared with the original, not copied, and
+    clones start out private.
+    """
+    alias = shard_for_user(user.pk, for_write=True)
+    sources = Recipe.objects.for_user(user).in_bulk(recipe_ids)
+    sources = [sources[pk] for pk in recipe_ids if pk in sources]
+    if not sources:
+        return []
+
+    with transaction.atomic(using=alias):
+        links = {
+            field: _links(alias, field, [source.pk for source in sources])
+            for field in LINKS
+        }
+        clones = _insert(alias, [
+            Recipe(**dict({
+                field.attname: getattr(source, field.attname)
+                for field in Recipe._meta.concrete_fields
+                if not field.primary_key
+            }, is_public=False, published_at=None))
+            for source in sources
+        ])
+        pairs = [
+            (source.pk, clone.pk) for source, clone in zip(sources, clones)
+        ]
+        for field in LINKS:
+            _copy_links(alias, field, pairs)
+        _share_images(clone.image.name for clone in clones)
+        stats.apply_recipe_changes(user, added=[
+            {
+                'cents': stats.to_cents(source.price),
+                'time': stats.time_bucket(source.time_minutes),
+                'tags': links['tags'][source.pk],
+                'ingredients': links['ingredients'][source.pk],
+            }
+            for source in sources
+        ])
+        recipes_cloned.send(sender=Recipe, instances=clones, using=alias)
+
+    return clones
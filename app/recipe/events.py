@@ -0,0 +1,427 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.db.utils import DatabaseError
+
+from rest_framework.authtoken.models import Token
+
+from core.metrics import metrics
+from recipe import sync
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'recipe_changes'
+
+REASONS = {
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    410: 'Gone',
+}
+
+
+def notify(using, user_id, seq):
+    """tells event stream servers that a user's change log grew
+
+    NOTIFY is transactional, so listeners only hear about the change
+    once it is committed. Other databases are polled instead.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_notify(%s, %s)',
+                [CHANNEL, f'{user_id}:{seq}']
+            )
+
+
+def format_event(seq, kind, object_id, action):
+    """a change log entry as a server-sent event"""
+    data = json.dumps(
+        {'kind': kind, 'id': object_id, 'action': action},
+        separators=(',', ':')
+    )
+
+    return f'id: {seq}\nevent: change\ndata: {data}\n\n'.encode()
+
+
+def authenticate(key):
+    """the active user owning an API token, or None"""
+    close_old_connections()
+    token = Token.objects.select_related('user').filter(key=key).first()
+    if token is None or not token.user.is_active:
+        return None
+
+    return token.user
+
+
+class Subscriber:
+    """An open event stream and the last change it was sent"""
+
+    def __init__(self, user_id, last_seq):
+        self.user_id = user_id
+        self.last_seq = last_seq
+        self.queue = asyncio.Queue()
+
+    def close(self):
+        self.queue.put_nowait(None)
+
+
+class Broker:
+    """Fans a user's change log entries out to their open streams
+
+    It is only used from the event loop, so it needs no locking. A
+    stream more than max_backlog events behind is closed, and its client
+    resumes from its Last-Event-ID once it reconnects.
+    """
+
+    def __init__(self, max_backlog):
+        self.max_backlog = max_backlog
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, subscriber):
+        self.subscribers[subscriber.user_id].add(subscriber)
+
+    def unsubscribe(self, subscriber):
+        streams = self.subscribers.get(subscriber.user_id)
+        if streams is None:
+            return
+        streams.discard(subscriber)
+        if not streams:
+            del self.subscribers[subscriber.user_id]
+
+    def cursor(self, user_id):
+        """the oldest change one of the user's streams is missing, or None"""
+        return min(
+            (stream.last_seq for stream in self.subscribers.get(user_id, ())),
+            default=None
+        )
+
+    def publish(self, user_id, entries):
+        """queues each entry for the user's streams that were not sent it"""
+        events = [(entry[0], format_event(*entry)) for entry in entries]
+        for subscriber in list(self.subscribers.get(user_id, ())):
+            for seq, event in events:
+                if seq <= subscriber.last_seq:
+                    continue
+                if subscriber.queue.qsize() >= self.max_backlog:
+                    metrics.incr('events.overflowed')
+                    self.unsubscribe(subscriber)
+                    subscriber.close()
+                    break
+                subscriber.queue.put_nowait(event)
+                subscriber.last_seq = seq
+
+
+class EventStreamServer:
+    """Streams users' change logs to them as server-sent events
+
+    Streams are served on asyncio, so an idle one costs a coroutine and a
+    queue rather than a thread. Database work runs on a small thread
+    pool. On PostgreSQL the server LISTENs for the NOTIFY sent with each
+    change and fetches a user's new entries once for all of their
+    streams. Other databases are polled every poll_interval seconds.
+    """
+    path = '/api/recipe/events/'
+
+    def __init__(self, heartbeat=None, poll_interval=None, max_backlog=None,
+                 db_threads=4):
+        self.heartbeat = heartbeat or settings.EVENT_STREAM_HEARTBEAT
+        self.poll_interval = (
+            poll_interval or settings.EVENT_STREAM_POLL_INTERVAL
+        )
+        self.broker = Broker(
+            max_backlog or settings.EVENT_STREAM_MAX_BACKLOG
+        )
+        self.executor = ThreadPoolExecutor(db_threads)
+        self.aliases = settings.DATABASE_SHARDS or [DEFAULT_DB_ALIAS]
+        self._refreshing = {}
+        self._listeners = {}
+        self._tasks = []
+        self._connections = set()
+
+    async def call(self, func, *args):
+        """runs blocking database work on the thread pool"""
+        loop = asyncio.get_event_loop()
+
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def start(self, host, port):
+        """starts serving streams and watching for changes"""
+        server = await asyncio.start_server(
+            self.handle,
+            host,
+            port,
+            backlog=1024
+        )
+        if all(
+            connections[alias].vendor == 'postgresql'
+            for alias in self.aliases
+        ):
+            for alias in self.aliases:
+                await self.listen(alias)
+        else:
+            self._tasks.append(asyncio.ensure_future(self.poll()))
+
+        return server
+
+    async def close(self):
+        """closes open streams and stops watching for changes"""
+        loop = asyncio.get_event_loop()
+        for task in self._tasks:
+            task.cancel()
+        for task in self._connections:
+            task.cancel()
+        await asyncio.gather(
+            *self._tasks,
+            *self._connections,
+            return_exceptions=True
+        )
+        for connection in self._listeners.values():
+            loop.remove_reader(connection.fileno())
+            connection.close()
+        self._listeners.clear()
+        self.executor.shutdown(wait=False)
+
+    async def listen(self, alias):
+        """LISTENs for change notifications on a database"""
+        wrapper = connections[alias]
+        connection = await self.call(
+            wrapper.get_new_connection,
+            wrapper.get_connection_params()
+        )
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+        asyncio.get_event_loop().add_reader(
+            connection.fileno(),
+            self._notified,
+            alias
+        )
+        self._listeners[alias] = connection
+
+    def _notified(self, alias):
+        connection = self._listeners[alias]
+        try:
+            connection.poll()
+        except connections[alias].Database.Error:
+            logger.exception('Lost the %s change listener', alias)
+            asyncio.get_event_loop().remove_reader(connection.fileno())
+            del self._listeners[alias]
+            self._tasks.append(asyncio.ensure_future(self.relisten(alias)))
+            return
+        user_ids = {
+            int(notification.payload.partition(':')[0])
+            for notification in connection.notifies
+        }
+        connection.notifies.clear()
+        for user_id in user_ids:
+            self.changed(user_id)
+
+    async def relisten(self, alias):
+        """reconnects a lost listener and catches up every stream"""
+        while alias not in self._listeners:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.listen(alias)
+            except connections[alias].Database.Error:
+                logger.warning('Could not reconnect to %s', alias)
+        for user_id in list(self.broker.subscribers):
+            self.changed(user_id)
+
+    async def poll(self):
+        """checks the change log of connected users for new entries"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            user_ids = list(self.broker.subscribers)
+            if not user_ids:
+                continue
+            try:
+                latest = await self.call(sync.latest_seqs, user_ids)
+            except DatabaseError:
+                logger.exception('Could not poll the change log')
+                continue
+            for user_id, seq in latest.items():
+                cursor = self.broker.cursor(user_id)
+                if cursor is not None and seq > cursor:
+                    self.changed(user_id)
+
+    def changed(self, user_id):
+        """sends a user's streams their new changes
+
+        One fetch per user runs at a time. Changes noticed while it runs
+        trigger another fetch once it finishes.
+        """
+        if user_id not in self.broker.subscribers:
+            return
+        if user_id in self._refreshing:
+            self._refreshing[user_id] = True
+            return
+        self._refreshing[user_id] = False
+        asyncio.ensure_future(self.refresh(user_id))
+
+    async def refresh(self, user_id):
+        user = get_user_model()(pk=user_id)
+        page_size = settings.SYNC_PAGE_SIZE
+        try:
+            while True:
+                cursor = self.broker.cursor(user_id)
+                if cursor is None:
+                    break
+                entries = await self.call(
+                    sync.entries_since,
+                    user,
+                    cursor,
+                    page_size
+                )
+                self.broker.publish(user_id, entries)
+                if len(entries) < page_size:
+                    if not self._refreshing[user_id]:
+                        break
+                    self._refreshing[user_id] = False
+        except DatabaseError:
+            logger.exception('Could not fetch changes for user %s', user_id)
+        finally:
+            del self._refreshing[user_id]
+
+    async def read_request(self, reader):
+        """(method, path, query, headers) of an HTTP request, or None"""
+        try:
+            head = await asyncio.wait_for(
+                reader.readuntil(b'\r\n\r\n'),
+                self.heartbeat
+            )
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                asyncio.TimeoutError):
+            return None
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            return None
+        headers = {}
+        for line in lines[1:]:
+            name, separator, value = line.partition(':')
+            if separator:
+                headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+
+        return method, url.path, parse_qs(url.query), headers
+
+    async def respond(self, writer, status, detail, headers=()):
+        body = json.dumps({'detail': detail}).encode()
+        head = [
+            f'HTTP/1.1 {status} {REASONS[status]}',
+            'Content-Type: application/json',
+            f'Content-Length: {len(body)}',
+            'Connection: close',
+        ] + list(headers)
+        writer.write('\r\n'.join(head).encode() + b'\r\n\r\n' + body)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        """serves one connection"""
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            request = await self.read_request(reader)
+            if request is None:
+                return
+            method, path, query, headers = request
+            if path != self.path:
+                return await self.respond(writer, 404, 'Not found.')
+            if method != 'GET':
+                return await self.respond(
+                    writer,
+                    405,
+                    f'Method "{method}" not allowed.'
+                )
+
+            scheme, _, key = headers.get('authorization', '').partition(' ')
+            user = None
+            if scheme.lower() == 'token' and key.strip():
+                user = await self.call(authenticate, key.strip())
+            if user is None:
+                return await self.respond(
+                    writer,
+                    401,
+                    'Authentication credentials were not provided.',
+                    ['WWW-Authenticate: Token']
+                )
+
+            last_id = headers.get('last-event-id') or query.get(
+                'last_event_id',
+                ['']
+            )[0]
+            if last_id:
+                try:
+                    last_seq = int(last_id)
+                except ValueError:
+                    last_seq = -1
+                if last_seq < 0:
+                    return await self.respond(
+                        writer,
+                        400,
+                        'Last-Event-ID must be a change id.'
+                    )
+                if await self.call(sync.cursor_expired, user, last_seq):
+                    return await self.respond(
+                        writer,
+                        410,
+                        'Last-Event-ID is too old, sync again without a '
+                        'cursor.'
+                    )
+            else:
+                last_seq = await self.call(sync.latest_seq, user)
+
+            await self.stream(writer, user.pk, last_seq)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def stream(self, writer, user_id, last_seq):
+        """sends the user's changes after last_seq until the client leaves"""
+        subscriber = Subscriber(user_id, last_seq)
+        self.broker.subscribe(subscriber)
+        metrics.incr('events.streams')
+        try:
+            writer.write(
+                b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: text/event-stream\r\n'
+                b'Cache-Control: no-cache\r\n'
+                b'X-Accel-Buffering: no\r\n'
+                b'Connection: close\r\n\r\n'
+                b'retry: 3000\n\n'
+            )
+            # catches up on anything since Last-Event-ID
+            self.changed(user_id)
+            while True:
+                await writer.drain()
+                try:
+                    event = await asyncio.wait_for(
+                        subscriber.queue.get(),
+                        self.heartbeat
+                    )
+                except asyncio.TimeoutError:
+                    writer.write(b': keep-alive\n\n')
+                    continue
+                events = [event]
+                while not subscriber.queue.empty():
+                    events.append(subscriber.queue.get_nowait())
+                writer.write(b''.join(filter(None, events)))
+                if None in events:
+                    await writer.drain()
+                    return
+        finally:
+            self.broker.unsubscribe(subscriber)
@@ -0,0 +1,253 @@
+import heapq
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Q
+
+from core.models import Follow, Recipe, TimelineEntry
+from core.sharding import shard_for_user
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# timeline rows per INSERT, four parameters each, and users per trimming
+# DELETE, kept under SQLite's limit of 999 parameters
+ROWS_PER_INSERT = 200
+USERS_PER_TRIM = 500
+
+
+def encode_cursor(published_at, recipe_id):
+    """an opaque keyset cursor for the feed item after which to continue"""
+    return f'{(published_at - EPOCH) // timedelta(microseconds=1)}:' \
+           f'{recipe_id}'
+
+
+def decode_cursor(cursor):
+    """(published_at, recipe_id) of a cursor, ValueError if malformed"""
+    micros, recipe_id = cursor.split(':')
+
+    return EPOCH + timedelta(microseconds=int(micros)), int(recipe_id)
+
+
+def _before(cursor, time_field, id_field):
+    """filters rows that sort after the cursor, newest first"""
+    published_at, recipe_id = cursor
+
+    return Q(**{f'{time_field}__lt': published_at}) | Q(**{
+        time_field: published_at,
+        f'{id_field}__lt': recipe_id,
+    })
+
+
+def is_fanned_out(author):
+    """whether an author's recipes are copied into followers' timelines
+
+    Authors with more than FEED_FANOUT_MAX_FOLLOWERS followers are merged
+    into feeds when they are read instead.
+    """
+    return author.follower_count <= settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def _shards(user_ids, for_write=False):
+    """{alias: [user ids]} for users spread over shards"""
+    shards = defaultdict(list)
+    for user_id in user_ids:
+        shards[shard_for_user(user_id, for_write=for_write)].append(user_id)
+
+    return shards
+
+
+def _insert_entries(alias, rows):
+    """adds (user id, recipe id, author id, published_at) timeline rows
+
+    Rows already present are skipped with ON CONFLICT DO NOTHING, so a
+    job retried after a crash writes every row once.
+    """
+    connection = connections[alias]
+    table = connection.ops.quote_name(TimelineEntry._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), ROWS_PER_INSERT):
+            chunk = rows[start:start + ROWS_PER_INSERT]
+            cursor.execute(
+                f'INSERT INTO {table} '
+                '(user_id, recipe_id, author_id, published_at) VALUES '
+                + ', '.join(['(%s, %s, %s, %s)'] * len(chunk))
+                + ' ON CONFLICT DO NOTHING',
+                [
+                    value
+                    for user_id, recipe_id, author_id, published_at in chunk
+                    for value in (
+                        user_id,
+                        recipe_id,
+                        author_id,
+                        connection.ops.adapt_datetimefield_value(
+                            published_at
+                        ),
+                    )
+                ]
+            )
+
+
+def _trim(alias, user_ids):
+    """cuts timelines back to their FEED_TIMELINE_LENGTH newest rows"""
+    connection = connections[alias]
+    table = connection.ops.quote_name(TimelineEntry._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(user_ids), USERS_PER_TRIM):
+            chunk = user_ids[start:start + USERS_PER_TRIM]
+            cursor.execute(
+                f'DELETE FROM {table} WHERE id IN ('
+                'SELECT id FROM (SELECT id, ROW_NUMBER() OVER ('
+                'PARTITION BY user_id '
+                'ORDER BY published_at DESC, recipe_id DESC'
+                f') AS position FROM {table} WHERE user_id IN '
+                f'({", ".join(["%s"] * len(chunk))})'
+                ') ranked WHERE position > %s)',
+                chunk + [settings.FEED_TIMELINE_LENGTH]
+            )
+
+
+def fan_out(recipe_id, author_id):
+    """copies a public recipe into its author's followers' timelines
+
+    Followers are read in batches of FEED_FANOUT_BATCH by id, and each
+    batch is written with a few set based statements per shard. Returns
+    the number of timelines written to.
+    """
+    author = get_user_model().objects.get(pk=author_id)
+    if not is_fanned_out(author):
+        return 0
+    recipe = Recipe._base_manager.using(shard_for_user(author_id)).filter(
+        id=recipe_id,
+        is_public=True
+    ).values_list('published_at', flat=True).first()
+    if recipe is None:
+        return 0
+
+    followers = Follow.objects.filter(followee_id=author_id).order_by(
+        'follower_id'
+    ).values_list('follower_id', flat=True)
+    written = 0
+    last_id = 0
+    while True:
+        batch = list(followers.filter(
+            follower_id__gt=last_id
+        )[:settings.FEED_FANOUT_BATCH])
+        if not batch:
+            return written
+        for alias, user_ids in _shards(batch, for_write=True).items():
+            _insert_entries(alias, [
+                (user_id, recipe_id, author_id, recipe)
+                for user_id in user_ids
+            ])
+            _trim(alias, user_ids)
+        written += len(batch)
+        last_id = batch[-1]
+
+
+def retract(recipe_id):
+    """removes a recipe that was deleted or made private from timelines"""
+    retract_recipes([recipe_id])
+
+
+def retract_recipes(recipe_ids):
+    """removes several deleted or private recipes from timelines at once"""
+    if not recipe_ids:
+        return
+    for alias in settings.DATABASE_SHARDS or [DEFAULT_DB_ALIAS]:
+        TimelineEntry._base_manager.using(alias).filter(
+            recipe_id__in=recipe_ids
+        ).delete()
+
+
+def backfill(follower_id, followee_id):
+    """adds a newly followed author's recent public recipes to a timeline"""
+    followee = get_user_model().objects.get(pk=followee_id)
+    if not is_fanned_out(followee):
+        return
+    recipes = Recipe._base_manager.using(shard_for_user(followee_id)).filter(
+        user_id=followee_id,
+        is_public=True
+    ).order_by('-published_at', '-id').values_list(
+        'id',
+        'published_at'
+    )[:settings.FEED_TIMELINE_LENGTH]
+    alias = shard_for_user(follower_id, for_write=True)
+    _insert_entries(alias, [
+        (follower_id, recipe_id, followee_id, published_at)
+        for recipe_id, published_at in recipes
+    ])
+    _trim(alias, [follower_id])
+
+
+def forget(follower_id, followee_id):
+    """removes an unfollowed author's recipes from a timeline"""
+    alias = shard_for_user(follower_id, for_write=True)
+    TimelineEntry._base_manager.using(alias).filter(
+        user_id=follower_id,
+        author_id=followee_id
+    ).delete()
+
+
+def read(user, cursor=None, limit=None):
+    """(public recipes, next cursor) of a page of a user's feed
+
+    The page is one range scan over the user's timeline, newest first,
+    merged with the recipes of followed authors too popular to fan out.
+    Recipes made private or deleted since they were fanned out are left
+    out. The next cursor is None on the last page.
+    """
+    limit = limit or settings.FEED_PAGE_SIZE
+    timeline = TimelineEntry.objects.for_user(user)
+    if cursor is not None:
+        timeline = timeline.filter(
+            _before(cursor, 'published_at', 'recipe_id')
+        )
+    sources = [list(timeline.order_by(
+        '-published_at',
+        '-recipe_id'
+    ).values_list('published_at', 'recipe_id', 'author_id')[:limit])]
+
+    popular = Follow.objects.filter(
+        follower=user,
+        followee__follower_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+    ).values_list('followee_id', flat=True)
+    for alias, author_ids in _shards(popular).items():
+        recipes = Recipe._base_manager.using(alias).filter(
+            user_id__in=author_ids,
+            is_public=True
+        )
+        if cursor is not None:
+            recipes = recipes.filter(_before(cursor, 'published_at', 'id'))
+        sources.append(list(recipes.order_by(
+            '-published_at',
+            '-id'
+        ).values_list('published_at', 'id', 'user_id')[:limit]))
+
+    page = []
+    seen = set()
+    for row in heapq.merge(*sources, key=lambda row: row[:2], reverse=True):
+        if row[1] not in seen:
+            seen.add(row[1])
+            page.append(row)
+        if len(page) == limit:
+            break
+
+    wanted = defaultdict(list)
+    for _, recipe_id, author_id in page:
+        wanted[shard_for_user(author_id)].append(recipe_id)
+    found = {}
+    for alias, recipe_ids in wanted.items():
+        found.update(Recipe._base_manager.using(alias).filter(
+            id__in=recipe_ids,
+            is_public=True
+        ).in_bulk())
+    recipes = [found[row[1]] for row in page if row[1] in found]
+    next_cursor = (
+        encode_cursor(*page[-1][:2]) if len(page) == limit else None
+    )
+
+    return recipes, next_cursor
@@ -0,0 +1,476 @@
+import hashlib
+import io
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+
+from PIL import Image, ImageOps, features
+
+from core import objectstore
+from core.storage import ContentAddressed, hashed_name
+
+
+CONTENT_TYPES = {
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+
+# image formats only Pillow builds with the codec of the same name can write
+OPTIONAL_FORMATS = ('webp',)
+
+# content types clients may upload straight to storage, and the extension
+# their files are stored with
+UPLOAD_TYPES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+}
+UPLOAD_SALT = 'recipe.images.upload'
+
+# cache hits only rewrite a file's mtime once it is this many seconds old
+TOUCH_INTERVAL = 60
+
+# Recipe fields filled in by extract_metadata()
+METADATA_FIELDS = (
+    'image_width',
+    'image_height',
+    'image_format',
+    'image_bytes',
+    'image_orientation',
+    'image_placeholder',
+    'image_color',
+)
+
+EXIF_ORIENTATION = 0x0112
+BASE83 = (
+    '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+    '#$%*+,-.:;=?@[]^_{|}~'
+)
+SRGB_TO_LINEAR = [
+    value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+    for value in (channel / 255 for channel in range(256))
+]
+
+
+class UnreadableImage(Exception):
+    """A stored image could not be decoded"""
+
+
+def can_write(fmt):
+    """whether the installed Pillow can encode variants in fmt"""
+    return fmt not in OPTIONAL_FORMATS or features.check(fmt)
+
+
+class Variant(namedtuple('Variant', 'width height dpr fit fmt quality')):
+    """A resized, cropped or re-encoded copy of an image"""
+
+    @property
+    def box(self):
+        """the output size in pixels, None for an unbounded side"""
+        return tuple(
+            side * self.dpr if side else None
+            for side in (self.width, self.height)
+        )
+
+    @property
+    def extension(self):
+        return '.jpg' if self.fmt == 'jpeg' else f'.{self.fmt}'
+
+    def key(self, source_name):
+        """names the variant of a stored file in the cache"""
+        return hashlib.sha256(
+            f'{source_name}:{tuple(self)}'.encode()
+        ).hexdigest()[:40]
+
+
+def render(source, variant):
+    """returns the variant of an image file as encoded bytes"""
+    image = Image.open(source)
+    width, height = variant.box
+    largest = max(width or 0, height or 0)
+    # JPEGs are decoded straight at the smallest scale still covering
+    # the output, whichever way the image turns out to be rotated
+    image.draft('RGB', (largest, largest))
+    if hasattr(ImageOps, 'exif_transpose'):
+        image = ImageOps.exif_transpose(image)
+    if variant.fmt == 'jpeg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA')
+
+    if variant.fit == 'cover' and width and height:
+        image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+    else:
+        image.thumbnail(
+            (width or image.width, height or image.height),
+            Image.LANCZOS
+        )
+
+    output = io.BytesIO()
+    image.save(output, variant.fmt.upper(), quality=variant.quality)
+
+    return output.getvalue()
+
+
+def _base83(value, length):
+    return ''.join(
+        BASE83[value // 83 ** (length - digit - 1) % 83]
+        for digit in range(length)
+    )
+
+
+def _linear_to_srgb(value):
+    value = min(max(value, 0.0), 1.0)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(image, x_components=4, y_components=3):
+    """the BlurHash of an image and its average colour as '#rrggbb'
+
+    The image is shrunk to at most 32x32 first, which is plenty for a
+    hash of 4x3 components.
+    """
+    image = image.convert('RGB')
+    image.thumbnail((32, 32))
+    width, height = image.size
+    pixels = [
+        tuple(SRGB_TO_LINEAR[channel] for channel in pixel)
+        for pixel in image.getdata()
+    ]
+
+    factors = []
+    for j in range(y_components):
+        cos_y = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(x_components):
+            cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+            normalisation = 1 if i == 0 and j == 0 else 2
+            red = green = blue = 0.0
+            for y in range(height):
+                for x in range(width):
+                    basis = normalisation * cos_x[x] * cos_y[y]
+                    pixel = pixels[y * width + x]
+                    red += basis * pixel[0]
+                    green += basis * pixel[1]
+                    blue += basis * pixel[2]
+            scale = 1 / (width * height)
+            factors.append((red * scale, green * scale, blue * scale))
+
+    average = [_linear_to_srgb(channel) for channel in factors[0]]
+    ac = factors[1:]
+    encoded = _base83(x_components - 1 + (y_components - 1) * 9, 1)
+    if ac:
+        largest = max(abs(channel) for factor in ac for channel in factor)
+        quantised = max(0, min(82, int(largest * 166 - 0.5)))
+        maximum = (quantised + 1) / 166
+        encoded += _base83(quantised, 1)
+    else:
+        maximum = 1
+        encoded += _base83(0, 1)
+    encoded += _base83(
+        (average[0] << 16) + (average[1] << 8) + average[2],
+        4
+    )
+    for factor in ac:
+        red, green, blue = (
+            max(0, min(18, int(math.floor(
+                math.copysign(abs(channel / maximum) ** 0.5, channel) * 9
+                + 9.5
+            ))))
+            for channel in factor
+        )
+        encoded += _base83(red * 19 * 19 + green * 19 + blue, 2)
+
+    return encoded, '#{:02x}{:02x}{:02x}'.format(*average)
+
+
+def _orientation(image):
+    """the EXIF orientation of an image, 1 when it has none"""
+    if hasattr(image, 'getexif'):
+        exif = image.getexif()
+    else:
+        exif = getattr(image, '_getexif', lambda: None)()
+    try:
+        return int((exif or {}).get(EXIF_ORIENTATION, 1)) or 1
+    except (TypeError, ValueError):
+        return 1
+
+
+def extract_metadata(file):
+    """the Recipe image_* field values for an image file
+
+    Width and height are as displayed, after the EXIF orientation is
+    applied. Only a downscaled copy of the image is decoded.
+    """
+    file.seek(0)
+    image = Image.open(file)
+    width, height = image.size
+    orientation = _orientation(image)
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    image_format = (image.format or '').lower()
+
+    image.draft('RGB', (64, 64))
+    if hasattr(ImageOps, 'exif_transpose'):
+        image = ImageOps.exif_transpose(image)
+    placeholder, color = blurhash(image)
+    file.seek(0)
+
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_format': image_format,
+        'image_bytes': file.size,
+        'image_orientation': orientation,
+        'image_placeholder': placeholder,
+        'image_color': color,
+    }
+
+
+def stored_metadata(name):
+    """extract_metadata() for a stored file, or None if it is missing"""
+    if not default_storage.exists(name):
+        return None
+    with default_storage.open(name) as file:
+        return extract_metadata(file)
+
+
+def upload_key(recipe, content_type, sha256):
+    """the name a directly uploaded image of a recipe is stored under"""
+    field = recipe._meta.get_field('image')
+    name = field.generate_filename(
+        recipe,
+        'upload' + UPLOAD_TYPES[content_type]
+    )
+    if isinstance(field.storage, ContentAddressed):
+        name = hashed_name(name, sha256)
+
+    return name
+
+
+def upload_ticket(recipe, content_type, size, sha256):
+    """a presigned PUT for a recipe image and the token to finalize it
+
+    The store only accepts the upload if it has the given type, size and
+    sha256. The token carries the same, signed, so finalizing needs no
+    state kept between the two calls.
+    """
+    key = upload_key(recipe, content_type, sha256)
+    headers = objectstore.upload_headers(content_type, size, sha256)
+    upload = {
+        'recipe': recipe.id,
+        'key': key,
+        'content_type': content_type,
+        'size': size,
+        'sha256': sha256,
+    }
+
+    return {
+        'key': key,
+        'method': 'PUT',
+        'url': objectstore.store().presigned_url(
+            key,
+            'PUT',
+            settings.IMAGE_UPLOAD_URL_EXPIRY,
+            headers
+        ),
+        'headers': headers,
+        'token': signing.dumps(upload, salt=UPLOAD_SALT, compress=True),
+    }
+
+
+def load_upload(token):
+    """the upload a token from upload_ticket() describes
+
+    Tokens are accepted for twice as long as the upload URL, so an upload
+    finishing just before the URL expires can still be finalized.
+    """
+    return signing.loads(
+        token,
+        salt=UPLOAD_SALT,
+        max_age=2 * settings.IMAGE_UPLOAD_URL_EXPIRY
+    )
+
+
+class DiskCache:
+    """A size bounded LRU cache of files on local disk
+
+    Entries are written to a temporary file and renamed into place, so
+    readers never see a partial file. Hits bump a file's mtime, and when
+    the cache grows past max_bytes the least recently used files are
+    removed until it is back under 90% of that.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = None
+        self._lock = threading.Lock()
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    def get(self, key, extension):
+        """the path of a cached file, or None"""
+        path = self.path(key, extension)
+        try:
+            modified = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        if time.time() - modified > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+
+        return path
+
+    def put(self, key, extension, data):
+        """stores a file atomically, returns its path"""
+        path = self.path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(
+            dir=os.path.dirname(path),
+            prefix='.tmp-'
+        )
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        self._grow(len(data))
+
+        return path
+
+    def _files(self):
+        """(mtime, size, path) of every cached file"""
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith('.tmp-'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _grow(self, size):
+        with self._lock:
+            if self.size is None:
+                self.size = sum(entry[1] for entry in self._files())
+            else:
+                self.size += size
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """removes least recently used files until under the low mark"""
+        files = sorted(self._files())
+        total = sum(entry[1] for entry in files)
+        target = self.max_bytes * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.size = total
+
+
+_cache = None
+_executor = None
+_inflight = {}
+_lock = threading.RLock()
+
+
+def cache():
+    global _cache
+    with _lock:
+        if _cache is None or _cache.directory != settings.IMAGE_CACHE_DIR:
+            _cache = DiskCache(
+                settings.IMAGE_CACHE_DIR,
+                settings.IMAGE_CACHE_MAX_BYTES
+            )
+
+        return _cache
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.IMAGE_RESIZE_WORKERS)
+
+        return _executor
+
+
+def _render_to_cache(key, source_name, variant):
+    path = cache().get(key, variant.extension)
+    if path is not None:
+        return path
+    with default_storage.open(source_name) as source:
+        try:
+            data = render(source, variant)
+        except (OSError, SyntaxError, Image.DecompressionBombError) as exc:
+            raise UnreadableImage(source_name) from exc
+
+    return cache().put(key, variant.extension, data)
+
+
+def variant_path(source_name, variant):
+    """the path of a cached variant of a stored image, rendered if needed
+
+    Rendering runs on a pool of IMAGE_RESIZE_WORKERS threads. Requests
+    for a variant already being rendered wait for that render instead of
+    decoding the image again. Raises concurrent.futures.TimeoutError if
+    no result arrives within IMAGE_RESIZE_TIMEOUT seconds,
+    FileNotFoundError if the stored image is missing and UnreadableImage
+    if it cannot be decoded.
+    """
+    key = variant.key(source_name)
+    path = cache().get(key, variant.extension)
+    if path is not None:
+        return path
+
+    with _lock:
+        future = _inflight.get(key)
+        if future is None:
+            future = _inflight[key] = executor().submit(
+                _render_to_cache,
+                key,
+                source_name,
+                variant
+            )
+            future.add_done_callback(lambda done: _forget(key))
+
+    return future.result(timeout=settings.IMAGE_RESIZE_TIMEOUT)
+
+
+def _forget(key):
+    with _lock:
+        _inflight.pop(key, None)
+
+
+def open_variant(source_name, variant):
+    """opens a cached variant, rendering it again if it was just evicted"""
+    path = variant_path(source_name, variant)
+    try:
+        return open(path, 'rb')
+    except FileNotFoundError:
+        return open(variant_path(source_name, variant), 'rb')
@@ -1,9 +1,37 @@
+import json
+
+from django.conf import settings
+from django.core import signing
+from django.utils.translation import ugettext_lazy as _
+
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS, PKOnlyObject
+
+from core import objectstore
+from core.models import Tag, Ingredient, Recipe, RecipeIngredient, \
+                        RecipeStats, normalize_name
+from core.storage import ContentAddressed, ObjectStorage
+from recipe import images, stats
+from recipe.tasks import store_image_metadata
+
 
-from core.models import Tag, Ingredient, Recipe
+class UniqueNameMixin:
+    """Rejects names the user already has, ignoring case"""
 
+    def validate_name(self, value):
+        value = normalize_name(value)
+        request = self.context.get('request')
+        if request is not None and self.Meta.model.objects.for_user(
+            request.user
+        ).filter(name__iexact=value).exists():
+            raise serializers.ValidationError(
+                _('You already have one named "{name}".').format(name=value)
+            )
 
-class TagSerializer(serializers.ModelSerializer):
+        return value
+
+
+class TagSerializer(UniqueNameMixin, serializers.ModelSerializer):
     """Serializer for the tag object"""
 
     class Meta:
@@ -12,7 +40,7 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', )
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(UniqueNameMixin, serializers.ModelSerializer):
     """Serializes the Ingredient obejct"""
 
     class Meta:
@@ -21,16 +49,108 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', )
 
 
+class UserOwnedManyRelatedField(serializers.ManyRelatedField):
+    """Resolves a list of primary keys with a single id__in query"""
+    default_error_messages = {
+        'does_not_exist': _('Invalid pks {pk_values} - objects do not exist.'),
+        'incorrect_type': _('Incorrect types {values}. Expected pk values.'),
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        pks = []
+        incorrect = []
+        for item in data:
+            try:
+                pks.append(int(item))
+            except (TypeError, ValueError):
+                incorrect.append(repr(item))
+        if incorrect:
+            self.fail('incorrect_type', values=', '.join(incorrect))
+
+        found = self.child_relation.get_queryset().in_bulk(set(pks))
+        missing = [str(pk) for pk in dict.fromkeys(pks) if pk not in found]
+        if missing:
+            self.fail('does_not_exist', pk_values=', '.join(missing))
+
+        return [found[pk] for pk in dict.fromkeys(pks)]
+
+
+class UserOwnedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field limited to rows owned by the requesting user"""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+
+        return UserOwnedManyRelatedField(**list_kwargs)
+
+    def get_queryset(self):
+        request = self.context.get('request')
+        queryset = super().get_queryset()
+        if request is None or not request.user.is_authenticated:
+            return queryset.none()
+
+        return queryset.for_user(request.user)
+
+
+class RecipeIngredientIdsField(UserOwnedManyRelatedField):
+    """Ingredient ids of a recipe read off its ingredient_amounts
+
+    Serializing both fields then needs a single prefetch.
+    """
+
+    def get_attribute(self, instance):
+        return [
+            PKOnlyObject(pk=amount.ingredient_id)
+            for amount in instance.ingredient_amounts.all()
+        ]
+
+
+class RecipeIngredientSerializer(serializers.ModelSerializer):
+    """Serializes how much of an ingredient a recipe needs"""
+    ingredient = serializers.IntegerField(source='ingredient_id')
+
+    class Meta:
+        model = RecipeIngredient
+        fields = ('ingredient', 'quantity', 'unit')
+        extra_kwargs = {'quantity': {'min_value': 0}}
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Serializes the Recipe object"""
-    ingredients = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=Ingredient.objects.all()
+    ingredients = RecipeIngredientIdsField(
+        child_relation=UserOwnedPrimaryKeyRelatedField(
+            queryset=Ingredient.objects.all()
+        ),
+        required=False
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = UserOwnedPrimaryKeyRelatedField(
         many=True,
+        required=False,
         queryset=Tag.objects.all()
     )
+    ingredient_names = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        required=False,
+        write_only=True
+    )
+    tag_names = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        required=False,
+        write_only=True
+    )
+    ingredient_amounts = RecipeIngredientSerializer(
+        many=True,
+        required=False
+    )
 
     class Meta:
         model = Recipe
@@ -41,9 +161,88 @@ class RecipeSerializer(serializers.ModelSerializer):
             'price',
             'link',
             'ingredients',
-            'tags'
+            'ingredient_amounts',
+            'tags',
+            'ingredient_names',
+            'tag_names',
+            'is_public',
+            'published_at',
+        ) + images.METADATA_FIELDS
+        read_only_fields = ('id', 'published_at') + images.METADATA_FIELDS
+
+    def _resolve_names(self, validated_data, user):
+        """adds the user's tags and ingredients named in the payload"""
+        for field, model in (('ingredients', Ingredient), ('tags', Tag)):
+            names = validated_data.pop(f'{field[:-1]}_names', None)
+            if names is not None:
+                rows, _ = model.objects.get_or_create_names(user, names)
+                validated_data[field] = list(
+                    validated_data.get(field, [])
+                ) + rows
+
+        return validated_data
+
+    def validate_ingredient_amounts(self, value):
+        """checks the ingredients are listed once and are the user's"""
+        ids = [amount['ingredient_id'] for amount in value]
+        if len(set(ids)) < len(ids):
+            raise serializers.ValidationError(
+                _('List each ingredient once.')
+            )
+        owned = set(Ingredient.objects.for_user(
+            self.context['request'].user
+        ).filter(id__in=ids).values_list('id', flat=True))
+        missing = [str(pk) for pk in ids if pk not in owned]
+        if missing:
+            raise serializers.ValidationError(
+                _('Invalid pks {pk_values} - objects do not exist.').format(
+                    pk_values=', '.join(missing)
+                )
+            )
+
+        return value
+
+    def _pop_amounts(self, validated_data):
+        """{ingredient id: (quantity, unit) or None} to save, if given
+
+        Ingredients listed by id or name without an amount keep the one
+        they already have.
+        """
+        ingredients = validated_data.pop('ingredients', None)
+        amounts = validated_data.pop('ingredient_amounts', None)
+        if ingredients is None and amounts is None:
+            return None
+        wanted = dict.fromkeys(
+            ingredient.pk for ingredient in ingredients or []
+        )
+        for amount in amounts or []:
+            wanted[amount['ingredient_id']] = (
+                amount.get('quantity'),
+                amount.get('unit', '')
+            )
+
+        return wanted
+
+    def create(self, validated_data):
+        validated_data = self._resolve_names(
+            validated_data,
+            validated_data['user']
         )
-        read_only_fields = ('id',)
+        amounts = self._pop_amounts(validated_data)
+        recipe = super().create(validated_data)
+        if amounts:
+            RecipeIngredient.objects.set_for_recipe(recipe, amounts)
+
+        return recipe
+
+    def update(self, instance, validated_data):
+        validated_data = self._resolve_names(validated_data, instance.user)
+        amounts = self._pop_amounts(validated_data)
+        recipe = super().update(instance, validated_data)
+        if amounts is not None:
+            RecipeIngredient.objects.set_for_recipe(recipe, amounts)
+
+        return recipe
 
 
 class RecipeDetailSerializer(RecipeSerializer):
@@ -52,10 +251,273 @@ class RecipeDetailSerializer(RecipeSerializer):
     tags = TagSerializer(many=True, read_only=True)
 
 
+class FeedRecipeSerializer(serializers.ModelSerializer):
+    """Serializes a public recipe in another user's feed"""
+
+    class Meta:
+        model = Recipe
+        fields = (
+            'id',
+            'user',
+            'title',
+            'time_minutes',
+            'price',
+            'link',
+            'image',
+            'published_at',
+        ) + images.METADATA_FIELDS
+        read_only_fields = fields
+
+
 class RecipeImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading images to recipe"""
 
     class Meta:
         model = Recipe
-        fields = ('id', 'image')
-        read_only_fields = ('id',)
+        fields = ('id', 'image') + images.METADATA_FIELDS
+        read_only_fields = ('id',) + images.METADATA_FIELDS
+
+    def update(self, instance, validated_data):
+        """stores the image along with its size, format and placeholder"""
+        image = validated_data.get('image')
+        if image:
+            validated_data.update(images.extract_metadata(image))
+        else:
+            validated_data.update({
+                field: Recipe._meta.get_field(field).get_default()
+                for field in images.METADATA_FIELDS
+            })
+
+        return super().update(instance, validated_data)
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Lists some of the user's recipes, at most max_setting of them"""
+    max_setting = None
+    too_many_message = None
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        min_length=1
+    )
+
+    def validate_ids(self, value):
+        most = getattr(settings, self.max_setting)
+        if len(value) > most:
+            raise serializers.ValidationError(
+                self.too_many_message.format(count=most)
+            )
+        owned = set(Recipe.objects.for_user(
+            self.context['request'].user
+        ).filter(id__in=value).values_list('id', flat=True))
+        missing = sorted(set(value) - owned)
+        if missing:
+            raise serializers.ValidationError(
+                _('Recipes {ids} do not exist.').format(ids=missing)
+            )
+
+        return value
+
+
+class RecipeCloneSerializer(RecipeIdsSerializer):
+    """Lists the user's recipes to copy"""
+    max_setting = 'RECIPE_CLONE_MAX'
+    too_many_message = _('Clone at most {count} recipes at once.')
+
+
+class ShoppingListSerializer(RecipeIdsSerializer):
+    """Lists the user's recipes to shop for, repeated to cook them again"""
+    max_setting = 'SHOPPING_LIST_MAX_RECIPES'
+    too_many_message = _('Shop for at most {count} recipes at once.')
+
+
+class ShoppingListItemSerializer(serializers.Serializer):
+    """Serializes the total amount of an ingredient to buy"""
+    ingredient = serializers.IntegerField()
+    name = serializers.CharField()
+    quantity = serializers.DecimalField(
+        max_digits=20,
+        decimal_places=3,
+        allow_null=True
+    )
+    unit = serializers.CharField()
+
+
+class ImageUploadSerializer(serializers.Serializer):
+    """Describes an image the client will upload straight to storage"""
+    content_type = serializers.ChoiceField(choices=list(images.UPLOAD_TYPES))
+    size = serializers.IntegerField(min_value=1)
+    sha256 = serializers.RegexField(r'^[0-9a-f]{64}$')
+
+    def validate_size(self, value):
+        if value > settings.IMAGE_UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError(
+                _('Images may be at most {size} bytes.').format(
+                    size=settings.IMAGE_UPLOAD_MAX_BYTES
+                )
+            )
+
+        return value
+
+    def validate(self, attrs):
+        storage = Recipe._meta.get_field('image').storage
+        if not isinstance(storage, ObjectStorage):
+            raise serializers.ValidationError(
+                _('Direct uploads need an object storage backend.')
+            )
+
+        return attrs
+
+
+class ImageUploadFinalizeSerializer(serializers.Serializer):
+    """Attaches an image uploaded straight to storage to a recipe
+
+    The upload is checked against the store's record of the object, its
+    size, type and the sha256 the store verified, without reading it.
+    Metadata is extracted afterwards by a background job.
+    """
+    token = serializers.CharField()
+
+    def validate_token(self, value):
+        try:
+            upload = images.load_upload(value)
+        except signing.BadSignature:
+            upload = None
+        if upload is None or upload['recipe'] != self.instance.id:
+            raise serializers.ValidationError(
+                _('Invalid or expired upload token.')
+            )
+
+        store = objectstore.store()
+        head = store.head(upload['key'])
+        if head is None:
+            raise serializers.ValidationError(
+                _('The image has not been uploaded.')
+            )
+        if head['size'] != upload['size'] or \
+                head['content_type'] != upload['content_type'] or \
+                store.checksum(upload['key']) != upload['sha256']:
+            raise serializers.ValidationError(
+                _('The uploaded image does not match its size, type or '
+                  'checksum.')
+            )
+
+        return upload
+
+    def update(self, instance, validated_data):
+        upload = validated_data['token']
+        storage = Recipe._meta.get_field('image').storage
+        if isinstance(storage, ContentAddressed):
+            storage.register(upload['key'], upload['size'])
+
+        instance.image.name = upload['key']
+        for field in images.METADATA_FIELDS:
+            setattr(
+                instance,
+                field,
+                Recipe._meta.get_field(field).get_default()
+            )
+        instance.image_format = upload['content_type'].split('/')[1]
+        instance.image_bytes = upload['size']
+        instance.save(update_fields=['image'] + list(images.METADATA_FIELDS))
+        store_image_metadata.enqueue({
+            'user_id': instance.user_id,
+            'recipe_id': instance.id,
+            'name': upload['key'],
+        })
+
+        return instance
+
+
+class ImageVariantSerializer(serializers.Serializer):
+    """Validates the query parameters of a resized recipe image
+
+    Only the sizes, DPRs, formats and qualities allowed in settings are
+    accepted, so clients cannot fill the cache with arbitrary variants.
+    Formats the installed Pillow cannot write are rejected as well.
+    """
+    w = serializers.ChoiceField(choices=(), required=False)
+    h = serializers.ChoiceField(choices=(), required=False)
+    dpr = serializers.ChoiceField(choices=(), default=1)
+    fit = serializers.ChoiceField(
+        choices=('contain', 'cover'),
+        default='contain'
+    )
+    fmt = serializers.ChoiceField(choices=(), default='jpeg')
+    q = serializers.ChoiceField(choices=(), required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['w'].choices = settings.IMAGE_VARIANT_SIZES
+        self.fields['h'].choices = settings.IMAGE_VARIANT_SIZES
+        self.fields['dpr'].choices = settings.IMAGE_VARIANT_DPRS
+        self.fields['fmt'].choices = [
+            fmt for fmt in settings.IMAGE_VARIANT_FORMATS
+            if images.can_write(fmt)
+        ]
+        self.fields['q'].choices = settings.IMAGE_VARIANT_QUALITIES
+
+    def validate(self, attrs):
+        if not attrs.get('w') and not attrs.get('h'):
+            raise serializers.ValidationError(_('Give a width or height.'))
+
+        return attrs
+
+    def to_variant(self):
+        data = self.validated_data
+        return images.Variant(
+            width=data.get('w'),
+            height=data.get('h'),
+            dpr=data['dpr'],
+            fit=data['fit'],
+            fmt=data['fmt'],
+            quality=data.get('q', settings.IMAGE_VARIANT_QUALITIES[-1])
+        )
+
+
+class RecipeStatsSerializer(serializers.ModelSerializer):
+    """Serializes the precomputed recipe stats for a user"""
+    average_price = serializers.SerializerMethodField()
+    median_price = serializers.SerializerMethodField()
+    time_histogram = serializers.SerializerMethodField()
+    top_tags = serializers.SerializerMethodField()
+    top_ingredients = serializers.SerializerMethodField()
+
+    class Meta:
+        model = RecipeStats
+        fields = (
+            'recipe_count',
+            'average_price',
+            'median_price',
+            'time_histogram',
+            'top_tags',
+            'top_ingredients',
+        )
+        read_only_fields = fields
+
+    def get_average_price(self, obj):
+        if not obj.recipe_count:
+            return None
+        return str((obj.price_total / obj.recipe_count).quantize(stats.CENT))
+
+    def get_median_price(self, obj):
+        median = stats.median_price(obj)
+        return None if median is None else str(median)
+
+    def get_time_histogram(self, obj):
+        return json.loads(obj.time_histogram)
+
+    def _top(self, obj, model, raw):
+        top = stats.top_counts(raw)
+        names = model.objects.for_user(obj.user).in_bulk(
+            [pk for pk, _ in top]
+        )
+        return [
+            {'id': pk, 'name': names[pk].name, 'count': count}
+            for pk, count in top if pk in names
+        ]
+
+    def get_top_tags(self, obj):
+        return self._top(obj, Tag, obj.tag_counts)
+
+    def get_top_ingredients(self, obj):
+        return self._top(obj, Ingredient, obj.ingredient_counts)
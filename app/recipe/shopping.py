@@ -0,0 +1,61 @@
+from collections import Counter
+
+from django.db.models import Case, CharField, Count, DecimalField, F, Q, \
+                             Sum, Value, When
+
+from core.models import INGREDIENT_UNITS, RecipeIngredient
+from core.sharding import shard_for_user
+
+
+def _by_unit(position, output_field):
+    """picks a column of INGREDIENT_UNITS by each row's unit"""
+    return Case(
+        *[When(unit=unit, then=Value(converted[position]))
+          for unit, converted in INGREDIENT_UNITS.items()],
+        output_field=output_field
+    )
+
+
+def shopping_list(user, recipe_ids):
+    """totals of the ingredients of a user's recipes, sorted by name
+
+    Quantities are converted to grams, millilitres or whole items and
+    summed by one grouped query, whatever the number of recipes. Recipes
+    listed more than once count that many times. Ingredients measured in
+    both weight and volume get a total for each. A total that any recipe
+    lists without a quantity is None, since it cannot be summed.
+    """
+    times = Counter(recipe_ids)
+    amount = F('quantity') * _by_unit(1, DecimalField())
+    repeated = {pk: count for pk, count in times.items() if count > 1}
+    if repeated:
+        amount = amount * Case(
+            *[When(recipe_id=pk, then=Value(count))
+              for pk, count in repeated.items()],
+            default=Value(1),
+            output_field=DecimalField()
+        )
+
+    totals = RecipeIngredient.objects.using(shard_for_user(user.pk)).filter(
+        recipe__user=user,
+        recipe_id__in=list(times)
+    ).annotate(
+        total_unit=_by_unit(0, CharField())
+    ).values(
+        'ingredient_id',
+        'ingredient__name',
+        'total_unit'
+    ).annotate(
+        total=Sum(amount, output_field=DecimalField()),
+        unmeasured=Count('id', filter=Q(quantity__isnull=True))
+    ).order_by('ingredient__name', 'total_unit')
+
+    return [
+        {
+            'ingredient': row['ingredient_id'],
+            'name': row['ingredient__name'],
+            'quantity': None if row['unmeasured'] else row['total'],
+            'unit': row['total_unit'],
+        }
+        for row in totals
+    ]
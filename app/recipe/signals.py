@@ -0,0 +1,182 @@
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_init, \
+                                     post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Follow, Ingredient, Recipe, Tag, ingredients_set, \
+                        names_created
+from recipe import events, sync, tasks
+from recipe.cloning import recipes_cloned
+
+
+_state = threading.local()
+
+
+def _deleting_users():
+    """ids of users being deleted on this thread"""
+    if not hasattr(_state, 'users'):
+        _state.users = set()
+
+    return _state.users
+
+
+def _record(user_id, using, upserted=(), deleted=()):
+    """logs changes to the owner's change log and notifies event streams"""
+    if user_id in _deleting_users():
+        return
+    seq = sync.record_changes(
+        get_user_model()(pk=user_id),
+        upserted=upserted,
+        deleted=deleted
+    )
+    if seq is not None:
+        events.notify(using, user_id, seq)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def record_save(sender, instance, raw, using, **kwargs):
+    if not raw:
+        _record(instance.user_id, using, upserted=[instance])
+
+
+@receiver(names_created, sender=Tag)
+@receiver(names_created, sender=Ingredient)
+@receiver(recipes_cloned, sender=Recipe)
+@receiver(ingredients_set, sender=Recipe)
+def record_bulk_insert(sender, instances, using, **kwargs):
+    if instances:
+        _record(instances[0].user_id, using, upserted=instances)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def record_delete(sender, instance, using, **kwargs):
+    _record(instance.user_id, using, deleted=[instance])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def record_links(sender, instance, action, reverse, pk_set, using,
+                 **kwargs):
+    """logs recipes whose tags or ingredients were added or removed"""
+    if not reverse:
+        if action == 'post_clear' or (
+            action in ('post_add', 'post_remove') and pk_set
+        ):
+            _record(instance.user_id, using, upserted=[instance])
+        return
+
+    # the tag or ingredient side was changed, so log its recipes
+    if action == 'pre_clear':
+        instance._cleared_recipe_ids = list(
+            sender.objects.using(using).filter(**{
+                f'{instance._meta.model_name}_id': instance.pk
+            }).values_list('recipe_id', flat=True)
+        )
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_recipe_ids', ())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    _record(instance.user_id, using, upserted=[
+        Recipe(pk=pk, user_id=instance.user_id) for pk in sorted(pk_set)
+    ])
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def stop_recording(sender, instance, **kwargs):
+    """rows deleted along with their owner leave nobody to sync"""
+    _deleting_users().add(instance.pk)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def resume_recording(sender, instance, **kwargs):
+    _deleting_users().discard(instance.pk)
+
+
+def _is_public(instance):
+    """the recipe's is_public flag, or None if the field was deferred"""
+    return instance.__dict__.get('is_public')
+
+
+@receiver(post_init, sender=Recipe)
+def remember_visibility(sender, instance, **kwargs):
+    instance._was_public = _is_public(instance)
+
+
+@receiver(pre_save, sender=Recipe)
+def stamp_publication(sender, instance, raw, using, update_fields,
+                      **kwargs):
+    """dates recipes as they are made public"""
+    instance._feed_task = None
+    is_public = _is_public(instance)
+    if raw or is_public is None or (
+        update_fields is not None and 'is_public' not in update_fields
+    ):
+        return
+    if instance._state.adding:
+        was_public = False
+    elif instance._was_public is not None:
+        was_public = instance._was_public
+    else:
+        was_public = sender._base_manager.using(using).filter(
+            pk=instance.pk
+        ).values_list('is_public', flat=True).first()
+    if is_public and not was_public:
+        instance.published_at = timezone.now()
+        instance._feed_task = tasks.fan_out
+    elif was_public and not is_public:
+        instance._feed_task = tasks.retract
+
+
+@receiver(post_save, sender=Recipe)
+def update_feeds(sender, instance, using, update_fields, **kwargs):
+    """queues adding a recipe to feeds or taking it out of them"""
+    feed_task = instance.__dict__.pop('_feed_task', None)
+    instance._was_public = _is_public(instance)
+    if feed_task is None:
+        return
+    if feed_task is tasks.retract:
+        tasks.retract.enqueue({'recipe_id': instance.pk})
+        return
+    if update_fields is not None and 'published_at' not in update_fields:
+        sender._base_manager.using(using).filter(pk=instance.pk).update(
+            published_at=instance.published_at
+        )
+    tasks.fan_out.enqueue({
+        'recipe_id': instance.pk,
+        'author_id': instance.user_id,
+    })
+
+
+@receiver(post_delete, sender=Recipe)
+def retract_deleted(sender, instance, **kwargs):
+    if instance.__dict__.get('published_at') is not None:
+        tasks.retract.enqueue({'recipe_id': instance.pk})
+
+
+@receiver(post_save, sender=Follow)
+def fill_feed(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        tasks.follow.enqueue({
+            'follower_id': instance.follower_id,
+            'followee_id': instance.followee_id,
+        })
+
+
+@receiver(post_delete, sender=Follow)
+def clear_feed(sender, instance, **kwargs):
+    if instance.follower_id in _deleting_users():
+        # the follower's timeline is deleted along with them
+        return
+    tasks.unfollow.enqueue({
+        'follower_id': instance.follower_id,
+        'followee_id': instance.followee_id,
+    })
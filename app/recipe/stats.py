@@ -0,0 +1,196 @@
+import json
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+
+from core.models import Recipe, RecipeStats
+from core.sharding import shard_for_user
+
+
+TIME_BUCKETS = (15, 30, 60, 120)
+TOP_COUNT = 5
+CENT = Decimal('0.01')
+
+
+def time_bucket(minutes):
+    """returns the histogram label a cooking time falls into"""
+    lower = 0
+    for upper in TIME_BUCKETS:
+        if minutes < upper:
+            return f'{lower}-{upper}'
+        lower = upper
+
+    return f'{lower}+'
+
+
+def to_cents(price):
+    """converts a price to whole cents"""
+    return int(Decimal(str(price)).quantize(CENT) * 100)
+
+
+def recipe_snapshot(recipe):
+    """captures everything a recipe contributes to its owner's stats"""
+    return {
+        'cents': to_cents(recipe.price),
+        'time': time_bucket(recipe.time_minutes),
+        'tags': list(recipe.tags.values_list('id', flat=True)),
+        'ingredients': list(
+            recipe.ingredients.values_list('id', flat=True)
+        ),
+    }
+
+
+def _load(stats):
+    return {
+        'price_counts': Counter(json.loads(stats.price_counts)),
+        'time_histogram': Counter(json.loads(stats.time_histogram)),
+        'tag_counts': Counter(json.loads(stats.tag_counts)),
+        'ingredient_counts': Counter(json.loads(stats.ingredient_counts)),
+    }
+
+
+def _dump(stats, counters):
+    for field, counter in counters.items():
+        setattr(stats, field, json.dumps(
+            {key: count for key, count in counter.items() if count > 0},
+            sort_keys=True
+        ))
+
+
+def _apply(stats, counters, snapshot, sign):
+    stats.recipe_count += sign
+    stats.price_total += sign * Decimal(snapshot['cents']) / 100
+    counters['price_counts'][str(snapshot['cents'])] += sign
+    counters['time_histogram'][snapshot['time']] += sign
+    for tag_id in snapshot['tags']:
+        counters['tag_counts'][str(tag_id)] += sign
+    for ingredient_id in snapshot['ingredients']:
+        counters['ingredient_counts'][str(ingredient_id)] += sign
+
+
+def apply_recipe_change(user, old=None, new=None):
+    """moves a user's stats from an old recipe snapshot to a new one"""
+    return apply_recipe_changes(
+        user,
+        removed=[old] if old is not None else [],
+        added=[new] if new is not None else []
+    )
+
+
+def atomic_for(user):
+    """a transaction on the database holding the user's recipes and stats
+
+    Saving a recipe and moving its stats contribution in one of these
+    keeps both or neither.
+    """
+    return transaction.atomic(using=shard_for_user(user.pk, for_write=True))
+
+
+def _locked_stats(user):
+    """the user's stats row, locked for update and created if missing"""
+    rows = RecipeStats.objects.for_user(user).select_for_update()
+    try:
+        with transaction.atomic(using=rows.db):
+            return rows.get_or_create(user=user)[0]
+    except IntegrityError:
+        # a concurrent request created the row since the lookup
+        return rows.get()
+
+
+def apply_recipe_changes(user, removed=(), added=()):
+    """takes many recipe snapshots out of and into a user's stats at once"""
+    with atomic_for(user):
+        stats = _locked_stats(user)
+        counters = _load(stats)
+        for snapshot in removed:
+            _apply(stats, counters, snapshot, -1)
+        for snapshot in added:
+            _apply(stats, counters, snapshot, 1)
+        _dump(stats, counters)
+        stats.save()
+
+    return stats
+
+
+def median_price(stats):
+    """returns the median price from the stored price distribution"""
+    if not stats.recipe_count:
+        return None
+    counts = sorted(
+        (int(cents), count)
+        for cents, count in json.loads(stats.price_counts).items()
+    )
+    middle = (stats.recipe_count - 1) // 2
+    wanted = [middle, stats.recipe_count // 2]
+    found = []
+    seen = 0
+    for cents, count in counts:
+        seen += count
+        while wanted and wanted[0] < seen:
+            found.append(cents)
+            wanted.pop(0)
+        if not wanted:
+            break
+
+    return (Decimal(sum(found)) / len(found) / 100).quantize(CENT)
+
+
+def top_counts(raw, count=TOP_COUNT):
+    """returns the (id, count) pairs with the highest counts"""
+    counts = [(int(key), value) for key, value in json.loads(raw).items()]
+
+    return sorted(counts, key=lambda item: (-item[1], item[0]))[:count]
+
+
+def rebuild_stats(users):
+    """recomputes stats from scratch for the given users"""
+    shards = defaultdict(list)
+    for user in users:
+        shards[shard_for_user(user.id, for_write=True)].append(user.id)
+
+    return sum(
+        _rebuild_shard_stats(alias, user_ids)
+        for alias, user_ids in shards.items()
+    )
+
+
+def _rebuild_shard_stats(alias, user_ids):
+    stats = {
+        user_id: (RecipeStats(user_id=user_id), _load(RecipeStats()))
+        for user_id in user_ids
+    }
+    recipes = Recipe.objects.using(alias).filter(
+        user_id__in=user_ids
+    ).values_list('id', 'user_id', 'price', 'time_minutes')
+    snapshots = {}
+    for recipe_id, user_id, price, minutes in recipes.iterator():
+        snapshots[recipe_id] = (user_id, {
+            'cents': to_cents(price),
+            'time': time_bucket(minutes),
+            'tags': [],
+            'ingredients': [],
+        })
+    links = defaultdict(list)
+    for field, key in (('tags', 'tag_id'), ('ingredients', 'ingredient_id')):
+        through = getattr(Recipe, field).through.objects.using(alias).filter(
+            recipe__user_id__in=user_ids
+        ).values_list('recipe_id', key)
+        for recipe_id, related_id in through.iterator():
+            links[recipe_id, field].append(related_id)
+    for recipe_id, (user_id, snapshot) in snapshots.items():
+        snapshot['tags'] = links[recipe_id, 'tags']
+        snapshot['ingredients'] = links[recipe_id, 'ingredients']
+        _apply(*stats[user_id], snapshot, 1)
+
+    with transaction.atomic(using=alias):
+        RecipeStats.objects.using(alias).filter(
+            user_id__in=user_ids
+        ).delete()
+        for row, counters in stats.values():
+            _dump(row, counters)
+        RecipeStats.objects.using(alias).bulk_create(
+            row for row, _ in stats.values()
+        )
+
+    return len(stats)
@@ -0,0 +1,155 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.models import Change, ChangeCounter, Ingredient, Recipe, Tag
+from core.sharding import shard_for_user
+
+
+# change log kinds, in the order sync payloads list them
+KINDS = {
+    'recipe': Recipe,
+    'tag': Tag,
+    'ingredient': Ingredient,
+}
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'The cursor is too old, sync again without a cursor.'
+    default_code = 'cursor_expired'
+
+
+def kind_of(instance):
+    """the change log kind of a model instance"""
+    for kind, model in KINDS.items():
+        if isinstance(instance, model):
+            return kind
+
+    raise ValueError(f'{type(instance).__name__} is not synced')
+
+
+def record_changes(user, upserted=(), deleted=()):
+    """appends changes for model instances to the user's change log
+
+    Sequence numbers are taken under a lock on the user's counter row in
+    the same transaction as the entries, so entries become visible in
+    sequence order and a client never skips one.
+    """
+    entries = [
+        (kind_of(instance), instance.pk, Change.UPSERT)
+        for instance in upserted
+    ] + [
+        (kind_of(instance), instance.pk, Change.DELETE)
+        for instance in deleted
+    ]
+    if not entries:
+        return None
+
+    with transaction.atomic(using=shard_for_user(user.pk)):
+        counter, _ = ChangeCounter.objects.for_user(
+            user
+        ).select_for_update().get_or_create(user=user)
+        Change.objects.for_user(user).bulk_create([
+            Change(
+                user=user,
+                seq=counter.last_seq + number,
+                kind=kind,
+                object_id=object_id,
+                action=action
+            )
+            for number, (kind, object_id, action) in enumerate(entries, 1)
+        ])
+        counter.last_seq += len(entries)
+        counter.save(update_fields=['last_seq'])
+
+    return counter.last_seq
+
+
+def latest_seq(user):
+    """the newest sequence number in the user's change log"""
+    counter = ChangeCounter.objects.for_user(user).first()
+
+    return counter.last_seq if counter else 0
+
+
+def cursor_expired(user, cursor):
+    """whether changes after cursor were pruned from the user's log"""
+    counter = ChangeCounter.objects.for_user(user).first()
+
+    return counter is not None and cursor < counter.pruned_seq
+
+
+def prune_changes(before, using=DEFAULT_DB_ALIAS):
+    """deletes change log entries created before a time on one database
+
+    Each user's counter remembers the newest pruned sequence number, so
+    cursors older than it can be told apart from ones that are up to
+    date. Returns the number of entries deleted.
+    """
+    newest_pruned = Change.objects.using(using).filter(
+        created_at__lt=before
+    ).values('user_id').annotate(seq=Max('seq')).values_list('user_id', 'seq')
+    pruned = 0
+    for user_id, seq in newest_pruned:
+        with transaction.atomic(using=using):
+            ChangeCounter.objects.using(using).filter(
+                user_id=user_id,
+                pruned_seq__lt=seq
+            ).update(pruned_seq=seq)
+            pruned += Change.objects.using(using).filter(
+                user_id=user_id,
+                seq__lte=seq
+            ).delete()[0]
+
+    return pruned
+
+
+def latest_seqs(user_ids):
+    """{user id: newest sequence number} for those users with changes"""
+    user_ids = list(user_ids)
+    seqs = {}
+    for alias in settings.DATABASE_SHARDS or [DEFAULT_DB_ALIAS]:
+        for start in range(0, len(user_ids), 500):
+            seqs.update(ChangeCounter.objects.using(alias).filter(
+                user_id__in=user_ids[start:start + 500]
+            ).values_list('user_id', 'last_seq'))
+
+    return seqs
+
+
+def entries_since(user, cursor, limit):
+    """the user's first limit (seq, kind, object id, action) after cursor"""
+    return list(
+        Change.objects.for_user(user).filter(
+            seq__gt=cursor
+        ).order_by('seq').values_list('seq', 'kind', 'object_id', 'action')[
+            :limit
+        ]
+    )
+
+
+def changes_since(user, cursor, limit):
+    """the user's changes after cursor, newest action per object
+
+    Returns (upserted ids by kind, deleted ids by kind, next cursor,
+    whether more changes follow).
+    """
+    changes = entries_since(user, cursor, limit + 1)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    latest = {}
+    for seq, kind, object_id, action in changes:
+        latest[kind, object_id] = action
+    upserted = {kind: [] for kind in KINDS}
+    deleted = {kind: [] for kind in KINDS}
+    for (kind, object_id), action in latest.items():
+        target = upserted if action == Change.UPSERT else deleted
+        target[kind].append(object_id)
+
+    next_cursor = changes[-1][0] if changes else cursor
+    return upserted, deleted, next_cursor, has_more
@@ -0,0 +1,46 @@
+from core.jobs import task
+from core.models import Recipe
+from core.sharding import shard_for_user
+from recipe import feed, images
+
+
+@task(name='recipe.store_image_metadata')
+def store_image_metadata(user_id, recipe_id, name):
+    """reads the size, format and placeholder of an uploaded image"""
+    alias = shard_for_user(user_id, for_write=True)
+    recipe = Recipe._base_manager.using(alias).filter(
+        id=recipe_id,
+        image=name
+    ).first()
+    if recipe is None:
+        return
+    metadata = images.stored_metadata(name)
+    if metadata is None:
+        return
+    for field, value in metadata.items():
+        setattr(recipe, field, value)
+    recipe.save(update_fields=list(metadata))
+
+
+@task(name='recipe.fan_out')
+def fan_out(recipe_id, author_id):
+    """adds a newly public recipe to its author's followers' feeds"""
+    feed.fan_out(recipe_id, author_id)
+
+
+@task(name='recipe.retract')
+def retract(recipe_id):
+    """removes a recipe made private or deleted from feeds"""
+    feed.retract(recipe_id)
+
+
+@task(name='recipe.follow')
+def follow(follower_id, followee_id):
+    """fills a follower's feed with a newly followed author's recipes"""
+    feed.backfill(follower_id, followee_id)
+
+
+@task(name='recipe.unfollow')
+def unfollow(follower_id, followee_id):
+    """clears an unfollowed author's recipes from a follower's feed"""
+    feed.forget(follower_id, followee_id)
@@ -0,0 +1,160 @@
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Change, ImageBlob, Ingredient, Recipe, \
+                        RecipeIngredient, RecipeStats, Tag
+
+
+CLONE_MANY_URL = reverse('recipe:recipe-clone-many')
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def clone_url(recipe_id):
+    return reverse('recipe:recipe-clone', args=[recipe_id])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeCloneApiTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Dinner')
+        self.ingredient = Ingredient.objects.create(
+            user=self.user,
+            name='Salt'
+        )
+
+    def sample_recipes(self, count):
+        """creates recipes through the API so their stats are counted"""
+        ids = []
+        for number in range(count):
+            response = self.client.post(reverse('recipe:recipe-list'), {
+                'title': f'Soup {number}',
+                'time_minutes': 20,
+                'price': '4.50',
+                'tags': [self.tag.id],
+                'ingredients': [self.ingredient.id],
+            })
+            ids.append(response.data['id'])
+
+        return ids
+
+    def test_clone_recipe(self):
+        """a clone copies fields and links and shares the image"""
+        recipe = Recipe.objects.get(id=self.sample_recipes(1)[0])
+        recipe.image.save('photo.jpg', ContentFile(b'image bytes'))
+
+        response = self.client.post(clone_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        clone = Recipe.objects.get(id=response.data['id'])
+        self.assertNotEqual(clone.id, recipe.id)
+        self.assertEqual(
+            (clone.title, clone.time_minutes, clone.price),
+            (recipe.title, recipe.time_minutes, recipe.price)
+        )
+        self.assertEqual(list(clone.tags.all()), [self.tag])
+        self.assertEqual(list(clone.ingredients.all()), [self.ingredient])
+        self.assertEqual(response.data['tags'], [self.tag.id])
+        self.assertEqual(clone.image.name, recipe.image.name)
+        self.assertEqual(
+            ImageBlob.objects.get(name=recipe.image.name).ref_count,
+            2
+        )
+        stats = RecipeStats.objects.get(user=self.user)
+        self.assertEqual(stats.recipe_count, 2)
+        self.assertIn(f'"{self.tag.id}": 2', stats.tag_counts)
+        self.assertTrue(Change.objects.filter(
+            kind='recipe',
+            object_id=clone.id
+        ).exists())
+
+    def test_clone_copies_amounts(self):
+        """the quantity and unit of each ingredient are copied"""
+        recipe = Recipe.objects.get(id=self.sample_recipes(1)[0])
+        RecipeIngredient.objects.filter(recipe=recipe).update(
+            quantity=2,
+            unit='tsp'
+        )
+
+        response = self.client.post(clone_url(recipe.id))
+
+        self.assertEqual(response.data['ingredient_amounts'], [
+            {'ingredient': self.ingredient.id, 'quantity': '2.000',
+             'unit': 'tsp'},
+        ])
+
+    def test_clone_many_in_constant_queries(self):
+        """batches cost the same number of queries whatever their size"""
+        few = self.sample_recipes(2)
+        many = self.sample_recipes(20)
+
+        with CaptureQueriesContext(connection) as few_queries:
+            response = self.client.post(CLONE_MANY_URL, {'ids': few})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with CaptureQueriesContext(connection) as many_queries:
+            response = self.client.post(CLONE_MANY_URL, {'ids': many})
+
+        self.assertEqual(len(few_queries), len(many_queries))
+        self.assertEqual(
+            [recipe['title'] for recipe in response.data],
+            [f'Soup {number}' for number in range(20)]
+        )
+        self.assertEqual(Recipe.objects.count(), 44)
+        self.assertEqual(
+            Recipe.tags.through.objects.filter(tag=self.tag).count(),
+            44
+        )
+        self.assertEqual(
+            RecipeStats.objects.get(user=self.user).recipe_count,
+            44
+        )
+
+    def test_clone_only_own_recipes(self):
+        """ids of other users' recipes are rejected"""
+        other = get_user_model().objects.create_user(
+            'other@test.com',
+            'password123'
+        )
+        theirs = Recipe.objects.create(
+            user=other,
+            title='Stew',
+            time_minutes=5,
+            price='1.00'
+        )
+        mine = self.sample_recipes(1)
+
+        response = self.client.post(
+            CLONE_MANY_URL,
+            {'ids': mine + [theirs.id]}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(clone_url(theirs.id))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    @override_settings(RECIPE_CLONE_MAX=2)
+    def test_clone_many_limited(self):
+        """a batch may only name so many recipes"""
+        response = self.client.post(
+            CLONE_MANY_URL,
+            {'ids': self.sample_recipes(3)}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
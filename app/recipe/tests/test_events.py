@@ -0,0 +1,228 @@
+import asyncio
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from rest_framework.authtoken.models import Token
+
+from core.models import Change, ChangeCounter, Ingredient, Recipe, \
+                        RecipeIngredient, Tag
+from recipe import events, sync
+
+
+async def call_inline(self, func, *args):
+    """runs database work on the test's thread and transaction"""
+    return func(*args)
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'Soup', 'time_minutes': 10, 'price': '4.00'}
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class ChangeSignalTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+
+    def changes(self):
+        return list(
+            Change.objects.for_user(self.user).order_by('seq').values_list(
+                'kind',
+                'action'
+            )
+        )
+
+    def test_saves_and_deletes_logged(self):
+        """model saves and deletes append to the owner's change log"""
+        recipe = sample_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        tag.delete()
+        recipe.delete()
+
+        self.assertEqual(self.changes(), [
+            ('recipe', Change.UPSERT),
+            ('tag', Change.UPSERT),
+            ('tag', Change.DELETE),
+            ('recipe', Change.DELETE),
+        ])
+
+    def test_links_logged_as_recipe_changes(self):
+        """adding tags from either side logs the recipes as changed"""
+        recipe = sample_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        Change.objects.all().delete()
+
+        recipe.tags.add(tag)
+        RecipeIngredient.objects.set_for_recipe(recipe, {ingredient.id: None})
+        tag.recipe_set.clear()
+
+        changed = Change.objects.for_user(self.user).values_list(
+            'kind',
+            'object_id'
+        )
+        self.assertEqual(list(changed), [('recipe', recipe.id)] * 3)
+
+    def test_names_created_in_bulk_logged(self):
+        """tags inserted by name are logged like created ones"""
+        Tag.objects.get_or_create_names(self.user, ['Vegan', 'Lunch'])
+
+        self.assertEqual(self.changes(), [('tag', Change.UPSERT)] * 2)
+
+    def test_deleting_user_skips_log(self):
+        """deleting a user and their rows logs nothing"""
+        recipe = sample_recipe(self.user)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'))
+
+        self.user.delete()
+
+        self.assertFalse(Change.objects.exists())
+
+
+class BrokerTests(TestCase):
+
+    def test_publish_fans_out_per_user(self):
+        """entries reach only the owner's streams that lack them"""
+        broker = events.Broker(max_backlog=10)
+        first = events.Subscriber(1, 0)
+        second = events.Subscriber(1, 5)
+        other = events.Subscriber(2, 0)
+        for subscriber in (first, second, other):
+            broker.subscribe(subscriber)
+
+        broker.publish(1, [(5, 'tag', 3, 'upsert'), (6, 'tag', 3, 'delete')])
+
+        self.assertEqual(first.queue.qsize(), 2)
+        self.assertEqual(second.queue.qsize(), 1)
+        self.assertTrue(other.queue.empty())
+        self.assertEqual(broker.cursor(1), 6)
+
+    def test_slow_stream_closed(self):
+        """a stream too far behind is dropped and told to close"""
+        broker = events.Broker(max_backlog=2)
+        subscriber = events.Subscriber(1, 0)
+        broker.subscribe(subscriber)
+
+        broker.publish(1, [(seq, 'tag', 1, 'upsert') for seq in (1, 2, 3)])
+
+        self.assertNotIn(1, broker.subscribers)
+        self.assertEqual(subscriber.queue.qsize(), 3)
+        self.assertEqual(subscriber.last_seq, 2)
+
+
+@override_settings(EVENT_STREAM_HEARTBEAT=5)
+@patch.object(events.EventStreamServer, 'call', call_inline)
+class EventStreamServerTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(self.loop.close)
+        self.stream = events.EventStreamServer(poll_interval=60)
+        self.server = self.loop.run_until_complete(
+            self.stream.start('127.0.0.1', 0)
+        )
+        self.addCleanup(self.close_server)
+
+    def close_server(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.run_until_complete(self.stream.close())
+
+    async def connect(self, *headers):
+        host, port = self.server.sockets[0].getsockname()[:2]
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write('\r\n'.join(
+            [f'GET {self.stream.path} HTTP/1.1', 'Host: test'] +
+            list(headers)
+        ).encode() + b'\r\n\r\n')
+        head = await reader.readuntil(b'\r\n\r\n')
+
+        return head.decode(), reader, writer
+
+    async def read_events(self, reader, count):
+        received = []
+        while len(received) < count:
+            block = await asyncio.wait_for(reader.readuntil(b'\n\n'), 5)
+            if block.startswith(b'id:'):
+                received.append(block.decode())
+
+        return received
+
+    def test_token_required(self):
+        """streams need a valid token"""
+        head, _, writer = self.loop.run_until_complete(
+            self.connect('Authorization: Token wrong')
+        )
+        writer.close()
+
+        self.assertIn('401 Unauthorized', head)
+
+    def test_pruned_last_event_id_gone(self):
+        """a Last-Event-ID older than the retained log is refused"""
+        sample_recipe(self.user)
+        ChangeCounter.objects.update(pruned_seq=1)
+
+        head, _, writer = self.loop.run_until_complete(self.connect(
+            f'Authorization: Token {self.token.key}',
+            'Last-Event-ID: 0'
+        ))
+        writer.close()
+
+        self.assertIn('410 Gone', head)
+
+    def test_resume_from_last_event_id(self):
+        """a stream first sends the changes after its Last-Event-ID"""
+        sample_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+
+        async def resume():
+            head, reader, writer = await self.connect(
+                f'Authorization: Token {self.token.key}',
+                'Last-Event-ID: 1'
+            )
+            received = await self.read_events(reader, 1)
+            writer.close()
+            return head, received
+
+        head, received = self.loop.run_until_complete(resume())
+
+        self.assertIn('text/event-stream', head)
+        self.assertEqual(received, [
+            f'id: 2\nevent: change\n'
+            f'data: {{"kind":"tag","id":{tag.id},"action":"upsert"}}\n\n'
+        ])
+
+    def test_live_changes_pushed(self):
+        """changes logged while connected are pushed to the stream"""
+        sample_recipe(self.user)
+
+        async def listen():
+            _, reader, writer = await self.connect(
+                f'Authorization: Token {self.token.key}'
+            )
+            await asyncio.sleep(0)
+            Tag.objects.create(user=self.user, name='Vegan')
+            self.stream.changed(self.user.id)
+            received = await self.read_events(reader, 1)
+            writer.close()
+            return received
+
+        received = self.loop.run_until_complete(listen())
+
+        self.assertTrue(received[0].startswith(
+            f'id: {sync.latest_seq(self.user)}\n'
+        ))
@@ -0,0 +1,189 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import jobs
+from core.models import Follow, Recipe, TimelineEntry
+
+
+FEED_URL = reverse('recipe:feed')
+
+
+def timeline(user):
+    return list(TimelineEntry.objects.for_user(user).order_by(
+        'recipe_id'
+    ).values_list('recipe_id', flat=True))
+
+
+def run_jobs():
+    job = jobs.claim('worker')
+    while job is not None:
+        jobs.run_job(job)
+        job = jobs.claim('worker')
+
+
+class FeedApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+        self.author = get_user_model().objects.create_user(
+            'author@test.com',
+            'password123'
+        )
+
+    def sample_recipe(self, user=None, title='Soup', is_public=True):
+        return Recipe.objects.create(
+            user=user or self.author,
+            title=title,
+            time_minutes=5,
+            price='1.00',
+            is_public=is_public
+        )
+
+    def feed_ids(self, **params):
+        response = self.client.get(FEED_URL, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_public_recipes_fanned_out(self):
+        """followers get the author's public recipes, newest first"""
+        Follow.objects.create(follower=self.user, followee=self.author)
+        first = self.sample_recipe(title='Soup')
+        self.sample_recipe(title='Secret', is_public=False)
+        second = self.sample_recipe(title='Stew')
+        run_jobs()
+
+        response = self.client.get(FEED_URL)
+
+        self.assertEqual(
+            [recipe['title'] for recipe in response.data['results']],
+            ['Stew', 'Soup']
+        )
+        self.assertEqual(response.data['results'][0]['user'], self.author.id)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(
+            timeline(self.user),
+            [first.id, second.id]
+        )
+
+    def test_follow_fills_and_unfollow_clears_feed(self):
+        """following adds earlier recipes, unfollowing removes them"""
+        recipe = self.sample_recipe()
+        follow = Follow.objects.create(
+            follower=self.user,
+            followee=self.author
+        )
+        run_jobs()
+        self.assertEqual(self.feed_ids(), [recipe.id])
+
+        follow.delete()
+        run_jobs()
+
+        self.assertEqual(self.feed_ids(), [])
+        self.assertEqual(timeline(self.user), [])
+
+    def test_keyset_pagination(self):
+        """cursors walk the feed without repeats or gaps"""
+        Follow.objects.create(follower=self.user, followee=self.author)
+        recipes = [self.sample_recipe(title=f'Soup {n}') for n in range(5)]
+        run_jobs()
+
+        seen = []
+        params = {'limit': 2}
+        while True:
+            response = self.client.get(FEED_URL, params)
+            seen += [recipe['id'] for recipe in response.data['results']]
+            if response.data['next'] is None:
+                break
+            params['cursor'] = response.data['next']
+
+        self.assertEqual(seen, [recipe.id for recipe in reversed(recipes)])
+        response = self.client.get(FEED_URL, {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+    def test_popular_authors_merged_when_read(self):
+        """authors with many followers are read, not fanned out"""
+        popular = get_user_model().objects.create_user(
+            'popular@test.com',
+            'password123'
+        )
+        fan = get_user_model().objects.create_user(
+            'fan@test.com',
+            'password123'
+        )
+        Follow.objects.create(follower=self.user, followee=self.author)
+        Follow.objects.create(follower=self.user, followee=popular)
+        Follow.objects.create(follower=fan, followee=popular)
+        recipes = [
+            self.sample_recipe(user=popular, title='Pie'),
+            self.sample_recipe(title='Soup'),
+            self.sample_recipe(user=popular, title='Tart'),
+        ]
+        run_jobs()
+
+        self.assertEqual(timeline(self.user), [recipes[1].id])
+        self.assertEqual(
+            self.feed_ids(),
+            [recipe.id for recipe in reversed(recipes)]
+        )
+        first_page = self.client.get(FEED_URL, {'limit': 2}).data
+        self.assertEqual(
+            self.feed_ids(limit=2, cursor=first_page['next']),
+            [recipes[0].id]
+        )
+
+    @override_settings(FEED_TIMELINE_LENGTH=3)
+    def test_timelines_bounded(self):
+        """only the newest recipes are kept in a timeline"""
+        Follow.objects.create(follower=self.user, followee=self.author)
+        recipes = [self.sample_recipe(title=f'Soup {n}') for n in range(5)]
+        run_jobs()
+
+        self.assertEqual(
+            self.feed_ids(),
+            [recipe.id for recipe in reversed(recipes[2:])]
+        )
+
+    def test_private_and_deleted_recipes_leave_feed(self):
+        """unpublished recipes are hidden at once and retracted later"""
+        Follow.objects.create(follower=self.user, followee=self.author)
+        hidden = self.sample_recipe(title='Soup')
+        deleted = self.sample_recipe(title='Stew')
+        kept = self.sample_recipe(title='Pie')
+        run_jobs()
+
+        hidden.is_public = False
+        hidden.save()
+        deleted.delete()
+        self.assertEqual(self.feed_ids(), [kept.id])
+        run_jobs()
+
+        self.assertEqual(timeline(self.user), [kept.id])
+
+    def test_publish_through_api(self):
+        """recipes made public through the API are dated and fanned out"""
+        Follow.objects.create(follower=self.user, followee=self.author)
+        recipe = self.sample_recipe(is_public=False)
+        self.assertIsNone(recipe.published_at)
+        client = APIClient()
+        client.force_authenticate(self.author)
+
+        response = client.patch(
+            reverse('recipe:recipe-detail', args=[recipe.id]),
+            {'is_public': True}
+        )
+        run_jobs()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(response.data['published_at'])
+        self.assertEqual(self.feed_ids(), [recipe.id])
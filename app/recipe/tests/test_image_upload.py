@@ -0,0 +1,201 @@
+import hashlib
+import io
+import shutil
+import tempfile
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from PIL import Image
+
+from core import jobs, objectstore
+from core.models import ImageBlob, Recipe
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def ticket_url(recipe_id):
+    return reverse('recipe:recipe-request-image-upload', args=[recipe_id])
+
+
+def finalize_url(recipe_id):
+    return reverse('recipe:recipe-finalize-image-upload', args=[recipe_id])
+
+
+def png_bytes(size=(30, 20)):
+    output = io.BytesIO()
+    Image.new('RGB', size, 'blue').save(output, 'PNG')
+
+    return output.getvalue()
+
+
+def describe(data, content_type='image/png'):
+    return {
+        'content_type': content_type,
+        'size': len(data),
+        'sha256': hashlib.sha256(data).hexdigest(),
+    }
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    DEFAULT_FILE_STORAGE='core.storage.ContentAddressedObjectStorage'
+)
+class DirectImageUploadTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            time_minutes=5,
+            price='1.00'
+        )
+
+    def request_ticket(self, data, **overrides):
+        response = self.client.post(
+            ticket_url(self.recipe.id),
+            dict(describe(data), **overrides)
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        return response.data
+
+    def put(self, ticket, data, **headers):
+        """sends data to a presigned URL the way a client would"""
+        headers = dict(ticket['headers'], **headers)
+        url = urlsplit(ticket['url'])
+
+        return APIClient().generic(
+            ticket['method'],
+            f'{url.path}?{url.query}',
+            data,
+            content_type=headers['Content-Type'],
+            HTTP_X_AMZ_CHECKSUM_SHA256=headers['x-amz-checksum-sha256']
+        )
+
+    def finalize(self, ticket):
+        return self.client.post(
+            finalize_url(self.recipe.id),
+            {'token': ticket['token']}
+        )
+
+    def test_upload_then_finalize(self):
+        """an uploaded image is attached and its metadata filled later"""
+        data = png_bytes()
+        ticket = self.request_ticket(data)
+
+        self.assertEqual(self.put(ticket, data).status_code, 200)
+        response = self.finalize(ticket)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image.read(), data)
+        self.assertEqual(self.recipe.image_format, 'png')
+        self.assertEqual(self.recipe.image_bytes, len(data))
+        self.assertIsNone(self.recipe.image_width)
+        self.assertEqual(
+            ImageBlob.objects.get(name=self.recipe.image.name).ref_count,
+            1
+        )
+
+        jobs.run_job(jobs.claim('worker'))
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            (self.recipe.image_width, self.recipe.image_height),
+            (30, 20)
+        )
+        self.assertTrue(self.recipe.image_placeholder)
+
+    def test_store_rejects_other_bytes_or_headers(self):
+        """the presigned URL only takes the described file"""
+        data = png_bytes()
+        ticket = self.request_ticket(data)
+
+        response = self.put(ticket, png_bytes((31, 20))[:len(data)])
+        self.assertEqual(response.status_code, 400)
+        response = self.put(ticket, data, **{'Content-Type': 'image/jpeg'})
+        self.assertEqual(response.status_code, 403)
+        self.assertIsNone(objectstore.store().head(ticket['key']))
+
+    def test_finalize_checks_the_object(self):
+        """missing or mismatched objects are not attached"""
+        data = png_bytes()
+        ticket = self.request_ticket(data)
+
+        response = self.finalize(ticket)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        objectstore.store().put(ticket['key'], data[:-1])
+        response = self.finalize(ticket)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('token', response.data)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    def test_token_bound_to_recipe(self):
+        """a token cannot attach its image to another recipe"""
+        data = png_bytes()
+        ticket = self.request_ticket(data)
+        self.put(ticket, data)
+        other = Recipe.objects.create(
+            user=self.user,
+            title='Stew',
+            time_minutes=5,
+            price='1.00'
+        )
+
+        response = self.client.post(
+            finalize_url(other.id),
+            {'token': ticket['token']}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(
+            finalize_url(self.recipe.id),
+            {'token': ticket['token'][:-1]}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ticket_validated(self):
+        """size, type and checksum are checked before signing"""
+        data = png_bytes()
+        for overrides in (
+            {'size': 21 * 1024 * 1024},
+            {'content_type': 'image/gif'},
+            {'sha256': 'abc'},
+        ):
+            response = self.client.post(
+                ticket_url(self.recipe.id),
+                dict(describe(data), **overrides)
+            )
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_400_BAD_REQUEST,
+                overrides
+            )
+
+    @override_settings(
+        DEFAULT_FILE_STORAGE='core.storage.ContentAddressedStorage'
+    )
+    def test_needs_object_storage(self):
+        """direct uploads are refused without an object store"""
+        response = self.client.post(
+            ticket_url(self.recipe.id),
+            describe(png_bytes())
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
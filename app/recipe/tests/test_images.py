@@ -0,0 +1,323 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from PIL import Image
+
+from core.models import Recipe
+from recipe import images
+from recipe.views import RecipeViewSet
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+CACHE_DIR = tempfile.mkdtemp()
+
+
+def image_url(recipe_id):
+    return reverse('recipe:recipe-image', args=[recipe_id])
+
+
+def upload_url(recipe_id):
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+def jpeg_bytes(size=(400, 200), orientation=None):
+    output = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[images.EXIF_ORIENTATION] = orientation
+    Image.new('RGB', size, 'red').save(output, 'JPEG', exif=exif.tobytes())
+
+    return output.getvalue()
+
+
+def response_image(response):
+    return Image.open(io.BytesIO(b''.join(response.streaming_content)))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_CACHE_DIR=CACHE_DIR)
+class RecipeImageVariantTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, CACHE_DIR, ignore_errors=True)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            time_minutes=5,
+            price='1.00'
+        )
+        self.recipe.image.save('photo.jpg', ContentFile(jpeg_bytes()))
+
+    def test_resize_keeps_aspect_ratio(self):
+        """contain fits the image inside the requested width"""
+        response = self.client.get(
+            image_url(self.recipe.id),
+            {'w': 128, 'dpr': 2}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response_image(response).size, (256, 128))
+
+    def test_cover_crops_and_reencodes(self):
+        """cover fills the box exactly in the requested format"""
+        response = self.client.get(
+            image_url(self.recipe.id),
+            {'w': 64, 'h': 64, 'fit': 'cover', 'fmt': 'png'}
+        )
+
+        self.assertEqual(response['Content-Type'], 'image/png')
+        image = response_image(response)
+        self.assertEqual((image.format, image.size), ('PNG', (64, 64)))
+
+    def test_parameters_outside_allowlist_rejected(self):
+        """sizes, formats and missing dimensions are validated"""
+        for params in ({'w': 100}, {'w': 64, 'fmt': 'gif'}, {'dpr': 2}):
+            response = self.client.get(image_url(self.recipe.id), params)
+
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_400_BAD_REQUEST,
+                params
+            )
+
+    def test_webp_variant(self):
+        """webp variants are served, or rejected where Pillow lacks webp"""
+        response = self.client.get(
+            image_url(self.recipe.id),
+            {'w': 64, 'fmt': 'webp'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response_image(response).format, 'WEBP')
+
+        with patch.object(images.features, 'check', return_value=False):
+            response = self.client.get(
+                image_url(self.recipe.id),
+                {'w': 64, 'fmt': 'webp'}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fmt', response.data)
+
+    def test_recipe_without_image_404(self):
+        """recipes without an image have no variants"""
+        self.recipe.image = None
+        self.recipe.save()
+
+        response = self.client.get(image_url(self.recipe.id), {'w': 64})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_missing_source_404(self):
+        """an image gone from storage is a 404, rendered only once"""
+        os.remove(self.recipe.image.path)
+
+        with patch.object(
+            images,
+            '_render_to_cache',
+            wraps=images._render_to_cache
+        ) as render:
+            response = self.client.get(image_url(self.recipe.id), {'w': 64})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(render.call_count, 1)
+
+    def test_undecodable_source_422(self):
+        """an image Pillow cannot decode is a 422"""
+        with open(self.recipe.image.path, 'wb') as file:
+            file.write(b'not an image')
+
+        response = self.client.get(image_url(self.recipe.id), {'w': 64})
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+
+    @patch.object(RecipeViewSet, 'latency_budget', 1e-9)
+    def test_variants_not_latency_budgeted(self):
+        """waiting for a resize does not count against the read budget"""
+        response = self.client.get(image_url(self.recipe.id), {'w': 64})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_variant_cached_and_revalidated(self):
+        """a variant is rendered once and its ETag answers with a 304"""
+        with patch.object(images, 'render', wraps=images.render) as render:
+            first = self.client.get(image_url(self.recipe.id), {'w': 64})
+            self.client.get(image_url(self.recipe.id), {'w': 64})
+            response = self.client.get(
+                image_url(self.recipe.id),
+                {'w': 64},
+                HTTP_IF_NONE_MATCH=first['ETag']
+            )
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_concurrent_requests_coalesced(self):
+        """requests for a variant being rendered wait for that render"""
+        started = threading.Event()
+
+        def slow_render(source, variant):
+            started.set()
+            time.sleep(0.2)
+            return jpeg_bytes((64, 32))
+
+        variant = images.Variant(64, None, 1, 'contain', 'jpeg', 85)
+        with patch.object(images, 'render', side_effect=slow_render) as render:
+            with ThreadPoolExecutor(4) as pool:
+                paths = list(pool.map(
+                    lambda _: images.variant_path(
+                        self.recipe.image.name,
+                        variant
+                    ),
+                    range(4)
+                ))
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(len(set(paths)), 1)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeImageMetadataTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            time_minutes=5,
+            price='1.00'
+        )
+
+    def test_blurhash(self):
+        """the hash encodes 4x3 components and the average colour"""
+        image = Image.new('RGB', (40, 20), 'red')
+
+        placeholder, color = images.blurhash(image)
+
+        self.assertEqual(len(placeholder), 2 + 4 + 2 * 11)
+        self.assertEqual(placeholder[0], images.BASE83[3 + 2 * 9])
+        self.assertEqual(placeholder[2:6], images._base83(0xff0000, 4))
+        self.assertEqual(color, '#ff0000')
+
+    def test_upload_stores_metadata(self):
+        """uploads record display size, format and a placeholder"""
+        data = jpeg_bytes((400, 200), orientation=6)
+        image = ContentFile(data, name='photo.jpg')
+
+        response = self.client.post(
+            upload_url(self.recipe.id),
+            {'image': image},
+            format='multipart'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            (self.recipe.image_width, self.recipe.image_height),
+            (200, 400)
+        )
+        self.assertEqual(self.recipe.image_format, 'jpeg')
+        self.assertEqual(self.recipe.image_bytes, len(data))
+        self.assertEqual(self.recipe.image_orientation, 6)
+        self.assertEqual(self.recipe.image_color, '#fe0000')
+        self.assertEqual(
+            response.data['image_placeholder'],
+            self.recipe.image_placeholder
+        )
+
+    def test_backfill_command(self):
+        """images uploaded before metadata existed are filled in"""
+        self.recipe.image.save('photo.jpg', ContentFile(jpeg_bytes()))
+        missing = Recipe.objects.create(
+            user=self.user,
+            title='Stew',
+            time_minutes=5,
+            price='1.00',
+            image='uploads/recipe/gone.jpg'
+        )
+        broken = Recipe.objects.create(
+            user=self.user,
+            title='Salad',
+            time_minutes=5,
+            price='1.00'
+        )
+        broken.image.save('broken.jpg', ContentFile(b'not an image'))
+        out = io.StringIO()
+
+        call_command(
+            'backfill_image_metadata',
+            processes=1,
+            stdout=out,
+            stderr=io.StringIO()
+        )
+
+        self.recipe.refresh_from_db()
+        missing.refresh_from_db()
+        self.assertEqual(
+            (self.recipe.image_width, self.recipe.image_height),
+            (400, 200)
+        )
+        self.assertTrue(self.recipe.image_placeholder)
+        self.assertIsNone(missing.image_width)
+        self.assertIn('1 images, 1 missing, 1 failed', out.getvalue())
+
+
+class DiskCacheTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_least_recently_used_evicted(self):
+        """going over the limit removes the oldest files first"""
+        cache = images.DiskCache(self.directory, max_bytes=250)
+        old = cache.put('aa1', '.jpg', b'x' * 100)
+        os.utime(old, (time.time() - 600, time.time() - 600))
+        recent = cache.put('bb2', '.jpg', b'x' * 100)
+
+        cache.put('cc3', '.jpg', b'x' * 100)
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(recent))
+        self.assertEqual(cache.size, 200)
+
+    def test_hits_refresh_recency(self):
+        """reading an old entry marks it as recently used"""
+        cache = images.DiskCache(self.directory, max_bytes=1000)
+        path = cache.put('aa1', '.jpg', b'x')
+        os.utime(path, (time.time() - 600, time.time() - 600))
+
+        self.assertEqual(cache.get('aa1', '.jpg'), path)
+        self.assertGreater(os.stat(path).st_mtime, time.time() - 60)
+        self.assertIsNone(cache.get('zz9', '.jpg'))
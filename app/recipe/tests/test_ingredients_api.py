@@ -5,7 +5,7 @@ from django.test import TestCase
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Ingredient, Recipe
+from core.models import Ingredient, Recipe, RecipeIngredient
 
 from recipe.serializers import IngredientSerializer
 
@@ -103,7 +103,7 @@ class PrivateIngredientsApiTest(TestCase):
             price=5.55,
             user=self.user
         )
-        recipe.ingredients.add(ingredient1)
+        RecipeIngredient.objects.create(recipe=recipe, ingredient=ingredient1)
 
         response = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
         serializer1 = IngredientSerializer(ingredient1)
@@ -122,14 +122,14 @@ class PrivateIngredientsApiTest(TestCase):
             price=5.55,
             user=self.user
         )
-        recipe1.ingredients.add(ingredient)
+        RecipeIngredient.objects.create(recipe=recipe1, ingredient=ingredient)
         recipe2 = Recipe.objects.create(
             title='pancakes',
             time_minutes=10,
             price=2.55,
             user=self.user
         )
-        recipe2.ingredients.add(ingredient)
+        RecipeIngredient.objects.create(recipe=recipe2, ingredient=ingredient)
 
         response = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
 
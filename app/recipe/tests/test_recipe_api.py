@@ -5,13 +5,15 @@ import os
 from PIL import Image
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Recipe, Tag, Ingredient
+from core.models import Recipe, RecipeIngredient, Tag, Ingredient
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
 
 
@@ -110,7 +112,10 @@ class PrivateRecipeApiTests(TestCase):
         """test viewing a recipe detail page"""
         recipe = sample_recipe(user=self.user)
         recipe.tags.add(sample_tag(user=self.user))
-        recipe.ingredients.add(sample_ingredient(user=self.user))
+        RecipeIngredient.objects.create(
+            recipe=recipe,
+            ingredient=sample_ingredient(user=self.user)
+        )
 
         url = detail_url(recipe.id)
         response = self.client.get(url)
@@ -175,6 +180,93 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(ingredient_one, ingredients)
         self.assertIn(ingredient_two, ingredients)
 
+    def test_create_recipe_with_amounts(self):
+        """ingredients may be given with a quantity and unit"""
+        flour = sample_ingredient(user=self.user, name="Flour")
+        salt = sample_ingredient(user=self.user, name="Salt")
+        payload = {
+            'title': 'Bread',
+            'time_minutes': 90,
+            'price': 2.00,
+            'ingredients': [salt.id],
+            'ingredient_amounts': [
+                {'ingredient': flour.id, 'quantity': '0.5', 'unit': 'kg'},
+            ],
+        }
+
+        response = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            sorted(response.data['ingredients']),
+            sorted([flour.id, salt.id])
+        )
+        amounts = RecipeIngredient.objects.filter(
+            recipe_id=response.data['id']
+        ).order_by('ingredient__name')
+        self.assertEqual(
+            [(row.ingredient, row.quantity, row.unit) for row in amounts],
+            [(flour, Decimal('0.5'), 'kg'), (salt, None, '')]
+        )
+
+    def test_update_keeps_amounts_of_listed_ingredients(self):
+        """ingredients listed by id keep their amounts, others go"""
+        recipe = sample_recipe(user=self.user)
+        flour = sample_ingredient(user=self.user, name="Flour")
+        salt = sample_ingredient(user=self.user, name="Salt")
+        RecipeIngredient.objects.create(
+            recipe=recipe,
+            ingredient=flour,
+            quantity=200,
+            unit='g'
+        )
+        RecipeIngredient.objects.create(recipe=recipe, ingredient=salt)
+
+        response = self.client.patch(
+            detail_url(recipe.id),
+            {'ingredients': [flour.id]},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['ingredient_amounts'], [
+            {'ingredient': flour.id, 'quantity': '200.000', 'unit': 'g'},
+        ])
+
+        self.client.patch(detail_url(recipe.id), {
+            'ingredient_amounts': [{'ingredient': flour.id, 'quantity': 3}],
+        }, format='json')
+        amount = RecipeIngredient.objects.get(recipe=recipe)
+        self.assertEqual((amount.quantity, amount.unit), (3, ''))
+
+    def test_amounts_validated(self):
+        """amounts name the user's ingredients once, in known units"""
+        other_user = get_user_model().objects.create_user(
+            "other@test.com",
+            "password123"
+        )
+        mine = sample_ingredient(user=self.user)
+        theirs = sample_ingredient(user=other_user)
+        for amounts in (
+            [{'ingredient': theirs.id, 'quantity': 1}],
+            [{'ingredient': mine.id}, {'ingredient': mine.id}],
+            [{'ingredient': mine.id, 'quantity': 1, 'unit': 'bushel'}],
+            [{'ingredient': mine.id, 'quantity': -1}],
+        ):
+            response = self.client.post(RECIPES_URL, {
+                'title': 'Stew',
+                'time_minutes': 5,
+                'price': 1.00,
+                'ingredient_amounts': amounts,
+            }, format='json')
+
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_400_BAD_REQUEST,
+                amounts
+            )
+        self.assertFalse(Recipe.objects.exists())
+
     def test_partial_update_recipe(self):
         """Test updating with patch"""
         recipe = sample_recipe(user=self.user)
@@ -216,6 +308,128 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(recipe.time_minutes, payload['time_minutes'])
         self.assertEqual(tags.count(), 0)
 
+    def test_create_recipe_with_other_users_tag(self):
+        """tags owned by another user are rejected"""
+        other_user = get_user_model().objects.create_user(
+            "other@test.com",
+            "password123"
+        )
+        tag = sample_tag(user=other_user)
+        payload = {
+            'title': 'Stolen tag',
+            'time_minutes': 5,
+            'price': 1.00,
+            'tags': [tag.id],
+        }
+
+        response = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_create_recipe_reports_every_invalid_id(self):
+        """all unknown ingredient ids are reported in one error"""
+        ingredient = sample_ingredient(user=self.user)
+        payload = {
+            'title': 'Mystery stew',
+            'time_minutes': 5,
+            'price': 1.00,
+            'ingredients': [ingredient.id, 9998, 9999],
+        }
+
+        response = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('9998, 9999', response.data['ingredients'][0])
+
+    def test_create_recipe_queries_do_not_grow_with_ingredients(self):
+        """ingredient ids are resolved in a constant number of queries"""
+        ingredients = [
+            sample_ingredient(user=self.user, name=f'Ingredient {number}')
+            for number in range(50)
+        ]
+        tag = sample_tag(user=self.user)
+
+        def post(count):
+            return self.client.post(RECIPES_URL, {
+                'title': 'Big salad',
+                'time_minutes': 5,
+                'price': 1.00,
+                'tags': [tag.id],
+                'ingredients': [item.id for item in ingredients[:count]],
+            })
+
+        post(1)
+        with CaptureQueriesContext(connection) as few:
+            post(5)
+        with self.assertNumQueries(len(few)):
+            response = post(50)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['ingredients']), 50)
+
+    def test_create_recipe_with_names(self):
+        """tags and ingredients are found or created by name"""
+        existing = sample_tag(user=self.user, name='Vegan')
+        payload = {
+            'title': 'Dal',
+            'time_minutes': 30,
+            'price': 4.00,
+            'tag_names': ['vegan', 'Indian', ' indian '],
+            'ingredient_names': ['Red  lentils', 'Cumin'],
+        }
+
+        response = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        tags = recipe.tags.order_by('name')
+        self.assertEqual([tag.name for tag in tags], ['Indian', 'Vegan'])
+        self.assertIn(existing, tags)
+        self.assertEqual(
+            sorted(recipe.ingredients.values_list('name', flat=True)),
+            ['Cumin', 'Red lentils']
+        )
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+
+    def test_names_are_not_shared_between_users(self):
+        """a name another user has is created again for this user"""
+        other_user = get_user_model().objects.create_user(
+            "other@test.com",
+            "password123"
+        )
+        theirs = sample_tag(user=other_user, name='Vegan')
+
+        response = self.client.post(RECIPES_URL, {
+            'title': 'Salad',
+            'time_minutes': 5,
+            'price': 1.00,
+            'tag_names': ['Vegan'],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn(theirs.id, response.data['tags'])
+        self.assertTrue(Tag.objects.filter(user=self.user).exists())
+
+    def test_create_recipe_by_name_queries_do_not_grow(self):
+        """new names are created in a constant number of queries"""
+        def post(names):
+            return self.client.post(RECIPES_URL, {
+                'title': 'Big salad',
+                'time_minutes': 5,
+                'price': 1.00,
+                'ingredient_names': names,
+            }, format='json')
+
+        post(['Warm up'])
+        with CaptureQueriesContext(connection) as few:
+            post([f'Few {number}' for number in range(5)])
+        with self.assertNumQueries(len(few)):
+            response = post([f'Many {number}' for number in range(50)])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['ingredients']), 50)
+
 
 class RecipeImageUploadTests(TestCase):
 
@@ -288,8 +502,14 @@ class RecipeImageUploadTests(TestCase):
         recipe_two = sample_recipe(user=self.user, title="salad")
         ingredient_one = sample_ingredient(user=self.user, name="chicken")
         ingredient_two = sample_ingredient(user=self.user, name="fish")
-        recipe_one.ingredients.add(ingredient_one)
-        recipe_two.ingredients.add(ingredient_two)
+        RecipeIngredient.objects.create(
+            recipe=recipe_one,
+            ingredient=ingredient_one
+        )
+        RecipeIngredient.objects.create(
+            recipe=recipe_two,
+            ingredient=ingredient_two
+        )
         recipe_three = sample_recipe(user=self.user, title="tacos")
 
         response = self.client.get(
@@ -0,0 +1,162 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe, RecipeIngredient
+
+
+SHOPPING_LIST_URL = reverse('recipe:recipe-shopping-list')
+
+
+class ShoppingListApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+        self.ingredients = {}
+
+    def sample_recipe(self, title, *amounts, user=None):
+        """creates a recipe needing (name, quantity, unit) amounts"""
+        user = user or self.user
+        recipe = Recipe.objects.create(
+            user=user,
+            title=title,
+            time_minutes=5,
+            price='1.00'
+        )
+        for name, quantity, unit in amounts:
+            if (user.pk, name) not in self.ingredients:
+                self.ingredients[user.pk, name] = Ingredient.objects.create(
+                    user=user,
+                    name=name
+                )
+            RecipeIngredient.objects.create(
+                recipe=recipe,
+                ingredient=self.ingredients[user.pk, name],
+                quantity=quantity,
+                unit=unit
+            )
+
+        return recipe
+
+    def shopping_list(self, recipes):
+        response = self.client.post(
+            SHOPPING_LIST_URL,
+            {'ids': [recipe.id for recipe in recipes]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        return [
+            (item['name'], item['quantity'], item['unit'])
+            for item in response.data
+        ]
+
+    def test_totals_in_common_units(self):
+        """amounts are converted to one unit per dimension and summed"""
+        pancakes = self.sample_recipe(
+            'Pancakes',
+            ('Flour', 1, 'kg'),
+            ('Milk', 1, 'cup'),
+            ('Eggs', 2, ''),
+            ('Salt', None, ''),
+        )
+        bread = self.sample_recipe(
+            'Bread',
+            ('Flour', 500, 'g'),
+            ('Milk', '0.25', 'l'),
+            ('Butter', 2, 'tbsp'),
+        )
+        cake = self.sample_recipe('Cake', ('Butter', 4, 'oz'))
+
+        self.assertEqual(self.shopping_list([pancakes, bread, cake]), [
+            ('Butter', '113.398', 'g'),
+            ('Butter', '29.574', 'ml'),
+            ('Eggs', '2.000', ''),
+            ('Flour', '1500.000', 'g'),
+            ('Milk', '486.588', 'ml'),
+            ('Salt', None, ''),
+        ])
+
+    def test_unmeasured_amounts_not_summed(self):
+        """a total is unknown when any recipe gives no quantity"""
+        soup = self.sample_recipe('Soup', ('Onion', 2, ''), ('Salt', 5, 'g'))
+        stew = self.sample_recipe(
+            'Stew',
+            ('Onion', None, ''),
+            ('Salt', 1, 'tsp')
+        )
+
+        self.assertEqual(self.shopping_list([soup, stew]), [
+            ('Onion', None, ''),
+            ('Salt', '5.000', 'g'),
+            ('Salt', '4.929', 'ml'),
+        ])
+
+    def test_repeated_recipes_counted_again(self):
+        """a recipe planned twice needs twice the ingredients"""
+        soup = self.sample_recipe('Soup', ('Onion', 2, ''))
+        stew = self.sample_recipe('Stew', ('Onion', 1, ''))
+
+        self.assertEqual(
+            self.shopping_list([soup, stew, soup]),
+            [('Onion', '5.000', '')]
+        )
+
+    def test_one_query_whatever_the_number_of_recipes(self):
+        """the totals cost the same for a few recipes or many"""
+        recipes = [
+            self.sample_recipe(
+                f'Soup {number}',
+                ('Onion', 1, ''),
+                (f'Herb {number}', 5, 'g')
+            )
+            for number in range(50)
+        ]
+
+        with CaptureQueriesContext(connection) as few:
+            self.shopping_list(recipes[:5])
+        with self.assertNumQueries(len(few)):
+            items = self.shopping_list(recipes)
+
+        self.assertEqual(len(items), 51)
+        self.assertIn(('Onion', '50.000', ''), items)
+
+    def test_only_own_recipes(self):
+        """recipes of other users are rejected"""
+        other = get_user_model().objects.create_user(
+            'other@test.com',
+            'password123'
+        )
+        theirs = self.sample_recipe('Stew', ('Onion', 1, ''), user=other)
+        mine = self.sample_recipe('Soup', ('Onion', 1, ''))
+
+        response = self.client.post(
+            SHOPPING_LIST_URL,
+            {'ids': [mine.id, theirs.id]},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(SHOPPING_LIST_MAX_RECIPES=2)
+    def test_number_of_recipes_limited(self):
+        """a shopping list may only name so many recipes"""
+        soup = self.sample_recipe('Soup')
+
+        response = self.client.post(
+            SHOPPING_LIST_URL,
+            {'ids': [soup.id] * 3},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
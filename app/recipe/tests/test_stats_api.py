@@ -0,0 +1,163 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.db.models.query import QuerySet
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, RecipeStats, Tag, Ingredient
+from recipe import stats
+
+
+STATS_URL = reverse('recipe:stats')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    """Return recipe detail URL"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+class PublicStatsApiTests(TestCase):
+    """Tests the public stats api"""
+
+    def test_authorization_required(self):
+        """tests that auth is required"""
+        response = APIClient().get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateStatsApiTests(TestCase):
+    """Tests the stats api for an authed user"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(
+            user=self.user,
+            name='Tofu'
+        )
+
+    def create_recipe(self, **params):
+        payload = {'title': 'Soup', 'time_minutes': 10, 'price': '4.00'}
+        payload.update(params)
+        return self.client.post(RECIPES_URL, payload).data
+
+    def test_empty_stats(self):
+        """a user without recipes gets zeroed stats"""
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['recipe_count'], 0)
+        self.assertIsNone(response.data['median_price'])
+        self.assertEqual(response.data['top_tags'], [])
+
+    def test_stats_follow_recipe_writes(self):
+        """creates, updates and deletes are folded into the stats row"""
+        self.create_recipe(price='2.00', tags=[self.tag.id])
+        self.create_recipe(price='4.00', time_minutes=45)
+        third = self.create_recipe(
+            price='9.00',
+            ingredients=[self.ingredient.id]
+        )
+        self.client.patch(detail_url(third['id']), {'price': '6.00'})
+        doomed = self.create_recipe(price='100.00', tags=[self.tag.id])
+        self.client.delete(detail_url(doomed['id']))
+
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.data['recipe_count'], 3)
+        self.assertEqual(response.data['average_price'], '4.00')
+        self.assertEqual(response.data['median_price'], '4.00')
+        self.assertEqual(
+            response.data['time_histogram'],
+            {'0-15': 2, '30-60': 1}
+        )
+        self.assertEqual(
+            response.data['top_tags'],
+            [{'id': self.tag.id, 'name': 'Vegan', 'count': 1}]
+        )
+        self.assertEqual(
+            response.data['top_ingredients'],
+            [{'id': self.ingredient.id, 'name': 'Tofu', 'count': 1}]
+        )
+
+    def test_failed_stats_update_rolls_back_recipe(self):
+        """a recipe is only saved together with its stats contribution"""
+        with patch.object(
+            stats,
+            'apply_recipe_change',
+            side_effect=RuntimeError('stats down')
+        ):
+            with self.assertRaises(RuntimeError):
+                self.create_recipe()
+
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_stats_row_created_concurrently(self):
+        """a stats row created by a racing request is used, not a 500"""
+        RecipeStats.objects.create(user=self.user)
+        get_or_create = QuerySet.get_or_create
+
+        def racing(queryset, **kwargs):
+            if queryset.model is RecipeStats:
+                raise IntegrityError('duplicate key')
+            return get_or_create(queryset, **kwargs)
+
+        with patch.object(QuerySet, 'get_or_create', racing):
+            self.create_recipe(price='3.00')
+
+        self.assertEqual(RecipeStats.objects.get().recipe_count, 1)
+
+    def test_even_count_median(self):
+        """the median of an even count averages the middle prices"""
+        for price in ('1.00', '2.00', '3.00', '10.00'):
+            self.create_recipe(price=price)
+
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.data['median_price'], '2.50')
+
+    def test_read_does_not_scan_recipes(self):
+        """reading stats is a row lookup plus the top-n name lookups"""
+        for _ in range(5):
+            self.create_recipe(tags=[self.tag.id])
+
+        with self.assertNumQueries(2):
+            self.client.get(STATS_URL)
+
+    def test_rebuild_matches_incremental(self):
+        """the rebuild command reproduces the incremental stats"""
+        self.create_recipe(price='3.50', tags=[self.tag.id])
+        self.create_recipe(price='7.25', ingredients=[self.ingredient.id])
+        Recipe.objects.create(
+            user=self.user,
+            title='Imported',
+            time_minutes=200,
+            price='1.25'
+        )
+        incremental = RecipeStats.objects.get(user=self.user)
+        RecipeStats.objects.all().delete()
+
+        call_command('rebuild_recipe_stats', stdout=StringIO())
+
+        rebuilt = RecipeStats.objects.get(user=self.user)
+        self.assertEqual(rebuilt.recipe_count, 3)
+        self.assertEqual(rebuilt.tag_counts, incremental.tag_counts)
+        self.assertEqual(
+            rebuilt.ingredient_counts,
+            incremental.ingredient_counts
+        )
+        self.assertIn('"120+": 1', rebuilt.time_histogram)
@@ -0,0 +1,163 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Change, Recipe, Tag
+
+
+SYNC_URL = reverse('recipe:sync')
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def detail_url(recipe_id):
+    """Return recipe detail URL"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+class PublicSyncApiTests(TestCase):
+    """Tests the public sync api"""
+
+    def test_authorization_required(self):
+        """tests that auth is required"""
+        response = APIClient().get(SYNC_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateSyncApiTests(TestCase):
+    """Tests the sync api for an authed user"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@test.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, **params):
+        payload = {'title': 'Soup', 'time_minutes': 10, 'price': '4.00'}
+        payload.update(params)
+        response = self.client.post(RECIPES_URL, payload, format='json')
+
+        return Recipe.objects.get(id=response.data['id'])
+
+    def sync(self, **params):
+        response = self.client.get(SYNC_URL, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        return response.data
+
+    def test_initial_sync_returns_everything(self):
+        """without a cursor every row and the latest cursor are returned"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        recipe = self.create_recipe(tag_names=['Lunch'])
+
+        data = self.sync()
+
+        self.assertEqual(data['cursor'], 4)
+        self.assertEqual([item['id'] for item in data['recipes']], [recipe.id])
+        self.assertEqual(
+            sorted(item['name'] for item in data['tags']),
+            ['Lunch', 'Vegan']
+        )
+
+    def test_changes_since_cursor(self):
+        """only rows changed after the cursor are returned"""
+        kept = self.create_recipe()
+        gone = self.create_recipe(title='Stew')
+        cursor = self.sync()['cursor']
+
+        self.client.post(TAGS_URL, {'name': 'Vegan'})
+        self.client.patch(
+            detail_url(kept.id),
+            {'title': 'Better soup', 'ingredient_names': ['Leek']},
+            format='json'
+        )
+        self.client.delete(detail_url(gone.id))
+        data = self.sync(cursor=cursor)
+
+        self.assertEqual(
+            [item['title'] for item in data['recipes']],
+            ['Better soup']
+        )
+        self.assertEqual(data['recipes'][0]['ingredients'], [
+            data['ingredients'][0]['id']
+        ])
+        self.assertEqual([item['name'] for item in data['tags']], ['Vegan'])
+        self.assertEqual(data['deleted']['recipes'], [gone.id])
+        self.assertEqual(self.sync(cursor=data['cursor'])['recipes'], [])
+
+    def test_payload_scales_with_changes(self):
+        """queries and payload do not grow with the collection"""
+        for number in range(20):
+            self.create_recipe(title=f'Recipe {number}')
+        cursor = self.sync()['cursor']
+        changed = self.create_recipe(title='New')
+
+        with CaptureQueriesContext(connection) as queries:
+            data = self.sync(cursor=cursor)
+
+        self.assertEqual(
+            [item['id'] for item in data['recipes']],
+            [changed.id]
+        )
+        self.assertLessEqual(len(queries), 6)
+
+    def test_paging(self):
+        """changes past the limit are left for the next page"""
+        cursor = self.sync()['cursor']
+        for number in range(3):
+            self.create_recipe(title=f'Recipe {number}')
+
+        first = self.sync(cursor=cursor, limit=2)
+        second = self.sync(cursor=first['cursor'], limit=2)
+
+        self.assertTrue(first['has_more'])
+        self.assertEqual(len(first['recipes']), 2)
+        self.assertFalse(second['has_more'])
+        self.assertEqual(
+            [item['title'] for item in second['recipes']],
+            ['Recipe 2']
+        )
+
+    def test_invalid_cursor(self):
+        """cursors must be non negative integers"""
+        for cursor in ('abc', '-1'):
+            response = self.client.get(SYNC_URL, {'cursor': cursor})
+
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_400_BAD_REQUEST
+            )
+
+    @override_settings(SYNC_CHANGE_RETENTION=60 * 60)
+    def test_pruned_changes_need_snapshot(self):
+        """cursors older than the retained log are sent back to a snapshot"""
+        old_cursor = self.sync()['cursor']
+        self.create_recipe(title='Old')
+        Change.objects.update(created_at=timezone.now() - timedelta(days=1))
+        cursor = self.sync()['cursor']
+        self.create_recipe(title='New')
+
+        call_command('prune_changes', stdout=StringIO())
+
+        self.assertEqual(Change.objects.count(), 1)
+        response = self.client.get(SYNC_URL, {'cursor': old_cursor})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(
+            [item['title'] for item in self.sync(cursor=cursor)['recipes']],
+            ['New']
+        )
+        self.assertEqual(len(self.sync()['recipes']), 2)
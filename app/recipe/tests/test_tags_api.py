@@ -86,6 +86,15 @@ class PrivateTagsApiTests(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_duplicate_tag_fails(self):
+        """a tag differing only by case from an existing one is rejected"""
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        response = self.client.post(TAGS_URL, {'name': ' VEGAN '})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
     def test_retrieve_only_tags_assigned_to_recipes(self):
         """return only the tags that are actively assigned to a recipe"""
         tag_one = Tag.objects.create(user=self.user, name='Vegan')
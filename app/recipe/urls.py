@@ -11,5 +11,8 @@ router.register('recipes', views.RecipeViewSet)
 app_name = 'recipe'
 
 urlpatterns = [
+    path('stats/', views.RecipeStatsView.as_view(), name='stats'),
+    path('sync/', views.SyncView.as_view(), name='sync'),
+    path('feed/', views.FeedView.as_view(), name='feed'),
     path('', include(router.urls))
 ]
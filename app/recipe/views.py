@@ -1,14 +1,25 @@
-from rest_framework import viewsets, mixins, status
+from concurrent.futures import TimeoutError
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponseNotModified
+
+from rest_framework import viewsets, mixins, status, generics
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from core.models import Tag, Ingredient, Recipe
-from recipe import serializers
+from core.idempotency import idempotent
+from core.timeouts import LatencyBudgetMixin
+from core.models import Tag, Ingredient, Recipe, RecipeStats
+from recipe import cloning, feed, images, serializers, shopping, stats, \
+                   sync
 
 
-class BaseRecipeAttributeViewSet(viewsets.GenericViewSet,
+class BaseRecipeAttributeViewSet(LatencyBudgetMixin,
+                                 viewsets.GenericViewSet,
                                  mixins.ListModelMixin,
                                  mixins.CreateModelMixin):
     """Base viewset for user owned recipe attributes"""
@@ -20,13 +31,15 @@ class BaseRecipeAttributeViewSet(viewsets.GenericViewSet,
         assigned_only = bool(
             int(self.request.query_params.get('assigned_only', 0))
         )
-        queryset = self.queryset
+        queryset = self.queryset.for_user(self.request.user)
         if assigned_only:
             queryset = queryset.filter(recipe__isnull=False)
 
-        return queryset.filter(
-            user=self.request.user
-        ).order_by('-name').distinct()
+        return queryset.order_by('-name').distinct()
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         """creates a new object for teh current auth'd user"""
@@ -45,30 +58,44 @@ class IngredientViewSet(BaseRecipeAttributeViewSet):
     serializer_class = serializers.IngredientSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(LatencyBudgetMixin, viewsets.ModelViewSet):
     """manage recipes in the database"""
+    latency_budget = 2
     serializer_class = serializers.RecipeSerializer
     queryset = Recipe.objects.all()
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
-    def _params_to_ints(self, qs):
+    def _params_to_ints(self, qs, name='ids'):
         """converts list of string id's to integers"""
-        return [int(str_id) for str_id in qs.split(',')]
+        str_ids = qs.split(',')
+        if len(str_ids) > settings.FILTER_MAX_IDS:
+            raise ValidationError({
+                name: f'Filter on at most {settings.FILTER_MAX_IDS} ids.'
+            })
+        try:
+            return [int(str_id) for str_id in str_ids]
+        except ValueError:
+            raise ValidationError({name: 'Ids must be integers.'})
 
     def get_queryset(self):
         """Retrieve only objects for auth'd user"""
         tags = self.request.query_params.get('tags')
         ingredients = self.request.query_params.get('ingredients')
-        queryset = self.queryset
-        if tags:
-            tag_ids = self._params_to_ints(tags)
+        tag_ids = self._params_to_ints(tags, 'tags') if tags else None
+        ingredient_ids = (
+            self._params_to_ints(ingredients, 'ingredients')
+            if ingredients else None
+        )
+        queryset = self.queryset.for_user(self.request.user)
+        if tag_ids:
             queryset = queryset.filter(tags__id__in=tag_ids)
-        if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
+        if ingredient_ids:
             queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+        if self.action == 'list':
+            queryset = queryset.prefetch_related('tags', 'ingredient_amounts')
 
-        return queryset.filter(user=self.request.user)
+        return queryset
 
     def get_serializer_class(self):
         """Return correct serilaizer class"""
@@ -76,14 +103,50 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return serializers.RecipeDetailSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'clone_many':
+            return serializers.RecipeCloneSerializer
+        elif self.action == 'shopping_list':
+            return serializers.ShoppingListSerializer
+        elif self.action == 'request_image_upload':
+            return serializers.ImageUploadSerializer
+        elif self.action == 'finalize_image_upload':
+            return serializers.ImageUploadFinalizeSerializer
 
         return self.serializer_class
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         """create recipes"""
-        serializer.save(user=self.request.user)
+        with stats.atomic_for(self.request.user):
+            recipe = serializer.save(user=self.request.user)
+            stats.apply_recipe_change(
+                self.request.user,
+                new=stats.recipe_snapshot(recipe)
+            )
+
+    def perform_update(self, serializer):
+        """update a recipe and move its stats contribution"""
+        with stats.atomic_for(self.request.user):
+            old = stats.recipe_snapshot(serializer.instance)
+            recipe = serializer.save()
+            stats.apply_recipe_change(
+                self.request.user,
+                old=old,
+                new=stats.recipe_snapshot(recipe)
+            )
+
+    def perform_destroy(self, instance):
+        """delete a recipe and drop its stats contribution"""
+        with stats.atomic_for(self.request.user):
+            old = stats.recipe_snapshot(instance)
+            instance.delete()
+            stats.apply_recipe_change(self.request.user, old=old)
 
     @action(methods=['POST'], detail=True, url_path='upload-image')
+    @idempotent
     def upload_image(self, request, pk=None):
         """Upload an image to a recipe"""
         recipe = self.get_object()
@@ -103,3 +166,275 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    def _cloned(self, clones):
+        """the clones serialized like newly created recipes"""
+        recipes = Recipe.objects.for_user(self.request.user).filter(
+            id__in=[clone.pk for clone in clones]
+        ).prefetch_related('tags', 'ingredient_amounts').in_bulk()
+
+        return serializers.RecipeSerializer(
+            [recipes[clone.pk] for clone in clones],
+            many=True,
+            context=self.get_serializer_context()
+        ).data
+
+    @action(methods=['POST'], detail=True, url_path='clone')
+    @idempotent
+    def clone(self, request, pk=None):
+        """Copy a recipe along with its tags and ingredients"""
+        recipe = self.get_object()
+        clones = cloning.clone_recipes(request.user, [recipe.pk])
+
+        return Response(
+            self._cloned(clones)[0],
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(methods=['POST'], detail=False, url_path='clone')
+    @idempotent
+    def clone_many(self, request):
+        """Copy several recipes along with their tags and ingredients"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        clones = cloning.clone_recipes(
+            request.user,
+            serializer.validated_data['ids']
+        )
+
+        return Response(
+            self._cloned(clones),
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(methods=['POST'], detail=False, url_path='shopping-list')
+    def shopping_list(self, request):
+        """Total up the ingredients of several recipes"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = shopping.shopping_list(
+            request.user,
+            serializer.validated_data['ids']
+        )
+
+        return Response(
+            serializers.ShoppingListItemSerializer(items, many=True).data
+        )
+
+    @action(methods=['POST'], detail=True, url_path='image-upload')
+    def request_image_upload(self, request, pk=None):
+        """Issue a presigned URL to upload the recipe's image to"""
+        recipe = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ticket = images.upload_ticket(recipe, **serializer.validated_data)
+        ticket['url'] = request.build_absolute_uri(ticket['url'])
+
+        return Response(ticket, status=status.HTTP_201_CREATED)
+
+    @action(
+        methods=['POST'],
+        detail=True,
+        url_path='image-upload/finalize'
+    )
+    def finalize_image_upload(self, request, pk=None):
+        """Attach an image uploaded to a presigned URL to the recipe"""
+        recipe = self.get_object()
+        serializer = self.get_serializer(recipe, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe = serializer.save()
+
+        return Response(
+            serializers.RecipeImageSerializer(
+                recipe,
+                context=self.get_serializer_context()
+            ).data,
+            status=status.HTTP_200_OK
+        )
+
+    @action(
+        methods=['GET'],
+        detail=True,
+        url_path='image',
+        latency_budgeted=False
+    )
+    def image(self, request, pk=None):
+        """Serve the recipe's image resized to the query parameters"""
+        recipe = self.get_object()
+        if not recipe.image:
+            raise Http404('The recipe has no image.')
+        params = serializers.ImageVariantSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        variant = params.to_variant()
+
+        etag = f'"{variant.key(recipe.image.name)}"'
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponseNotModified()
+        else:
+            try:
+                file = images.open_variant(recipe.image.name, variant)
+            except TimeoutError:
+                return Response(
+                    {'detail': 'The image is still being resized.'},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': '1'}
+                )
+            except FileNotFoundError:
+                raise Http404('The recipe image is missing.')
+            except images.UnreadableImage:
+                return Response(
+                    {'detail': 'The recipe image cannot be decoded.'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            response = FileResponse(
+                file,
+                content_type=images.CONTENT_TYPES[variant.fmt]
+            )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=86400'
+
+        return response
+
+
+class RecipeStatsView(generics.RetrieveAPIView):
+    """Return the precomputed recipe stats for the auth'd user"""
+    serializer_class = serializers.RecipeStatsSerializer
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get_object(self):
+        """look up the single stats row for the auth'd user"""
+        try:
+            return RecipeStats.objects.for_user(
+                self.request.user
+            ).select_related('user').get()
+        except RecipeStats.DoesNotExist:
+            return RecipeStats(user=self.request.user)
+
+
+class SyncView(LatencyBudgetMixin, APIView):
+    """Return the auth'd user's changes since a cursor
+
+    Without a cursor every recipe, tag and ingredient is returned along
+    with the cursor to send next time. With one, only rows changed after
+    it are returned, and ids of deleted rows are listed under deleted.
+    """
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    serializer_classes = {
+        'recipe': serializers.RecipeSerializer,
+        'tag': serializers.TagSerializer,
+        'ingredient': serializers.IngredientSerializer,
+    }
+
+    def _int_param(self, name, default):
+        try:
+            value = int(self.request.query_params.get(name, default))
+        except ValueError:
+            raise ValidationError({name: 'Must be an integer.'})
+        if value < 0:
+            raise ValidationError({name: 'Must not be negative.'})
+
+        return value
+
+    def get(self, request):
+        user = request.user
+        snapshot = 'cursor' not in request.query_params
+        cursor = self._int_param('cursor', 0)
+        limit = min(
+            self._int_param('limit', settings.SYNC_PAGE_SIZE),
+            settings.SYNC_PAGE_SIZE
+        ) or settings.SYNC_PAGE_SIZE
+        rows = {
+            kind: model.objects.for_user(user)
+            for kind, model in sync.KINDS.items()
+        }
+        rows['recipe'] = rows['recipe'].prefetch_related(
+            'tags',
+            'ingredient_amounts'
+        )
+
+        if not snapshot:
+            if sync.cursor_expired(user, cursor):
+                raise sync.CursorExpired()
+            upserted, deleted, next_cursor, has_more = sync.changes_since(
+                user,
+                cursor,
+                limit
+            )
+            rows = {
+                kind: queryset.filter(id__in=upserted[kind])
+                for kind, queryset in rows.items()
+            }
+        else:
+            next_cursor = sync.latest_seq(user)
+            deleted = {kind: [] for kind in sync.KINDS}
+            has_more = False
+
+        data = {'cursor': next_cursor, 'has_more': has_more}
+        for kind, queryset in rows.items():
+            found = list(queryset)
+            data[f'{kind}s'] = self.serializer_classes[kind](
+                found,
+                many=True
+            ).data
+            if not snapshot:
+                # rows deleted after the changes in this page
+                found_ids = {row.id for row in found}
+                deleted[kind].extend(
+                    object_id for object_id in upserted[kind]
+                    if object_id not in found_ids
+                )
+        data['deleted'] = {
+            f'{kind}s': sorted(ids) for kind, ids in deleted.items()
+        }
+
+        return Response(data)
+
+
+class FeedView(LatencyBudgetMixin, APIView):
+    """Return public recipes of the users the auth'd user follows
+
+    Recipes are newest first. Send the returned next cursor to get the
+    following page; it is null on the last one.
+    """
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def _limit(self):
+        try:
+            limit = int(self.request.query_params.get(
+                'limit',
+                settings.FEED_PAGE_SIZE
+            ))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+        if limit < 0:
+            raise ValidationError({'limit': 'Must not be negative.'})
+
+        return min(limit, settings.FEED_PAGE_SIZE) or settings.FEED_PAGE_SIZE
+
+    def _cursor(self):
+        cursor = self.request.query_params.get('cursor')
+        if cursor is None:
+            return None
+        try:
+            return feed.decode_cursor(cursor)
+        except ValueError:
+            raise ValidationError({'cursor': 'Invalid cursor.'})
+
+    def get(self, request):
+        recipes, next_cursor = feed.read(
+            request.user,
+            self._cursor(),
+            self._limit()
+        )
+
+        return Response({
+            'results': serializers.FeedRecipeSerializer(
+                recipes,
+                many=True,
+                context={'request': request}
+            ).data,
+            'next': next_cursor,
+        })
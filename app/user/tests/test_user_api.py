@@ -2,15 +2,23 @@ from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from core import jobs
+from core.models import Follow
+
 
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
 ME_URL = reverse('user:me')
 
 
+def follow_url(user_id):
+    return reverse('user:follow', args=[user_id])
+
+
 def create_user(**params):
     return get_user_model().objects.create_user(**params)
 
@@ -160,3 +168,53 @@ class PrivateUserApiTest(TestCase):
         self.assertEqual(self.user.email, payload['email'])
         self.assertTrue(self.user.check_password(payload['password']))
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_delete_account(self):
+        """Deleting deactivates the user and queues their data deletion"""
+        Token.objects.create(user=self.user)
+
+        res = self.client.delete(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+
+        jobs.run_job(jobs.claim('worker'))
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+
+    def test_follow_user(self):
+        """Following is counted once and can be undone"""
+        other = create_user(email="other@test.com", password="password123")
+
+        res = self.client.post(follow_url(other.pk))
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        res = self.client.post(follow_url(other.pk))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        other.refresh_from_db()
+        self.assertEqual(other.follower_count, 1)
+        self.assertEqual(list(self.user.following.all()), [other])
+
+        res = self.client.delete(follow_url(other.pk))
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        other.refresh_from_db()
+        self.assertEqual(other.follower_count, 0)
+        self.assertFalse(Follow.objects.exists())
+
+    def test_follow_invalid_user(self):
+        """Users cannot follow themselves or inactive users"""
+        other = create_user(
+            email="other@test.com",
+            password="password123",
+            is_active=False
+        )
+
+        res = self.client.post(follow_url(self.user.pk))
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.post(follow_url(other.pk))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        res = self.client.delete(follow_url(other.pk))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -1,7 +1,16 @@
-from rest_framework import generics, authentication, permissions
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+
+from rest_framework import generics, authentication, permissions, status
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
+from core.models import Follow
+from core.tasks import delete_user_data
 from user.serializers import UserSerializer, AuthTokenSerializer
 
 
@@ -16,8 +25,8 @@ class CreateTokenView(ObtainAuthToken):
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
-    """Creates a get and patch auth endpoint to manage users"""
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
+    """Creates a get, patch and delete auth endpoint to manage users"""
     serializer_class = UserSerializer
     authentication_classes = (authentication.TokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
@@ -25,3 +34,43 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         """retrieve and return authed user"""
         return self.request.user
+
+    def destroy(self, request, *args, **kwargs):
+        """deactivate the user now and delete their data in the background"""
+        user = self.get_object()
+        with transaction.atomic():
+            user.is_active = False
+            user.save(update_fields=['is_active'])
+            Token.objects.filter(user=user).delete()
+            delete_user_data.enqueue({'user_id': user.pk})
+
+        return Response(status=status.HTTP_202_ACCEPTED)
+
+
+class FollowView(generics.GenericAPIView):
+    """Follow or stop following another user's public recipes"""
+    authentication_classes = (authentication.TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    queryset = get_user_model().objects.filter(is_active=True)
+
+    def post(self, request, pk):
+        followee = self.get_object()
+        if followee == request.user:
+            raise ValidationError('Users cannot follow themselves.')
+        _, created = Follow.objects.get_or_create(
+            follower=request.user,
+            followee=followee
+        )
+
+        return Response(
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+    def delete(self, request, pk):
+        get_object_or_404(
+            Follow,
+            follower=request.user,
+            followee_id=pk
+        ).delete()
+
+        return Response(status=status.HTTP_204_NO_CONTENT)